@@ -1,12 +1,13 @@
 import re
-import bcrypt
 import logging
 from flask import Blueprint, request, abort
-from werkzeug.security import check_password_hash
 from bson import ObjectId
 from pymongo import errors as pymongo_errors
 from utils import format_response
-from db import db
+from db import db, on_startup
+from credentials import find_login, login_key
+from sessions import invalidate_account, issue_token
+from passwords import PasswordBusy, busy_response, hash_password, verify_password
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -15,6 +16,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@on_startup
 def create_default_admin():
     """
     Ensures a default admin exists.
@@ -23,16 +25,16 @@ def create_default_admin():
     try:
         default_email = "admin@enoylity.com"
         default_password = "Admin@1234"
-        existing = db.admin.find_one({
-            'email': {'$regex': f'^{re.escape(default_email)}$', '$options': 'i'}
-        })
+        # The email match covers an admin stored before login keys were backfilled
+        existing = db.admin.find_one(
+            {'$or': [{'login_key': login_key(default_email)}, {'email': default_email}]}, {'_id': 1}
+        )
         if not existing:
-            hashed = bcrypt.hashpw(
-                default_password.encode('utf-8'), bcrypt.gensalt()
-            ).decode('utf-8')
+            hashed = hash_password(default_password, 'bcrypt')
             db.admin.insert_one({
                 "adminId": str(ObjectId()),
                 "email": default_email,
+                "login_key": login_key(default_email),
                 "password": hashed
             })
             logger.info("Default admin created.")
@@ -40,8 +42,6 @@ def create_default_admin():
         logger.error("Error creating default admin: %s", e)
 
 
-create_default_admin()
-
 @admin_bp.route("/login", methods=["POST"])
 def login_combined():
     try:
@@ -52,27 +52,34 @@ def login_combined():
         if not email_or_username or not password:
             return format_response(False, "Email/Username and password are required.", None, 400)
 
-        # Attempt Admin login
-        admin = db.admin.find_one({
-            'email': {'$regex': f'^{re.escape(email_or_username)}$', '$options': 'i'}
-        })
-        if admin and bcrypt.checkpw(password.encode('utf-8'), admin['password'].encode('utf-8')):
-            admin.pop('_id', None)
-            admin.pop('password', None)
-            admin['role'] = 'admin'
-            return format_response(True, "Admin login successful.", admin, 200)
-
-        # Attempt Subadmin login
-        sub = db.subadmin.find_one({'username': email_or_username})
-        if sub and check_password_hash(sub['password_hash'], password):
-            sub.pop('_id', None)
-            sub.pop('password_hash', None)
-            sub['role'] = 'subadmin'
-            return format_response(True, "Subadmin login successful.", sub, 200)
+        # Admin email or subadmin username, one indexed lookup (admins first)
+        for account in find_login(email_or_username):
+            if account['role'] == 'admin':
+                ok, new_hash = verify_password(password, account.pop('password'), 'bcrypt')
+                if not ok:
+                    continue
+                if new_hash:
+                    # Stored with an older bcrypt cost: upgrade while we have the password
+                    db.admin.update_one({'adminId': account['adminId']}, {'$set': {'password': new_hash}})
+                account.pop('login_key', None)
+                account['token'] = issue_token('admin', account['adminId'], account.pop('session_version', 0))
+                return format_response(True, "Admin login successful.", account, 200)
+
+            ok, new_hash = verify_password(password, account.pop('password_hash'), 'werkzeug')
+            if not ok:
+                continue
+            if new_hash:
+                db.subadmin.update_one({'subadminId': account['subadminId']}, {'$set': {'password_hash': new_hash}})
+            account.pop('login_key', None)
+            account['token'] = issue_token('subadmin', account['subadminId'], account.pop('session_version', 0))
+            return format_response(True, "Subadmin login successful.", account, 200)
 
         # Invalid credentials
         return format_response(False, "Invalid credentials.", None, 401)
 
+    except PasswordBusy:
+        return busy_response()
+
     except pymongo_errors.PyMongoError as e:
         logger.error("Database error during login: %s", e)
         return format_response(False, "Database error occurred.", None, 500)
@@ -96,9 +103,9 @@ def update_admin():
 
         # Check email uniqueness excluding current admin
         conflict = db.admin.find_one({
-            'email': {'$regex': f'^{re.escape(new_email)}$', '$options': 'i'},
+            'login_key': login_key(new_email),
             'adminId': {'$ne': admin_id}
-        })
+        }, {'_id': 1})
         if conflict:
             return format_response(False, "Another admin with this email already exists.", None, 409)
 
@@ -115,20 +122,25 @@ def update_admin():
             return format_response(False, "Password should not contain 'gmail'.", None, 400)
 
         # Hash and update
-        hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        hashed = hash_password(new_password, 'bcrypt')
         result = db.admin.update_one(
             {'adminId': admin_id},
-            {'$set': {'email': new_email, 'password': hashed}}
+            {'$set': {'email': new_email, 'login_key': login_key(new_email), 'password': hashed},
+             # New password: tokens issued before it stop working
+             '$inc': {'session_version': 1}}
         )
         if result.matched_count == 0:
             abort(404)
+        invalidate_account('admin', admin_id)
 
         updated = db.admin.find_one(
             {'adminId': admin_id},
-            {'_id': 0, 'password': 0, 'password_hash': 0}
+            {'_id': 0, 'password': 0, 'password_hash': 0, 'login_key': 0, 'session_version': 0}
         )
         return format_response(True, "Admin details updated successfully.", updated, 200)
 
+    except PasswordBusy:
+        return busy_response()
     except pymongo_errors.PyMongoError as e:
         logger.error("Database error during update: %s", e)
         return format_response(False, "Database error occurred.", None, 500)
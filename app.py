@@ -7,22 +7,70 @@ from salaryslip import salary_bp
 from invoiceMHD import invoice_bp
 from invoiceEnoylity import invoice_enoylity_bp
 from invoiceEnoylityTech import enoylity_bp
-from settings import settings_bp
+from settings import settings_bp, warm_settings
+from payroll import payroll_bp
+from render_jobs import jobs_bp
+from exports import export_bp
+from pdf_fonts import warm_fonts
+from pdf_assets import warm_assets
+from db import close_client, run_startup_hooks
+from sessions import authenticate
+from json_provider import FastJSONProvider
+from passwords import apply_calibration
 
-app = Flask(__name__)
-CORS(app) 
+# Application factory. Production runs through wsgi.py under gunicorn (see
+# gunicorn.conf.py); ``python app.py`` starts the single-process debug server.
 
 
-app.register_blueprint(admin_bp)
-app.register_blueprint(employee_bp)
-app.register_blueprint(subadmin_bp)
-app.register_blueprint(salary_bp)
-app.register_blueprint(invoice_bp)
-app.register_blueprint(invoice_enoylity_bp)
-app.register_blueprint(enoylity_bp)
-app.register_blueprint(settings_bp)
+def create_app():
+    app = Flask(__name__)
+    # ObjectId / datetime / Decimal aware, orjson-backed (see json_provider.py)
+    app.json = FastJSONProvider(app)
+    CORS(app)
 
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(employee_bp)
+    app.register_blueprint(subadmin_bp)
+    app.register_blueprint(salary_bp)
+    app.register_blueprint(invoice_bp)
+    app.register_blueprint(invoice_enoylity_bp)
+    app.register_blueprint(enoylity_bp)
+    app.register_blueprint(settings_bp)
+    app.register_blueprint(payroll_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(export_bp)
+
+    # Connection check and seeding (default admin) run once per worker process,
+    # on its first request unless the server already ran them after fork
+    @app.before_request
+    def startup():
+        run_startup_hooks()
+
+    # Session token and permission check for every non-public route (see sessions.py)
+    app.before_request(authenticate)
+
+    return app
+
+
+def preload(settings=False):
+    """
+    Warm process-wide caches: Lexend font metrics, decoded logos and, with
+    ``settings``, the invoice / salary settings documents.
+
+    Called in the gunicorn master before workers fork, so they inherit the
+    caches instead of each building its own. The MongoDB client used for the
+    settings is closed again; workers open their own after fork.
+    """
+    warm_fonts()
+    warm_assets()
+    if settings:
+        warm_settings()
+        close_client()
 
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    apply_calibration()
+    app = create_app()
+    preload()
+    run_startup_hooks()
+    app.run(debug=True, port=5000)
@@ -0,0 +1,303 @@
+"""
+Benchmark suite for the PDF generators and the salary tax engine.
+
+Runs every case against an in-memory MongoDB stand-in (mongomock), so no
+database or network is needed:
+
+    pip install -r requirements-bench.txt
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --compare bench.json
+
+Each case reports docs/sec, p50/p99 latency, peak RSS and average output
+size. Results are written as JSON so runs can be compared between commits.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import mongomock
+except ImportError:
+    sys.exit("mongomock is required for the benchmarks: pip install -r requirements-bench.txt")
+
+# Rendered PDFs (payroll case) go to a throwaway store, never the repo's pdf_store/.
+# Set before pdf_store is imported, which reads it once; render processes
+# re-import this module and inherit the parent's store
+if not os.environ.get('BENCH_PDF_STORE'):
+    os.environ['BENCH_PDF_STORE'] = tempfile.mkdtemp(prefix='bench-pdf-store-')
+    atexit.register(shutil.rmtree, os.environ['BENCH_PDF_STORE'], ignore_errors=True)
+os.environ['PDF_STORE_DIR'] = os.environ['BENCH_PDF_STORE']
+
+
+def _accept_bulk_sort(method):
+    """pymongo >= 4.11 passes ``sort`` to bulk builders, which mongomock 4.3 does not take"""
+    def add(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return add
+
+
+def _install_fake_db():
+    """Point the ``db`` connection manager at an in-memory database before the app uses it"""
+    import db
+    builder = mongomock.collection.BulkOperationBuilder
+    builder.add_update = _accept_bulk_sort(builder.add_update)
+    builder.add_replace = _accept_bulk_sort(builder.add_replace)
+    client = mongomock.MongoClient()
+    db.MongoClient = lambda uri, **options: client
+    return db.get_db()
+
+
+# Fonts and logos are referenced relative to the repo root
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+fake_db = _install_fake_db()
+
+from app import create_app  # noqa: E402
+from sessions import issue_token  # noqa: E402
+from salaryslip import SalarySlipGenerator  # noqa: E402
+from invoiceEnoylity import create_invoice, DEFAULT_SETTINGS as ENOYLITY_DEFAULTS  # noqa: E402
+
+
+# ─── Fixture payloads ────────────────────────────────────────────────────────
+
+def salary_employee(i=1):
+    return {
+        "full_name": f"Employee {i:04d}",
+        "emp_no": f"EMP{i:04d}",
+        "designation": "Software Engineer",
+        "department": "Engineering",
+        "doj": "01-04-2021",
+        "bank_account": "123456789012",
+        "pan": "ABCDE1234F",
+        "monthly_salary": 150000,
+        "lop": 1.5,
+        "salary_structure": [
+            {"name": "Basic Pay", "amount": 105000.0},
+            {"name": "House Rent Allowance", "amount": 30000.0},
+            {"name": "Performance Bonus", "amount": 5000.0},
+            {"name": "Overtime Bonus", "amount": 0.0},
+            {"name": "Special Allowance", "amount": 15000.0},
+        ],
+    }
+
+
+def invoice_items(n):
+    return [
+        {"description": f"Video editing package #{i}", "price": 120.5 + i % 7, "quantity": 1 + i % 3}
+        for i in range(n)
+    ]
+
+
+def mhd_payload(n_items):
+    return {
+        "bill_to_name": "Acme Media LLC",
+        "bill_to_address": "42 Market Street, San Francisco, CA",
+        "bill_to_email": "billing@acme.example",
+        "bill_to_phone": "4155550100",
+        "invoice_date": "01-05-2025",
+        "due_date": "15-05-2025",
+        "notes": "Thank you for your business.",
+        "items": invoice_items(n_items),
+        "payment_method": 1,
+    }
+
+
+def llc_payload(n_items):
+    payload = mhd_payload(n_items)
+    payload["note"] = payload.pop("notes")
+    return payload
+
+
+def enoylity_invoice(n_items):
+    items = invoice_items(n_items)
+    subtotal = sum(i["quantity"] * i["price"] for i in items)
+    return {
+        **{k: v for k, v in ENOYLITY_DEFAULTS.items() if k != 'bank_details'},
+        "bank_details": ENOYLITY_DEFAULTS["bank_details"],
+        "invoice_number": "INV00001",
+        "invoice_date": "01-05-2025",
+        "due_date": "15-05-2025",
+        "payment_method_text": "Bank Transfer",
+        "client_name": "Acme Media LLC",
+        "client_address": "42 Market Street\nSan Francisco, CA",
+        "client_email": "billing@acme.example",
+        "client_phone": "4155550100",
+        "items": items,
+        "subtotal": subtotal,
+        "paypal_fee": 0.0,
+        "total": subtotal,
+        "notes": "Thank you for your business.",
+    }
+
+
+def seed_employees(n):
+    fake_db.employees.delete_many({})
+    fake_db.employees.insert_many([
+        {
+            "employeeId": f"EMP{i:04d}",
+            "name": f"Employee {i:04d}",
+            "email": f"employee{i}@enoylity.example",
+            "phone": f"9{i:09d}",
+            "date_of_joining": "2021-04-01",
+            "base_salary": 50000 + i * 10,
+            "annual_salary": (50000 + i * 10) * 12,
+            "department": "Engineering",
+            "designation": "Engineer",
+            "pan_number": "ABCDE1234F",
+            "bank_details": {"account_number": "123456789012"},
+        }
+        for i in range(n)
+    ])
+
+
+# ─── Cases ───────────────────────────────────────────────────────────────────
+
+app = create_app()
+client = app.test_client()
+
+# Routes require a session token; benchmark as an admin
+fake_db.admin.insert_one({"adminId": "bench-admin", "email": "bench@example.com"})
+client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {issue_token('admin', 'bench-admin')}"
+
+
+def case_tax_engine():
+    generator = SalarySlipGenerator(salary_employee(), current_date="30-04-2025", company_settings={})
+    generator.calculate_salary()
+    return 0
+
+
+def case_salary_slip():
+    generator = SalarySlipGenerator(salary_employee(), current_date="30-04-2025")
+    return len(generator.generate_pdf().getvalue())
+
+
+def _post_pdf(url, payload):
+    resp = client.post(url, json=payload)
+    if resp.status_code != 200:
+        raise RuntimeError(f"{url} returned {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+    return len(resp.get_data())
+
+
+def make_cases():
+    """name -> (callable returning output bytes, default iterations, setup)"""
+    return {
+        "tax_engine": (case_tax_engine, 2000, None),
+        "salary_slip": (case_salary_slip, 50, None),
+        "enoylity_create_invoice": (lambda: len(create_invoice(enoylity_invoice(10))), 50, None),
+        "mhd_generate_invoice": (lambda: _post_pdf('/invoiceMHD/generate-invoice', mhd_payload(10)), 50, None),
+        "llc_generate_invoice": (lambda: _post_pdf('/invoiceEnoylityLLC/generate-invoice', llc_payload(10)), 50, None),
+        "enoylity_create_invoice_1000_lines": (lambda: len(create_invoice(enoylity_invoice(1000))), 3, None),
+        "mhd_generate_invoice_1000_lines": (
+            lambda: _post_pdf('/invoiceMHD/generate-invoice', mhd_payload(1000)), 3, None),
+        "llc_generate_invoice_1000_lines": (
+            lambda: _post_pdf('/invoiceEnoylityLLC/generate-invoice', llc_payload(1000)), 3, None),
+        "payroll_run_1000_employees": (
+            lambda: _post_pdf('/payroll/run', {"month": "04-2025"}), 1, lambda: seed_employees(1000)),
+    }
+
+
+# ─── Runner ──────────────────────────────────────────────────────────────────
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_case(func, iterations, setup=None, warmup=1):
+    if setup:
+        setup()
+    for _ in range(warmup):
+        func()
+    timings, sizes = [], []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        sizes.append(func())
+        timings.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return {
+        "iterations": iterations,
+        "docs_per_sec": round(iterations / elapsed, 2),
+        "p50_ms": round(_percentile(timings, 50) * 1000, 2),
+        "p99_ms": round(_percentile(timings, 99) * 1000, 2),
+        "peak_rss_mb": _peak_rss_mb(),
+        "avg_output_bytes": int(sum(sizes) / len(sizes)),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nComparison against {baseline_path} ({baseline.get('commit')})")
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        print(f"  {name:40s} p50 {old['p50_ms']:>9.2f} -> {result['p50_ms']:>9.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    cases = make_cases()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='*', choices=sorted(cases), help="subset of cases to run")
+    parser.add_argument('--iterations', type=int, help="override iterations for every case")
+    parser.add_argument('--skip-large', action='store_true', help="skip the 1,000-line/employee cases")
+    parser.add_argument('--output', help="write results JSON to this path")
+    parser.add_argument('--compare', help="baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    selected = args.cases or list(cases)
+    if args.skip_large:
+        selected = [c for c in selected if '1000' not in c]
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + 'Z',
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": {},
+    }
+    for name in selected:
+        func, iterations, setup = cases[name]
+        result = run_case(func, args.iterations or iterations, setup)
+        report["results"][name] = result
+        print(f"{name:40s} {result['docs_per_sec']:>9.2f} docs/s  p50 {result['p50_ms']:>9.2f} ms  "
+              f"p99 {result['p99_ms']:>9.2f} ms  rss {result['peak_rss_mb']:>7.1f} MB  "
+              f"{result['avg_output_bytes']:>9d} B")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+from db import db
+
+# Login lookup shared by admins and subadmins.
+#
+# Both collections store ``login_key``: the admin email / subadmin username,
+# trimmed and lowercased, under a unique index. A login is one indexed read
+# (admin and subadmin matched in the same aggregation) plus one hash check.
+
+
+def login_key(value):
+    """Normalized form of an email or username, as stored in ``login_key``"""
+    return (value or '').strip().lower()
+
+
+def find_login(identifier):
+    """
+    Accounts whose login matches ``identifier`` (case-insensitive), admins
+    first; each carries ``role`` ('admin' or 'subadmin').
+    """
+    key = login_key(identifier)
+    if not key:
+        return []
+    return list(db.admin.aggregate([
+        {'$match': {'login_key': key}},
+        {'$addFields': {'role': 'admin'}},
+        {'$unionWith': {'coll': 'subadmin', 'pipeline': [
+            {'$match': {'login_key': key}},
+            {'$addFields': {'role': 'subadmin'}},
+        ]}},
+        {'$project': {'_id': 0, 'search': 0}},
+        {'$sort': {'role': 1}},
+    ]))
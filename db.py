@@ -1,29 +1,159 @@
 import os
+import logging
+import threading
 import certifi
 from pymongo import MongoClient
 from dotenv import load_dotenv
 load_dotenv()
 
+# MongoDB connection manager.
+#
+# Nothing connects at import time: the client is created on first use, once
+# per process. A process forked after that (pre-fork servers, render workers)
+# builds its own client instead of sharing the parent's sockets.
+#
+# Seeding and health checks run through startup hooks (``on_startup`` /
+# ``run_startup_hooks``) rather than as import side effects.
+
+logger = logging.getLogger(__name__)
+
 # Option A: hard-code (not recommended)
 # uri = "mongodb+srv://Invoice:<db_password>@invoice.nlglhbe.mongodb.net/invoice_db?retryWrites=true&w=majority&appName=Invoice"
 
 # Option B: pull from env var (best practice)
 uri = os.getenv("MONGODB_URI")
+DB_NAME = os.getenv("MONGODB_DB", "invoice_db")
+
+# Pool sizing and timeouts (per process)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", 300000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+# Wire compression in order of preference; zstd is used only if ``zstandard`` is installed
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,zlib")
+MONGO_ZLIB_LEVEL = int(os.getenv("MONGO_ZLIB_LEVEL", 6))
+# primary | primaryPreferred | secondary | secondaryPreferred | nearest
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+
+
+def _compressors():
+    names = [c.strip() for c in MONGO_COMPRESSORS.split(',') if c.strip()]
+    if 'zstd' in names:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            names.remove('zstd')
+    return names
+
+
+def client_options():
+    return {
+        'tls': True,
+        # certifi’s CA bundle for proper TLS validation
+        'tlsCAFile': certifi.where(),
+        'maxPoolSize': MONGO_MAX_POOL_SIZE,
+        'minPoolSize': MONGO_MIN_POOL_SIZE,
+        'maxIdleTimeMS': MONGO_MAX_IDLE_MS,
+        'connectTimeoutMS': MONGO_CONNECT_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        'socketTimeoutMS': MONGO_SOCKET_TIMEOUT_MS,
+        'waitQueueTimeoutMS': MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        'compressors': _compressors(),
+        'zlibCompressionLevel': MONGO_ZLIB_LEVEL,
+        'readPreference': MONGO_READ_PREFERENCE,
+        # Don't start monitoring threads until the first operation
+        'connect': False,
+    }
+
+
+def get_client():
+    """The MongoClient for this process, created on first use (and again after fork)"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                # An inherited client belongs to the parent; leave its sockets alone
+                _client = MongoClient(uri, **client_options())
+                _client_pid = pid
+    return _client
+
+
+def get_db():
+    return get_client()[DB_NAME]
+
+
+def close_client():
+    """Close this process's client (e.g. on worker exit)"""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = _client_pid = None
+
+
+class _Lazy:
+    """Module-level stand-in that resolves to the per-process client / database on access"""
+
+    def __init__(self, resolve):
+        self._resolve = resolve
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, name):
+        return self._resolve()[name]
+
+
+# ``from db import db`` keeps working: attribute access goes to the current process's database
+client = _Lazy(get_client)
+db = _Lazy(get_db)
+
+
+# ─── Startup hooks ───────────────────────────────────────────────────────────
+
+_startup_hooks = []
+_started_pid = None
+
+
+def on_startup(func):
+    """Register ``func`` to run once per process from ``run_startup_hooks``"""
+    _startup_hooks.append(func)
+    return func
+
+
+def run_startup_hooks():
+    """Run registered hooks once in this process; a failing hook is logged, not raised"""
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    for hook in _startup_hooks:
+        try:
+            hook()
+        except Exception as e:
+            logger.error("Startup hook %s failed: %s", hook.__name__, e)
 
 
-# Create the client, using certifi’s CA bundle for proper TLS validation
-client = MongoClient(
-    uri,
-    tls=True,
-    tlsCAFile=certifi.where()
-)
+def check_connection():
+    """Ping the deployment; returns True when it answers"""
+    try:
+        get_client().admin.command("ping")
+        logger.info("Connected to MongoDB")
+        return True
+    except Exception as err:
+        logger.error("MongoDB connection error: %s", err)
+        return False
 
-# Select your database
-db = client["invoice_db"]
 
-# Quick ping test
-try:
-    client.admin.command("ping")
-    print("✅ Connected to MongoDB Atlas!")
-except Exception as err:
-    print("❌ Connection error:", err)
\ No newline at end of file
+on_startup(check_connection)
@@ -1,16 +1,29 @@
 from flask import Blueprint, request, send_file, abort, make_response
 from flask_pymongo import PyMongo
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 from db import db
 from utils import format_response
+from sessions import signed_url
 import re
 import math
 import random
 import string
-from salaryslip import SalarySlipGenerator
+from salaryslip import SalarySlipGenerator, render_salary_slip
+from settings import get_current_salary_settings
+from pdf_store import artifact_key, artifact_path, has_pdf, save_pdf
+from search import (
+    EMPLOYEE_SEARCH_FIELDS, AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX, search_document, search_query,
+    ranked_page, ranked_pipeline
+)
+from pagination import ID_ORDER, InvalidCursor, keyset_page, page_with_total, wants_cursor
 import calendar
 import uuid
+import io
+import csv
+import json
 from io import BytesIO
 import os
 
@@ -24,48 +37,45 @@ def generate_unique_employee_id():
         if not db.employees.find_one({"employeeId": emp_id}):
             return emp_id
 
-@employee_bp.route('/SaveRecord', methods=['POST'])
-def add_employee():
-    data = request.get_json(force=True)
+# Required employee fields (now including employeeId)
+REQUIRED_EMPLOYEE_FIELDS = [
+    "employeeId", "name", "email", "phone", "dob",
+    "adharnumber", "pan_number", "date_of_joining",
+    "base_salary", "department", "designation"
+]
 
-    # Required fields (now including employeeId)
-    required = [
-        "employeeId", "name", "email", "phone", "dob",
-        "adharnumber", "pan_number", "date_of_joining", 
-        "base_salary", "department", "designation"
-    ]
-    
-    # Check for missing fields
-    if not all(data.get(field) for field in required):
-        return format_response(False, "Missing required employee details", status=400)
+# Fields that must not repeat across employees
+UNIQUE_EMPLOYEE_FIELDS = ("employeeId", "email", "phone")
+
+# Rows validated, duplicate-checked and inserted together by /employee/import
+EMPLOYEE_IMPORT_BATCH = int(os.getenv("EMPLOYEE_IMPORT_BATCH", 500))
 
-    # Check uniqueness of employeeId, email, or phone
-    if db.employees.find_one({
-        "$or": [
-            {"employeeId": data['employeeId']},
-            {"email": data['email']},
-            {"phone": data['phone']}
-        ]
-    }):
-        return format_response(
-            False,
-            "Employee already exists with this ID, email, or phone number",
-            status=409
-        )
 
+def salary_fields(base_salary):
+    """Stored salary fields derived from the monthly base salary"""
+    base_salary = float(base_salary)
+    return {"base_salary": base_salary, "annual_salary": base_salary * 12}
+
+
+def build_employee_record(data):
+    """
+    Validate a new employee payload and assemble its document.
+
+    Returns (record, None) or (None, error message). Uniqueness is checked by
+    the caller.
+    """
     # Validate date formats
-    for field in ("dob", "date_of_joining"):  
+    for field in ("dob", "date_of_joining"):
         try:
             datetime.strptime(data[field], "%Y-%m-%d")
-        except ValueError:
-            return format_response(False, f"{field} must be YYYY-MM-DD", status=400)
+        except (ValueError, TypeError):
+            return None, f"{field} must be YYYY-MM-DD"
 
     # Parse numeric salary fields
     try:
-        base_salary = float(data['base_salary'])
-        annual_salary = base_salary * 12
+        salary = salary_fields(data['base_salary'])
     except (ValueError, TypeError):
-        return format_response(False, "Salary fields must be numbers", status=400)
+        return None, "Salary fields must be numbers"
 
     # Assemble record using user-provided ID
     record = {
@@ -77,15 +87,39 @@ def add_employee():
         "adharnumber": data['adharnumber'],
         "pan_number": data['pan_number'],
         "date_of_joining": data['date_of_joining'],
-        "base_salary": base_salary,
-        "annual_salary": annual_salary,
+        **salary,
         "bank_details": data.get('bank_details', {}),
         "address": data.get('address', {}),
         "department": data['department'],
         "designation": data['designation'],
         "created_at": datetime.utcnow()
     }
-    
+    record["search"] = search_document(record, EMPLOYEE_SEARCH_FIELDS)
+    return record, None
+
+
+@employee_bp.route('/SaveRecord', methods=['POST'])
+def add_employee():
+    data = request.get_json(force=True)
+
+    # Check for missing fields
+    if not all(data.get(field) for field in REQUIRED_EMPLOYEE_FIELDS):
+        return format_response(False, "Missing required employee details", status=400)
+
+    # Check uniqueness of employeeId, email, or phone
+    if db.employees.find_one({
+        "$or": [{field: data[field]} for field in UNIQUE_EMPLOYEE_FIELDS]
+    }):
+        return format_response(
+            False,
+            "Employee already exists with this ID, email, or phone number",
+            status=409
+        )
+
+    record, error = build_employee_record(data)
+    if error:
+        return format_response(False, error, status=400)
+
     # Insert into the database
     db.employees.insert_one(record)
 
@@ -97,6 +131,155 @@ def add_employee():
     )
 
 
+def _import_format(upload):
+    """'csv' or 'ndjson', from ?format=, the file name or the content type"""
+    fmt = (request.args.get('format') or '').lower()
+    if not fmt:
+        name = (upload.filename if upload else '') or ''
+        ctype = (upload.mimetype if upload else request.mimetype) or ''
+        if name.lower().endswith(('.ndjson', '.jsonl')) or 'ndjson' in ctype or 'jsonl' in ctype:
+            fmt = 'ndjson'
+        elif name.lower().endswith('.csv') or 'csv' in ctype:
+            fmt = 'csv'
+    return fmt if fmt in ('csv', 'ndjson') else None
+
+
+def _nest(row):
+    """CSV columns like ``bank_details.account_number`` become nested fields"""
+    out = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip()
+        if isinstance(value, str):
+            value = value.strip()
+        if '.' in key:
+            parent, child = key.split('.', 1)
+            if value not in (None, ''):
+                out.setdefault(parent, {})[child] = value
+        else:
+            out[key] = value
+    return out
+
+
+def _import_rows(stream, fmt):
+    """Yield (row number, payload or None, parse error) one row at a time"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        for n, row in enumerate(csv.DictReader(text), 1):
+            yield n, _nest(row), None
+        return
+    n = 0
+    for line in text:
+        if not line.strip():
+            continue
+        n += 1
+        try:
+            payload = json.loads(line)
+        except ValueError as e:
+            yield n, None, f"Invalid JSON: {e}"
+            continue
+        if isinstance(payload, dict):
+            yield n, payload, None
+        else:
+            yield n, None, "Each line must be a JSON object"
+
+
+def _import_batch(batch, seen, report):
+    """Duplicate-check one batch of (row, record) against the file and the DB, then insert it"""
+    # One $in query per batch instead of a find_one per row
+    taken = {field: set() for field in UNIQUE_EMPLOYEE_FIELDS}
+    clauses = [{field: {"$in": [r[field] for _n, r in batch]}} for field in UNIQUE_EMPLOYEE_FIELDS]
+    for doc in db.employees.find({"$or": clauses}, {field: 1 for field in UNIQUE_EMPLOYEE_FIELDS}):
+        for field in UNIQUE_EMPLOYEE_FIELDS:
+            if doc.get(field) is not None:
+                taken[field].add(doc[field])
+
+    rows, records = [], []
+    for n, record in batch:
+        clash = next((f for f in UNIQUE_EMPLOYEE_FIELDS if record[f] in taken[f]), None)
+        if clash:
+            report['errors'].append({"row": n, "employeeId": record['employeeId'],
+                                     "error": f"Employee already exists with this {clash}"})
+            continue
+        clash = next((f for f in UNIQUE_EMPLOYEE_FIELDS if record[f] in seen[f]), None)
+        if clash:
+            report['errors'].append({"row": n, "employeeId": record['employeeId'],
+                                     "error": f"Duplicate {clash} earlier in the file"})
+            continue
+        for field in UNIQUE_EMPLOYEE_FIELDS:
+            seen[field].add(record[field])
+        rows.append(n)
+        records.append(record)
+
+    if not records:
+        return
+    try:
+        db.employees.insert_many(records, ordered=False)
+        report['inserted'] += len(records)
+    except BulkWriteError as e:
+        # Unordered: everything except the failed documents was written
+        failed = {err['index']: err.get('errmsg', 'Insert failed') for err in e.details.get('writeErrors', [])}
+        report['inserted'] += len(records) - len(failed)
+        for index, message in sorted(failed.items()):
+            report['errors'].append({"row": rows[index], "employeeId": records[index]['employeeId'],
+                                     "error": message})
+
+
+@employee_bp.route('/import', methods=['POST'])
+def import_employees():
+    """
+    Bulk-create employees from a CSV or NDJSON upload.
+
+    Send the file as multipart field ``file`` or as the raw request body
+    (``?format=csv|ndjson`` when neither the file name nor the content type
+    tells). Rows use the /SaveRecord fields; CSV columns such as
+    ``bank_details.account_number`` fill nested fields. The upload is parsed
+    as a stream and written in batches of EMPLOYEE_IMPORT_BATCH with
+    unordered ``insert_many``; rows that fail validation or clash with an
+    existing employee (or an earlier row) are reported and skipped.
+    """
+    upload = request.files.get('file')
+    fmt = _import_format(upload)
+    if not fmt:
+        return format_response(False, "Upload a .csv or .ndjson file (or pass ?format=csv|ndjson)", status=400)
+
+    report = {"total": 0, "inserted": 0, "errors": []}
+    seen = {field: set() for field in UNIQUE_EMPLOYEE_FIELDS}
+    batch = []
+    try:
+        for n, payload, error in _import_rows(upload.stream if upload else request.stream, fmt):
+            report['total'] += 1
+            if error is None:
+                missing = [f for f in REQUIRED_EMPLOYEE_FIELDS if not payload.get(f)]
+                if missing:
+                    error = f"Missing required employee details: {', '.join(missing)}"
+                elif not all(isinstance(payload[f], (str, int, float)) for f in UNIQUE_EMPLOYEE_FIELDS):
+                    error = "employeeId, email and phone must be plain values"
+                else:
+                    record, error = build_employee_record(payload)
+            if error:
+                report['errors'].append({"row": n, "employeeId": (payload or {}).get('employeeId'), "error": error})
+                continue
+            batch.append((n, record))
+            if len(batch) >= EMPLOYEE_IMPORT_BATCH:
+                _import_batch(batch, seen, report)
+                batch = []
+        if batch:
+            _import_batch(batch, seen, report)
+    except (UnicodeDecodeError, csv.Error) as e:
+        report['errors'].append({"row": report['total'] + 1, "employeeId": None, "error": f"Unreadable file: {e}"})
+
+    report['failed'] = len(report['errors'])
+    report['errors'].sort(key=lambda err: err['row'])
+    return format_response(
+        True,
+        f"Imported {report['inserted']} of {report['total']} employees",
+        report,
+        status=200
+    )
+
+
 @employee_bp.route('/update', methods=['POST'])
 def update_employee():
     data = request.get_json(force=True)
@@ -120,12 +303,102 @@ def update_employee():
                 data[num] = float(data[num])
             except (ValueError, TypeError):
                 return format_response(False, f"{num} must be a number", status=400)
+    # Keep annual_salary in step when only the monthly base changes
+    if "base_salary" in data and "annual_salary" not in data:
+        data.update(salary_fields(data["base_salary"]))
+
+    # Search tokens are derived data; rebuild them when a searchable field changes
+    data.pop('search', None)
+    if any(f in data for f in EMPLOYEE_SEARCH_FIELDS):
+        existing = db.employees.find_one({"employeeId": emp_id}, {f: 1 for f in EMPLOYEE_SEARCH_FIELDS})
+        if not existing:
+            abort(404)
+        data['search'] = search_document({**existing, **data, "employeeId": emp_id}, EMPLOYEE_SEARCH_FIELDS)
 
     result = db.employees.update_one({"employeeId": emp_id}, {"$set": data})
     if not result.matched_count:
         abort(404)
     return format_response(True, "Employee updated successfully", {"employeeId": emp_id}, status=200)
 
+@employee_bp.route('/revise-salaries', methods=['POST'])
+def revise_salaries():
+    """
+    Apply many salary revisions at once.
+
+    Body: {"revisions": [{"employeeId": ..., "base_salary": 50000}
+                         | {"employeeId": ..., "percent_increase": 8}],
+           "dry_run": false}
+
+    Current salaries are read with one query, ``annual_salary`` is derived
+    from the new base, and all changes go out in one unordered ``bulk_write``.
+    With ``dry_run`` the computed changes are returned and nothing is written.
+    """
+    data = request.get_json(force=True) or {}
+    revisions = data.get('revisions')
+    if not isinstance(revisions, list) or not revisions:
+        return format_response(False, "revisions must be a non-empty list", status=400)
+    dry_run = bool(data.get('dry_run'))
+
+    errors, wanted = [], {}
+    for n, rev in enumerate(revisions, 1):
+        emp_id = rev.get('employeeId') if isinstance(rev, dict) else None
+        if not emp_id:
+            errors.append({"row": n, "employeeId": None, "error": "employeeId is required"})
+            continue
+        if emp_id in wanted:
+            errors.append({"row": n, "employeeId": emp_id, "error": "Duplicate revision for this employee"})
+            continue
+        given = [k for k in ('base_salary', 'percent_increase') if rev.get(k) is not None]
+        if len(given) != 1:
+            errors.append({"row": n, "employeeId": emp_id,
+                           "error": "Provide exactly one of base_salary or percent_increase"})
+            continue
+        try:
+            value = float(rev[given[0]])
+        except (ValueError, TypeError):
+            errors.append({"row": n, "employeeId": emp_id, "error": f"{given[0]} must be a number"})
+            continue
+        if given[0] == 'base_salary' and value < 0:
+            errors.append({"row": n, "employeeId": emp_id, "error": "base_salary cannot be negative"})
+            continue
+        wanted[emp_id] = (n, given[0], value)
+
+    current = {
+        emp['employeeId']: emp for emp in db.employees.find(
+            {"employeeId": {"$in": list(wanted)}},
+            {"_id": 0, "employeeId": 1, "name": 1, "base_salary": 1, "annual_salary": 1}
+        )
+    } if wanted else {}
+
+    changes, ops = [], []
+    for emp_id, (n, kind, value) in wanted.items():
+        emp = current.get(emp_id)
+        if not emp:
+            errors.append({"row": n, "employeeId": emp_id, "error": "Employee not found"})
+            continue
+        old_base = float(emp.get('base_salary') or 0)
+        new_base = value if kind == 'base_salary' else round(old_base * (1 + value / 100), 2)
+        if new_base < 0:
+            errors.append({"row": n, "employeeId": emp_id, "error": "Revised base_salary would be negative"})
+            continue
+        fields = salary_fields(new_base)
+        changes.append({
+            "employeeId": emp_id,
+            "name": emp.get('name'),
+            "old_base_salary": old_base,
+            "new_base_salary": fields['base_salary'],
+            "old_annual_salary": emp.get('annual_salary'),
+            "new_annual_salary": fields['annual_salary'],
+        })
+        ops.append(UpdateOne({"employeeId": emp_id}, {"$set": fields}))
+
+    result = {"dry_run": dry_run, "changes": changes, "errors": sorted(errors, key=lambda e: e['row'])}
+    if not dry_run and ops:
+        res = db.employees.bulk_write(ops, ordered=False)
+        result.update(matched=res.matched_count, modified=res.modified_count)
+    message = f"{len(changes)} salary revision(s) " + ("computed" if dry_run else "applied")
+    return format_response(True, message, result, status=200)
+
 @employee_bp.route('/delete', methods=['POST'])
 def delete_employee():
     emp_id = request.get_json(force=True).get('employeeId')
@@ -136,17 +409,18 @@ def delete_employee():
         abort(404)
     return format_response(True, "Employee deleted successfully", status=200)
 
+# Fields hidden from employee responses (search tokens are internal)
+LIST_PROJECTION = {'_id': 0, 'search': 0}
+
 @employee_bp.route('/getrecord', methods=['GET'])
 def get_record():
     emp_id = request.args.get('employeeId')
     if not emp_id:
         return format_response(False, "Query parameter 'employeeId' is required", status=400)
-    emp = db.employees.find_one({"employeeId": emp_id})
+    emp = db.employees.find_one({"employeeId": emp_id}, LIST_PROJECTION)
     if not emp:
         abort(404)
-    # Serialize
     emp['created_at'] = emp['created_at'].isoformat() if emp.get('created_at') else None
-    emp.pop('_id', None)
     return format_response(True, "Employee retrieved successfully", {"employee": emp}, status=200)
 
 @employee_bp.route('/getlist', methods=['POST'])
@@ -155,17 +429,29 @@ def get_all_employees():
     search = (params.get('search') or '').strip()
     page = max(int(params.get('page', 1)), 1)
     size = max(int(params.get('pageSize', 10)), 1)
-    query = {}
-    if search:
-        regex = re.compile(re.escape(search), re.IGNORECASE)
-        query['$or'] = [{'name': regex}, {'email': regex}, {'phone': regex}]
-    total = db.employees.count_documents(query)
+    # Token index lookup (see search.py) instead of a case-insensitive regex scan
+    query = (search_query(search) or {'_id': None}) if search else {}
+
+    # Continuation-token mode: no skip and no count query
+    if wants_cursor(params):
+        try:
+            docs, next_cursor, has_more = keyset_page(db.employees, query, ID_ORDER, size, params.get('cursor'),
+                                                      LIST_PROJECTION)
+        except InvalidCursor:
+            return format_response(False, "Invalid cursor", status=400)
+        return format_response(True, "Employees retrieved successfully", {
+            "employees": docs,
+            "pageSize": size,
+            "next_cursor": next_cursor,
+            "has_more": has_more
+        }, status=200)
+
     skip = (page - 1) * size
-    cursor = db.employees.find(query).skip(skip).limit(size)
-    results = []
-    for e in cursor:
-        e.pop('_id', None)
-        results.append(e)
+    if search:
+        # Best matches first: whole word, then word prefix, then substring
+        results, total = ranked_page(db.employees, query, search, 'name', skip, size, LIST_PROJECTION)
+    else:
+        results, total = page_with_total(db.employees, query, ID_ORDER, skip, size, LIST_PROJECTION)
     total_pages = math.ceil(total / size)
     return format_response(True, "Employees retrieved successfully", {
         "employees": results,
@@ -175,46 +461,52 @@ def get_all_employees():
         "totalPages": total_pages
     }, status=200)
 
-@employee_bp.route('/salaryslip', methods=['POST'])
-def get_salary_slip():
-    data = request.get_json(force=True)
-
-    # 1️⃣ Required fields
-    emp_id = data.get('employeeId') or data.get('employee_id')
-    payslip_month = data.get('month')
-    if not emp_id or not payslip_month:
-        return format_response(
-            False,
-            "Missing required fields: employeeId or month",
-            status=400
-        )
-
-    # 2️⃣ Parse month (MM-YYYY)
+@employee_bp.route('/autocomplete', methods=['GET'])
+def autocomplete_employees():
+    """Prefix suggestions for the employee search box: ?q=<text>&limit=<n>"""
+    q = (request.args.get('q') or '').strip()
     try:
-        month_date = datetime.strptime(payslip_month, "%m-%Y")
+        limit = min(max(int(request.args.get('limit', AUTOCOMPLETE_LIMIT)), 1), AUTOCOMPLETE_MAX)
     except ValueError:
-        return format_response(
-            False,
-            "Invalid month format. Use MM-YYYY",
-            status=400
-        )
+        return format_response(False, "limit must be a number", status=400)
+    query = search_query(q, prefix_only=True)
+    if not query:
+        return format_response(True, "Suggestions retrieved", {"suggestions": []}, status=200)
+    suggestions = list(db.employees.aggregate(ranked_pipeline(
+        query, q, 'name', limit=limit, projection={'_id': 0, 'employeeId': 1, 'name': 1, 'email': 1}
+    )))
+    return format_response(True, "Suggestions retrieved", {"suggestions": suggestions}, status=200)
+
+# Salary components shown on every payslip, in display order
+ALLOWANCE_NAMES = [
+    "Basic Pay",
+    "House Rent Allowance",
+    "Performance Bonus",
+    "Overtime Bonus",
+    "Special Allowance",
+]
+
+
+def payslip_date_str(year, month):
+    """Last day of the pay month as DD-MM-YYYY (the slip's generation date)"""
+    max_days = calendar.monthrange(year, month)[1]
+    return f"{max_days:02d}-{month:02d}-{year}"  # e.g. "30-04-2025"
 
-    # 3️⃣ Lookup employee
-    emp = db.employees.find_one({"employeeId": emp_id})
-    if not emp:
-        abort(404)
 
-    year, month = month_date.year, month_date.month
-    max_days = calendar.monthrange(year, month)[1]
-    date_str = f"{max_days:02d}-{month:02d}-{year}"  # e.g. "30-04-2025"
+def build_salary_snapshot(emp, data):
+    """
+    Build the final salary structure and employee snapshot for a payslip.
 
-    # 4️⃣ Build a map of incoming salary components
+    ``data`` carries the optional per-slip inputs: ``salary_structure``,
+    the ``basic``/``hra``/``overtime``/``bonus``/``others`` overrides and ``lop``.
+    """
+    # Build a map of incoming salary components
     incoming_map = {
         item["name"]: float(item.get("amount", 0))
         for item in data.get("salary_structure", [])
     }
 
-        # 4.1️⃣ Accept common synonyms
+    # Accept common synonyms
     if 'Basic' in incoming_map:
         incoming_map['Basic Pay'] = incoming_map.pop('Basic')
     if 'Other Allowance' in incoming_map:
@@ -236,14 +528,7 @@ def get_salary_slip():
                 # ignore non-numeric override
                 pass
 
-    # 5️⃣ Final allowance list: use incoming_map when present, otherwise default
-    allowance_names = [
-        "Basic Pay",
-        "House Rent Allowance",
-        "Performance Bonus",
-        "Overtime Bonus",
-        "Special Allowance",
-    ]
+    # Final allowance list: use incoming_map when present, otherwise default
     base_salary = float(emp.get("base_salary", 0))
     default_map = {
         "Basic Pay": base_salary * 0.7,
@@ -252,13 +537,12 @@ def get_salary_slip():
     }
 
     final = []
-    for name in allowance_names:
+    for name in ALLOWANCE_NAMES:
         amt = incoming_map.get(name)
         if amt is None:
             amt = default_map.get(name, incoming_map.get(name, 0.0))
         final.append({"name": name, "amount": amt})
 
-    # 6️⃣ Build employee snapshot
     emp_snapshot = {
         "full_name": emp["name"],
         "emp_no": emp["employeeId"],
@@ -271,14 +555,18 @@ def get_salary_slip():
         "lop": float(data.get("lop", 0)),
         "salary_structure": final,
     }
+    return final, emp_snapshot
 
-    # 7️⃣ Generate PDF
-    pdf_buf = SalarySlipGenerator(emp_snapshot, current_date=date_str).generate_pdf()
 
-    # 8️⃣ Persist to DB
-    payslip_id = str(uuid.uuid4())
-    db.payslips.insert_one({
-        "payslipId": payslip_id,
+def payslip_pdf_key(emp_snapshot, date_str, company_settings):
+    """Artifact key of a rendered slip: snapshot + slip date + salary settings"""
+    return artifact_key(emp_snapshot, date_str, company_settings)
+
+
+def build_payslip_record(emp_id, year, month, final, emp_snapshot, pdf_key=None):
+    """Assemble the ``payslips`` document stored for a generated slip"""
+    return {
+        "payslipId": str(uuid.uuid4()),
         "employeeId": emp_id,
         "month": month,
         "year": year,
@@ -286,17 +574,100 @@ def get_salary_slip():
         "lop_days": emp_snapshot["lop"],
         "salary_structure": final,
         "emp_snapshot": emp_snapshot,
-        "filename": f"salary_slip_{emp_id}.pdf"
-    })
+        "filename": f"salary_slip_{emp_id}.pdf",
+        "pdf_key": pdf_key
+    }
+
 
-    # 9️⃣ Stream PDF back
+def payslip_period(record):
+    """Unique key of a payslip: one slip per employee per month"""
+    return {"employeeId": record["employeeId"], "year": record["year"], "month": record["month"]}
+
+
+def payslip_update(record):
+    """
+    (filter, update) storing ``record`` as the slip for its period, for an upsert.
+
+    A regenerated slip replaces the stored one but keeps its ``payslipId``, so
+    links handed out earlier stay valid.
+    """
+    fields = {k: v for k, v in record.items() if k != "payslipId"}
+    return payslip_period(record), {"$set": fields, "$setOnInsert": {"payslipId": record["payslipId"]}}
+
+
+def payslip_upsert(record):
+    """``payslip_update`` as a bulk_write op"""
+    return UpdateOne(*payslip_update(record), upsert=True)
+
+
+@employee_bp.route('/salaryslip', methods=['POST'])
+def get_salary_slip():
+    data = request.get_json(force=True)
+
+    # 1️⃣ Required fields
+    emp_id = data.get('employeeId') or data.get('employee_id')
+    payslip_month = data.get('month')
+    if not emp_id or not payslip_month:
+        return format_response(
+            False,
+            "Missing required fields: employeeId or month",
+            status=400
+        )
+
+    # 2️⃣ Parse month (MM-YYYY)
+    try:
+        month_date = datetime.strptime(payslip_month, "%m-%Y")
+    except ValueError:
+        return format_response(
+            False,
+            "Invalid month format. Use MM-YYYY",
+            status=400
+        )
+
+    # 3️⃣ Lookup employee
+    emp = db.employees.find_one({"employeeId": emp_id})
+    if not emp:
+        abort(404)
+
+    year, month = month_date.year, month_date.month
+    date_str = payslip_date_str(year, month)
+
+    # 4️⃣ Build salary structure and employee snapshot
+    final, emp_snapshot = build_salary_snapshot(emp, data)
+
+    # 5️⃣ Same inputs as the stored slip for this month: serve it as is
+    company_settings = get_current_salary_settings()
+    pdf_key = payslip_pdf_key(emp_snapshot, date_str, company_settings)
+    existing = db.payslips.find_one({"employeeId": emp_id, "year": year, "month": month}, {"pdf_key": 1})
+    if existing and existing.get('pdf_key') == pdf_key and has_pdf(pdf_key):
+        return send_file(
+            artifact_path(pdf_key),
+            mimetype="application/pdf",
+            as_attachment=True,
+            download_name=f"salary_slip_{emp_id}.pdf"
+        )
+
+    # 6️⃣ Generate PDF and keep the rendered bytes for later views
+    pdf_bytes = render_salary_slip(emp_snapshot, current_date=date_str, company_settings=company_settings)
+    pdf_key = save_pdf(pdf_key, pdf_bytes)
+
+    # 7️⃣ Persist to DB (one slip per employee and month)
+    record = build_payslip_record(emp_id, year, month, final, emp_snapshot, pdf_key)
+    db.payslips.update_one(*payslip_update(record), upsert=True)
+
+    # 8️⃣ Stream PDF back
     return send_file(
-        pdf_buf,
+        BytesIO(pdf_bytes),
         mimetype="application/pdf",
         as_attachment=True,
         download_name=f"salary_slip_{emp_id}.pdf"
     )
 
+def _with_links(payslip):
+    """List entry plus its PDF link (``view_url`` opens in a browser tab without headers)"""
+    return {**payslip, 'download_link': f"/download/{payslip['payslipId']}",
+            'view_url': signed_url(f"/employee/viewpdf/{payslip['payslipId']}")}
+
 @employee_bp.route('/getpayslips', methods=['POST'])
 def get_payslips():
     params = request.get_json(force=True) or {}
@@ -309,9 +680,19 @@ def get_payslips():
         query['year'] = int(params['year'])
     page = max(int(params.get('page', 1)), 1)
     size = max(int(params.get('pageSize', 10)), 1)
-    total = db.payslips.count_documents(query)
-    cursor = db.payslips.find(query, {'_id': 0}).skip((page-1)*size).limit(size)
-    payslips = [{**p, 'download_link': f"/download/{p['payslipId']}"} for p in cursor]
+    if wants_cursor(params):
+        try:
+            docs, next_cursor, has_more = keyset_page(db.payslips, query, ID_ORDER, size, params.get('cursor'),
+                                                      {'_id': 0})
+        except InvalidCursor:
+            return format_response(False, "Invalid cursor", status=400)
+        return format_response(True, "Payslips retrieved successfully", {
+            'payslips': [_with_links(p) for p in docs],
+            'pagination': {'pageSize': size, 'next_cursor': next_cursor, 'has_more': has_more}
+        }, status=200)
+
+    cursor, total = page_with_total(db.payslips, query, ID_ORDER, (page-1)*size, size, {'_id': 0})
+    payslips = [_with_links(p) for p in cursor]
     if not payslips:
         return format_response(True, "No payslips found", {
             'payslips': [],
@@ -326,12 +707,41 @@ def get_payslips():
         'pagination': { 'totalRecords': total, 'currentPage': page, 'totalPages': math.ceil(total/size) }
     }, status=200)
 
+def _private_pdf(response, filename):
+    """
+    Payslips carry salary data and keep their payslipId across regeneration:
+    shared caches must not store them and browsers revalidate every time
+    (ETag = pdf_key, so an unchanged slip is a 304).
+    """
+    response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.cache_control.public = False
+    response.cache_control.max_age = None
+    return response
+
 @employee_bp.route('/viewpdf/<payslip_id>', methods=['GET'])
 def view_payslip_pdf(payslip_id):
-    payslip = db.payslips.find_one({"payslipId": payslip_id})
+    # Duplicates removed by migration 003 live on in the archive
+    payslip = db.payslips.find_one({"payslipId": payslip_id}) or db.payslips_archive.find_one({"payslipId": payslip_id})
     if not payslip:
         return format_response(False, "Payslip not found", status=404)
+    filename = payslip.get("filename", "salary_slip.pdf")
+
+    # Serve the PDF stored at generation time (supports Range / conditional requests)
+    pdf_key = payslip.get('pdf_key')
+    if has_pdf(pdf_key):
+        response = send_file(
+            artifact_path(pdf_key),
+            mimetype='application/pdf',
+            as_attachment=False,
+            download_name=filename,
+            conditional=True,
+            etag=pdf_key
+        )
+        return _private_pdf(response, filename)
 
+    # Older payslips have no stored artifact: render once and keep it
     emp_snapshot = payslip.get('emp_snapshot')
     if not emp_snapshot:
         return format_response(False, "Payslip does not contain employee snapshot", status=400)
@@ -341,13 +751,17 @@ def view_payslip_pdf(payslip_id):
         return format_response(False, "Payslip does not have generation date", status=400)
     generated_on_str = generated_on.strftime("%d-%m-%Y")
 
-    pdf_buf = SalarySlipGenerator(emp_snapshot, current_date=generated_on_str).generate_pdf()
+    company_settings = get_current_salary_settings()
+    pdf_key = payslip_pdf_key(emp_snapshot, generated_on_str, company_settings)
+    pdf_bytes = render_salary_slip(emp_snapshot, current_date=generated_on_str, company_settings=company_settings)
+    if save_pdf(pdf_key, pdf_bytes):
+        db.payslips.update_one({"payslipId": payslip_id}, {"$set": {"pdf_key": pdf_key}})
+
     response = make_response(send_file(
-        pdf_buf,
+        BytesIO(pdf_bytes),
         mimetype='application/pdf',
-        as_attachment=False
+        as_attachment=False,
+        conditional=True,
+        etag=pdf_key
     ))
-    response.headers['Content-Disposition'] = (
-        f'inline; filename="{payslip.get("filename", "salary_slip.pdf")}"'
-    )
-    return response
+    return _private_pdf(response, filename)
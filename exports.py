@@ -0,0 +1,223 @@
+from flask import Blueprint, request, Response, stream_with_context
+import io
+import os
+import csv
+import json
+from datetime import datetime, timedelta
+
+from db import db
+from utils import format_response
+from employee import ALLOWANCE_NAMES
+from invoice_dates import parse_date
+
+# Bulk exports streamed straight from a Mongo cursor as CSV or NDJSON.
+#
+#   GET /export/invoices?company=mhd,enoylity,llc&from=DD-MM-YYYY&to=DD-MM-YYYY&format=csv
+#   GET /export/payslips?from=DD-MM-YYYY&to=DD-MM-YYYY&employeeId=...&format=ndjson
+#
+# Dates use the same DD-MM-YYYY format as the invoice list filters (invoice_dates.py).
+#
+# Rows are written to the response as the cursor yields them, so memory use
+# does not depend on how many documents match.
+
+export_bp = Blueprint('export', __name__, url_prefix='/export')
+
+# Documents fetched per cursor round trip
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# Bytes buffered before a chunk is sent to the client
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# company -> (collection, label, column -> field path in that collection)
+INVOICE_SOURCES = {
+    'mhd': ('invoiceMHD', 'MHD Tech', {
+        'client_name': 'bill_to.name', 'client_email': 'bill_to.email', 'client_phone': 'bill_to.phone',
+        'client_address': 'bill_to.address', 'subtotal': 'total_amount', 'total': 'total_amount',
+        'payment_method': 'payment_method', 'notes': 'notes',
+    }),
+    'enoylity': ('invoiceEnoylity', 'Enoylity Studio', {
+        'client_name': 'client_name', 'client_email': 'client_email', 'client_phone': 'client_phone',
+        'client_address': 'client_address', 'subtotal': 'subtotal', 'total': 'total',
+        'payment_method': 'payment_method_text', 'notes': 'notes',
+    }),
+    'llc': ('invoiceEnoylityLLC', 'Enoylity Media Creations LLC', {
+        'client_name': 'bill_to.name', 'client_email': 'bill_to.email', 'client_phone': 'bill_to.bt_phone',
+        'client_address': 'bill_to.address', 'subtotal': 'subtotal', 'total': 'total',
+        'payment_method': 'payment_method', 'notes': 'note',
+    }),
+}
+
+# Oldest invoice date first: the invoice_on_desc index walked backwards serves
+# both the date range filter and the sort (no in-memory sort)
+INVOICE_ORDER = [('invoice_on', 1), ('_id', 1)]
+
+INVOICE_COLUMNS = [
+    'company', 'invoice_number', 'invoice_date', 'due_date', 'client_name', 'client_email', 'client_phone',
+    'client_address', 'subtotal', 'total', 'payment_method', 'notes', 'created_at', 'items',
+]
+
+PAYSLIP_COLUMNS = [
+    'payslipId', 'employeeId', 'full_name', 'department', 'designation', 'year', 'month',
+    'lop_days', 'monthly_salary', *ALLOWANCE_NAMES, 'generated_on',
+]
+
+
+def _get(doc, path):
+    for part in path.split('.'):
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return doc
+
+
+def _parse_range():
+    """``from`` / ``to`` query params (DD-MM-YYYY, inclusive) as datetimes; ValueError if malformed"""
+    bounds = []
+    for param in ('from', 'to'):
+        value = request.args.get(param)
+        day = parse_date(value) if value else None
+        if value and day is None:
+            raise ValueError(param)
+        bounds.append(day)
+    start, end = bounds
+    return start, end + timedelta(days=1) if end else None
+
+
+def _invoiced_between(start, end):
+    """Filter on the native invoice date (indexed, see invoice_dates.py)"""
+    bounds = {}
+    if start:
+        bounds['$gte'] = start
+    if end:
+        bounds['$lt'] = end
+    return {'invoice_on': bounds} if bounds else {}
+
+
+def _period_between(start, end):
+    """Filter payslips whose (year, month) falls within [start, end)"""
+    clauses = []
+    if start:
+        clauses.append({'$or': [{'year': {'$gt': start.year}}, {'year': start.year, 'month': {'$gte': start.month}}]})
+    if end:
+        last = end - timedelta(days=1)
+        clauses.append({'$or': [{'year': {'$lt': last.year}}, {'year': last.year, 'month': {'$lte': last.month}}]})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=_json_default, separators=(',', ':'))
+    return '' if value is None else value
+
+
+def stream_rows(rows, columns, fmt, filename):
+    """Response streaming ``rows`` (an iterator of dicts) as CSV or NDJSON"""
+    def generate():
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=columns, extrasaction='ignore') if fmt == 'csv' else None
+        if writer:
+            writer.writeheader()
+        for row in rows:
+            if writer:
+                writer.writerow({k: _cell(v) for k, v in row.items()})
+            else:
+                buf.write(json.dumps(row, default=_json_default, separators=(',', ':')))
+                buf.write('\n')
+            if buf.tell() >= EXPORT_CHUNK_SIZE:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'}
+    )
+
+
+def _export_format():
+    fmt = (request.args.get('format') or 'csv').lower()
+    return fmt if fmt in ('csv', 'ndjson') else None
+
+
+def _invoice_rows(companies, query):
+    for company in companies:
+        collection, label, fields = INVOICE_SOURCES[company]
+        projection = {path.split('.')[0]: 1 for path in fields.values()}
+        projection.update(invoice_number=1, invoice_date=1, due_date=1, created_at=1, items=1)
+        cursor = db[collection].find(query, projection).sort(INVOICE_ORDER).batch_size(EXPORT_BATCH_SIZE)
+        for doc in cursor:
+            row = {'company': label}
+            for column in INVOICE_COLUMNS[1:]:
+                row[column] = _get(doc, fields.get(column, column))
+            # MHD records have no created_at; the ObjectId carries the insert time
+            row['created_at'] = row['created_at'] or doc['_id'].generation_time.replace(tzinfo=None)
+            yield row
+
+
+@export_bp.route('/invoices', methods=['GET'])
+def export_invoices():
+    fmt = _export_format()
+    if not fmt:
+        return format_response(False, "format must be csv or ndjson", status=400)
+    companies = [c.strip().lower() for c in (request.args.get('company') or ','.join(INVOICE_SOURCES)).split(',')
+                 if c.strip()]
+    unknown = [c for c in companies if c not in INVOICE_SOURCES]
+    if unknown or not companies:
+        return format_response(False, f"company must be one or more of: {', '.join(INVOICE_SOURCES)}", status=400)
+    try:
+        start, end = _parse_range()
+    except ValueError:
+        return format_response(False, "from/to must be DD-MM-YYYY", status=400)
+
+    query = _invoiced_between(start, end)
+    return stream_rows(_invoice_rows(companies, query), INVOICE_COLUMNS, fmt, f"invoices_{'_'.join(companies)}")
+
+
+def _payslip_rows(query):
+    projection = {'_id': 0, 'payslipId': 1, 'employeeId': 1, 'year': 1, 'month': 1, 'lop_days': 1,
+                  'salary_structure': 1, 'emp_snapshot': 1, 'generated_on': 1}
+    # Served by the period_employee index: streamed in order, no in-memory sort
+    cursor = db.payslips.find(query, projection).sort([('year', 1), ('month', 1), ('employeeId', 1)])
+    for doc in cursor.batch_size(EXPORT_BATCH_SIZE):
+        snapshot = doc.get('emp_snapshot') or {}
+        row = {
+            'payslipId': doc.get('payslipId'),
+            'employeeId': doc.get('employeeId'),
+            'full_name': snapshot.get('full_name'),
+            'department': snapshot.get('department'),
+            'designation': snapshot.get('designation'),
+            'year': doc.get('year'),
+            'month': doc.get('month'),
+            'lop_days': doc.get('lop_days'),
+            'monthly_salary': snapshot.get('monthly_salary'),
+            'generated_on': doc.get('generated_on'),
+        }
+        for item in doc.get('salary_structure') or []:
+            if item.get('name') in ALLOWANCE_NAMES:
+                row[item['name']] = item.get('amount')
+        yield row
+
+
+@export_bp.route('/payslips', methods=['GET'])
+def export_payslips():
+    fmt = _export_format()
+    if not fmt:
+        return format_response(False, "format must be csv or ndjson", status=400)
+    try:
+        start, end = _parse_range()
+    except ValueError:
+        return format_response(False, "from/to must be DD-MM-YYYY", status=400)
+
+    query = _period_between(start, end)
+    if request.args.get('employeeId'):
+        query = {'$and': [query, {'employeeId': request.args['employeeId']}]} if query else \
+            {'employeeId': request.args['employeeId']}
+    return stream_rows(_payslip_rows(query), PAYSLIP_COLUMNS, fmt, "payslips")
@@ -0,0 +1,74 @@
+import gc
+import os
+import multiprocessing
+
+from db import close_client, run_startup_hooks
+
+# gunicorn settings for wsgi:app. Every value can be overridden with the
+# usual GUNICORN_* / WEB_CONCURRENCY environment variables below.
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', 5000)}")
+
+# One process per core (plus one) so CPU-bound PDF rendering and password
+# hashing use every core; threads cover requests waiting on MongoDB.
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() + 1))
+# gthread by default. "gevent" (install gevent) suits I/O-heavy loads; run it
+# with GUNICORN_PRELOAD=0 so modules are imported after monkey-patching.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Each worker owns a PDF render process pool (see render_jobs.py): split the
+# cores between workers instead of giving each of them one process per core
+os.environ.setdefault("RENDER_WORKERS", str(max(multiprocessing.cpu_count() // workers, 1)))
+
+# Password hashing pools are per worker (see passwords.py): about one hash per
+# core across all workers, and fewer hashing slots than request threads so a
+# worker flooded with logins answers 503 instead of tying up every thread.
+# Explicit environment settings win; the app reads them when it is imported.
+os.environ.setdefault("PASSWORD_WORKERS", str(max(multiprocessing.cpu_count() // workers, 1)))
+if worker_class == "gthread":
+    os.environ.setdefault("PASSWORD_QUEUE_LIMIT",
+                          str(max(threads - 1 - int(os.environ["PASSWORD_WORKERS"]), 0)))
+
+# Recycle workers now and then to bound slow leaks; jitter avoids restarting all at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+# Import the app (and warm fonts, logos, settings) in the master before forking
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+# gunicorn's default format with the path only (%(U)s) instead of the full
+# request line and without the referer: query strings may carry signed
+# download URLs (?sig=, see sessions.py)
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(a)s"'
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    # Pick password hashing costs once, in the master, and hand them to every
+    # worker (PASSWORD_TARGET_MS; no-op when unset)
+    from passwords import apply_calibration
+    apply_calibration()
+
+
+def when_ready(server):
+    # Everything preloaded so far is long-lived: keep the collector from
+    # touching it in workers, which would un-share the copy-on-write pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Per-worker MongoDB client, connection check and seeding, before the
+    # worker accepts its first request
+    run_startup_hooks()
+
+
+def worker_exit(server, worker):
+    close_client()
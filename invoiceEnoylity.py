@@ -2,13 +2,23 @@ from flask import Blueprint, request, send_file
 import io
 import os
 import datetime
-import requests
 from fpdf import FPDF
-from pymongo import ReturnDocument
 
 from utils import format_response
+from pagination import ID_ORDER, InvalidCursor, keyset_page, page_with_total, wants_cursor
+from invoice_dates import BY_INVOICE_DATE, combine, date_filter, native_dates, HIDE_NATIVE
+from pdf_fonts import register_lexend
+from pdf_assets import resolve_asset, place_image
+from invoice_layout import (
+    Text, MarkY, CurY, cell, multi_cell, font, text_color, fill_color, draw_color, set_xy,
+    rect, line, image, mark, keep_on_page, each, when, compile_layout, replay
+)
+from render_jobs import (
+    RenderQueueFull, submit_render, wants_async, queued_response, queue_full_response
+)
 from db import db
 from settings import get_current_settings  # dynamic settings fetch
+from sequences import SequenceAllocator
 
 invoice_enoylity_bp = Blueprint("invoiceEnoylity", __name__, url_prefix="/invoiceEnoylity")
 
@@ -36,28 +46,15 @@ DEFAULT_SETTINGS = {
     }
 }
 
-# Logo handling
-ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
-LOGO_URL = 'https://www.enoylitystudio.com/wp-content/uploads/2024/02/enoylity-final-logo.png'
-LOGO_FILENAME = 'enoylity-final-logo.png'
-LOGO_PATH = os.path.join(ASSETS_DIR, LOGO_FILENAME)
-os.makedirs(ASSETS_DIR, exist_ok=True)
-if not os.path.isfile(LOGO_PATH):
-    try:
-        resp = requests.get(LOGO_URL, timeout=5)
-        resp.raise_for_status()
-        with open(LOGO_PATH, 'wb') as f:
-            f.write(resp.content)
-    except Exception as e:
-        print(f"Warning: could not fetch logo – {e}")
+# Logo (local asset only; rendering never downloads)
+LOGO_FILENAME = os.path.join('assets', 'enoylity-final-logo.png')
 
 class InvoicePDF(FPDF):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.add_font('Lexend', '', os.path.join('static', 'Lexend-Regular.ttf'), uni=True)
-        self.add_font('Lexend', 'B', os.path.join('static', 'Lexend-Bold.ttf'), uni=True)
+        register_lexend(self)
         self.invoice_data = None
-        self.logo_path = LOGO_PATH if os.path.isfile(LOGO_PATH) else None
+        self.logo_path = resolve_asset(LOGO_FILENAME)
         self.light_blue = (235, 244, 255)
         self.dark_blue = (39, 60, 117)
         self.medium_blue = (100, 149, 237)
@@ -67,7 +64,7 @@ class InvoicePDF(FPDF):
             logo_w = 20
             x = self.w - self.r_margin - logo_w
             try:
-                self.image(self.logo_path, x=x, y=8, w=logo_w)
+                place_image(self, self.logo_path, x=x, y=8, w=logo_w)
             except Exception as e:
                 print(f"Failed to add logo to header: {e}")
         if self.invoice_data:
@@ -88,149 +85,21 @@ class InvoicePDF(FPDF):
             self.cell(0, 4, contact, 0, 1, 'C')
 
 
-def create_invoice(invoice_data):
-    pdf = InvoicePDF()
-    pdf.invoice_data = invoice_data
-    pdf.add_page()
-
-    # First-page header
-    pdf.set_fill_color(*pdf.light_blue)
-    pdf.rect(10, 10, 190, 50, 'F')
-    if pdf.logo_path:
-        try:
-            pdf.image(pdf.logo_path, x=0, y=22, w=90)
-        except Exception:
-            pass
-
-    pdf.set_xy(65, 15)
-    pdf.set_font('Lexend', 'B', 20)
-    pdf.set_text_color(*pdf.dark_blue)
-    pdf.cell(130, 12, invoice_data['company_name'], align='R')
-
-    pdf.set_xy(65, 27)
-    pdf.set_font('Lexend', '', 12)
-    pdf.cell(130, 8, invoice_data['company_tagline'], align='R')
+# Settings that shape the compiled layout; everything else is bound per invoice
+LAYOUT_FIELDS = ('company_name', 'company_tagline', 'company_address', 'bank_details')
 
-    pdf.set_xy(65, 35)
-    pdf.set_font('Lexend', '', 8)
-    pdf.multi_cell(130, 4, invoice_data['company_address'], align='R')
+# Items and the blocks below them move to a new page past this distance from the bottom
+BOTTOM_MARGIN = 60
+# Y position content restarts at on continuation pages
+CONTINUED_Y = 35
 
-    # Client & Invoice Details
-    y = 70
-    pdf.set_fill_color(*pdf.light_blue)
-    pdf.rect(10, y, 95, 52, 'F')
-    pdf.set_xy(15, y + 5)
-    pdf.set_font('Lexend', 'B', 11)
-    pdf.set_text_color(*pdf.dark_blue)
-    pdf.cell(85, 6, 'Bill To', ln=1)
-
-    pdf.set_font('Lexend', '', 10)
-    pdf.set_xy(15, y + 13)
-    pdf.multi_cell(75, 5, "\n".join([
-        invoice_data['client_name'],
-        invoice_data['client_address'],
-        invoice_data.get('client_email', ''),
-        invoice_data.get('client_phone', '')
-    ]))
-
-    pdf.rect(115, y, 85, 52, 'F')
-    pdf.set_xy(120, y + 5)
-    pdf.set_font('Lexend', 'B', 11)
-    pdf.set_text_color(*pdf.dark_blue)
-    pdf.cell(75, 6, 'Invoice Details', ln=1)
-
-    pdf.set_font('Lexend', '', 10)
-    for i, (label, key) in enumerate([
-        ("Invoice Number:", 'invoice_number'),
-        ("Bill Date:", 'invoice_date'),
-        ("Due Date:", 'due_date'),
-        ("Payment Method:", 'payment_method_text')
-    ]):
-        pdf.set_xy(120, y + 13 + i*6)
-        pdf.cell(40, 6, label, 0, 0)
-        pdf.cell(35, 6, invoice_data[key], 0, 1)
-
-    # Items table header
-    y = 130
-    pdf.set_fill_color(*pdf.light_blue)
-    pdf.rect(10, y, 190, 12, 'F')
-
-    pdf.set_xy(15, y + 3)
-    pdf.set_font('Lexend', 'B', 10)
-    pdf.set_text_color(*pdf.dark_blue)
-    pdf.cell(90, 6, 'ITEM DESCRIPTION', 0, 0, 'L')
-    pdf.cell(25, 6, 'QTY', 0, 0, 'C')
-    pdf.cell(30, 6, 'PRICE', 0, 0, 'R')
-    pdf.cell(30, 6, 'TOTAL', 0, 1, 'R')
-
-    # Iterate items
-    y = 145
-    bottom_limit = pdf.h - 60
-    pdf.set_font('Lexend', '', 10)
-    pdf.set_text_color(80, 80, 80)
-    running_sub = 0
 
-    for item in invoice_data['items']:
-        if y > bottom_limit:
-            pdf.add_page()
-            y = 35
-        desc = item['description']
-        if len(desc) > 50:
-            desc = desc[:50] + '…'
-        total = item['quantity'] * item['price']
-        running_sub += total
-
-        pdf.set_xy(15, y)
-        pdf.cell(90, 6, desc, 0, 0, 'L')
-        pdf.cell(25, 6, str(item['quantity']), 0, 0, 'C')
-        pdf.cell(30, 6, f"${item['price']:.2f}", 0, 0, 'R')
-        pdf.cell(30, 6, f"${total:.2f}", 0, 1, 'R')
-
-        y += 8
-        pdf.set_draw_color(*pdf.medium_blue)
-        pdf.line(15, y, 190, y)
-        y += 4
-
-    # Summary
-    if y > bottom_limit:
-        pdf.add_page()
-        y = 35
-    y += 10
-    pdf.set_xy(120, y)
-    pdf.set_font('Lexend', '', 10)
-    pdf.set_text_color(*pdf.dark_blue)
-    pdf.cell(40, 8, 'Sub Total', 0, 0)
-    pdf.cell(30, 8, f"${invoice_data['subtotal']:.2f}", 0, 1, 'R')
-
-    if invoice_data.get('paypal_fee', 0) > 0:
-        y += 8
-        pdf.set_xy(120, y)
-        pdf.cell(40, 8, 'PayPal Fee', 0, 0)
-        pdf.cell(30, 8, f"${invoice_data['paypal_fee']:.2f}", 0, 1, 'R')
-
-    line_y = y + (16 if invoice_data.get('paypal_fee',0)>0 else 8)
-    pdf.set_draw_color(*pdf.medium_blue)
-    pdf.line(120, line_y, 190, line_y)
-
-    y = line_y + (8 if invoice_data.get('paypal_fee',0)>0 else 8)
-    pdf.set_xy(120, y)
-    pdf.set_font('Lexend', 'B', 12)
-    pdf.cell(40, 8, 'Grand Total', 0, 0)
-    pdf.cell(30, 8, f"${invoice_data['total']:.2f}", 0, 1, 'R')
-
-    # Bank Details & Notes
-    y += 20
-    if y > bottom_limit:
-        pdf.add_page()
-        y = 35
-
-    pdf.set_xy(10, y)
-    pdf.set_font('Lexend', 'B', 10)
-    pdf.set_text_color(*pdf.dark_blue)
-    pdf.cell(85, 6, 'BANK DETAILS', ln=1)
-
-    bank = invoice_data['bank_details']
-    bank_lines = [
+def invoice_layout(settings, page):
+    """Layout spec for the Enoylity invoice (compiled once per settings version)"""
+    light_blue, dark_blue, medium_blue, grey = (235, 244, 255), (39, 60, 117), (100, 149, 237), (80, 80, 80)
+    bottom_limit = page['h'] - BOTTOM_MARGIN
+    bank = settings['bank_details']
+    bank_lines = "\n".join([
         f"Account name: {bank['account_name']}",
         f"Account Number: {bank['account_number']}",
         f"ACH routing number: {bank['ach_routing_number']}",
@@ -240,34 +109,150 @@ def create_invoice(invoice_data):
         f"Bank name: {bank['bank_name']}",
         f"Bank address: {bank['bank_address']}",
         f"Account Type: {bank['account_type']}"
+    ])
+    y = 70
+
+    return [
+        # First-page header
+        fill_color(light_blue),
+        rect(10, 10, 190, 50, 'F'),
+        image(settings['logo_path'], 0, 22, 90) if settings['logo_path'] else None,
+        set_xy(65, 15), font('B', 20), text_color(dark_blue),
+        cell(130, 12, settings['company_name'], align='R'),
+        set_xy(65, 27), font('', 12),
+        cell(130, 8, settings['company_tagline'], align='R'),
+        set_xy(65, 35), font('', 8),
+        multi_cell(130, 4, settings['company_address'], align='R'),
+
+        # Client & Invoice Details
+        fill_color(light_blue),
+        rect(10, y, 95, 52, 'F'),
+        set_xy(15, y + 5), font('B', 11), text_color(dark_blue),
+        cell(85, 6, 'Bill To', ln=1),
+        font('', 10), set_xy(15, y + 13),
+        multi_cell(75, 5, Text('{bill_to}')),
+
+        rect(115, y, 85, 52, 'F'),
+        set_xy(120, y + 5), font('B', 11), text_color(dark_blue),
+        cell(75, 6, 'Invoice Details', ln=1),
+        font('', 10),
+        [[set_xy(120, y + 13 + i*6), cell(40, 6, label, 0, 0), cell(35, 6, Text(value), 0, 1)]
+         for i, (label, value) in enumerate([
+             ("Invoice Number:", '{invoice_number}'),
+             ("Bill Date:", '{invoice_date}'),
+             ("Due Date:", '{due_date}'),
+             ("Payment Method:", '{payment_method_text}')
+         ])],
+
+        # Items table header
+        fill_color(light_blue),
+        rect(10, 130, 190, 12, 'F'),
+        set_xy(15, 133), font('B', 10), text_color(dark_blue),
+        cell(90, 6, 'ITEM DESCRIPTION', 0, 0, 'L'),
+        cell(25, 6, 'QTY', 0, 0, 'C'),
+        cell(30, 6, 'PRICE', 0, 0, 'R'),
+        cell(30, 6, 'TOTAL', 0, 1, 'R'),
+
+        # Items, one 12pt row each, continuing on new pages
+        mark('row', 145),
+        font('', 10), text_color(grey),
+        each('items',
+             keep_on_page('row', bottom_limit, CONTINUED_Y),
+             set_xy(15, MarkY('row')),
+             cell(90, 6, Text('{description}'), 0, 0, 'L'),
+             cell(25, 6, Text('{quantity}'), 0, 0, 'C'),
+             cell(30, 6, Text('${price:.2f}'), 0, 0, 'R'),
+             cell(30, 6, Text('${total:.2f}'), 0, 1, 'R'),
+             draw_color(medium_blue),
+             line(15, MarkY('row', 8), 190, MarkY('row', 8)),
+             mark('row', MarkY('row', 12))),
+
+        # Summary
+        keep_on_page('row', bottom_limit, CONTINUED_Y),
+        set_xy(120, MarkY('row', 10)), font('', 10), text_color(dark_blue),
+        cell(40, 8, 'Sub Total', 0, 0),
+        cell(30, 8, Text('${subtotal:.2f}'), 0, 1, 'R'),
+        when('paypal_fee', [
+            set_xy(120, MarkY('row', 18)),
+            cell(40, 8, 'PayPal Fee', 0, 0),
+            cell(30, 8, Text('${paypal_fee:.2f}'), 0, 1, 'R'),
+            draw_color(medium_blue),
+            line(120, MarkY('row', 34), 190, MarkY('row', 34)),
+            set_xy(120, MarkY('row', 42)),
+            mark('bank', MarkY('row', 62)),
+        ], [
+            draw_color(medium_blue),
+            line(120, MarkY('row', 18), 190, MarkY('row', 18)),
+            set_xy(120, MarkY('row', 26)),
+            mark('bank', MarkY('row', 46)),
+        ]),
+        font('B', 12),
+        cell(40, 8, 'Grand Total', 0, 0),
+        cell(30, 8, Text('${total:.2f}'), 0, 1, 'R'),
+
+        # Bank Details & Notes
+        keep_on_page('bank', bottom_limit, CONTINUED_Y),
+        set_xy(10, MarkY('bank')), font('B', 10), text_color(dark_blue),
+        cell(85, 6, 'BANK DETAILS', ln=1),
+        font('', 9), text_color(grey),
+        multi_cell(85, 5, bank_lines),
+        set_xy(115, MarkY('bank')), font('B', 10), text_color(dark_blue),
+        cell(75, 6, 'NOTES', ln=1),
+        set_xy(115, CurY()), font('', 9), text_color(grey),
+        multi_cell(90, 9, Text('{notes}')),
     ]
-    pdf.set_font('Lexend', '', 9)
-    pdf.set_text_color(80, 80, 80)
-    pdf.multi_cell(85, 5, "\n".join(bank_lines))
 
-    pdf.set_xy(115, y)
-    pdf.set_font('Lexend', 'B', 10)
-    pdf.set_text_color(*pdf.dark_blue)
-    pdf.cell(75, 6, 'NOTES', ln=1)
 
-    y = pdf.get_y()
-    pdf.set_xy(115, y)
-    pdf.set_font('Lexend', '', 9)
-    pdf.set_text_color(80, 80, 80)
-    pdf.multi_cell(90, 9, invoice_data.get('notes', ''))
+def invoice_context(invoice_data):
+    """Per-invoice values bound into the compiled layout"""
+    items = []
+    for item in invoice_data['items']:
+        desc = item['description']
+        if len(desc) > 50:
+            desc = desc[:50] + '…'
+        items.append({
+            'description': desc,
+            'quantity': item['quantity'],
+            'price': item['price'],
+            'total': item['quantity'] * item['price']
+        })
+    return {
+        'bill_to': "\n".join([
+            invoice_data['client_name'],
+            invoice_data['client_address'],
+            invoice_data.get('client_email', ''),
+            invoice_data.get('client_phone', '')
+        ]),
+        'invoice_number': invoice_data['invoice_number'],
+        'invoice_date': invoice_data['invoice_date'],
+        'due_date': invoice_data['due_date'],
+        'payment_method_text': invoice_data['payment_method_text'],
+        'items': items,
+        'subtotal': invoice_data['subtotal'],
+        'paypal_fee': invoice_data.get('paypal_fee', 0) > 0 and invoice_data['paypal_fee'],
+        'total': invoice_data['total'],
+        'notes': invoice_data.get('notes', '')
+    }
+
+
+def create_invoice(invoice_data):
+    pdf = InvoicePDF()
+    pdf.invoice_data = invoice_data
+    pdf.add_page()
+
+    settings = {field: invoice_data[field] for field in LAYOUT_FIELDS}
+    settings['logo_path'] = pdf.logo_path
+    replay(pdf, compile_layout('Enoylity', invoice_layout, settings, pdf), invoice_context(invoice_data))
 
     return pdf.output(dest='S').encode('latin1')
 
 
+# See sequences.py for ordering / gap guarantees
+invoice_numbers = SequenceAllocator("Enoylity Studio counter")
+
+
 def get_next_invoice_number():
-    counter = db.invoice_counters.find_one_and_update(
-        {"_id": "Enoylity Studio counter"},
-        {"$inc": {"sequence_value": 1}},
-        upsert=True,
-        return_document=ReturnDocument.AFTER
-    )
-    seq = counter.get('sequence_value', 1)
-    return f"INV{seq:05d}"
+    return f"INV{invoice_numbers.next():05d}"
 
 
 @invoice_enoylity_bp.route('/generate-invoice', methods=['POST'])
@@ -300,9 +285,6 @@ def generate_invoice_route():
             if not client_phone.isdigit() or len(client_phone) != 10:
                 return format_response(False, "Client phone must be exactly 10 digits if provided", status=400)
 
-        # ✅ Assign invoice number
-        data['invoice_number'] = get_next_invoice_number()
-
         # ✅ Item calculations
         items = data.get('items', [])
         subtotal = sum(i['quantity'] * i['price'] for i in items)
@@ -313,6 +295,9 @@ def generate_invoice_route():
         data['total'] = subtotal + paypal_fee
         data['payment_method_text'] = {0: "PayPal", 1: "Bank Transfer"}.get(pm, "Other")
 
+        # ✅ Assign invoice number (only once the request has validated)
+        data['invoice_number'] = get_next_invoice_number()
+
         # ✅ Format address
         data['client_address'] = data['client_address'].replace(', ', '\n')
 
@@ -340,12 +325,24 @@ def generate_invoice_route():
             **data
         }
 
+        record = invoice_data.copy()
+        record['created_at'] = datetime.datetime.now()
+        record.update(native_dates(record))
+        filename = f"invoice_{data['invoice_number']}.pdf"
+
+        # ✅ Async mode: save now and render on the worker pool
+        if wants_async():
+            try:
+                job_id = submit_render('invoiceEnoylity', filename, create_invoice, invoice_data)
+            except RenderQueueFull:
+                return queue_full_response()
+            db.invoiceEnoylity.insert_one(record)
+            return queued_response(job_id)
+
         # ✅ Generate PDF
         pdf_bytes = create_invoice(invoice_data)
 
         # ✅ Save to DB
-        record = invoice_data.copy()
-        record['created_at'] = datetime.datetime.now()
         db.invoiceEnoylity.insert_one(record)
 
         # ✅ Send file
@@ -355,7 +352,7 @@ def generate_invoice_route():
             buf,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=f"invoice_{data['invoice_number']}.pdf"
+            download_name=filename
         )
 
     except ValueError:
@@ -382,15 +379,30 @@ def get_invoice_list():
                     {'invoice_date': regex}
                 ]
             }
+        # Indexed date filters: from / to (invoice date), overdue
+        try:
+            filter_criteria = combine(filter_criteria, date_filter(data))
+        except ValueError as e:
+            return format_response(False, str(e), status=400)
+        order = BY_INVOICE_DATE if data.get('sort_by') == 'invoice_date' else ID_ORDER
+
+        if wants_cursor(data):
+            try:
+                docs, next_cursor, has_more = keyset_page(db.invoiceEnoylity, filter_criteria, order, per_page,
+                                                          data.get('cursor'), HIDE_NATIVE)
+            except InvalidCursor:
+                return format_response(False, 'Invalid cursor', status=400)
+            payload = {
+                'invoices': docs,
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_more': has_more
+            }
+            return format_response(True, 'Invoice list retrieved successfully', data=payload)
 
         skip = (page - 1) * per_page
-        cursor = db.invoiceEnoylity.find(filter_criteria).skip(skip).limit(per_page)
-        invoices = []
-        for inv in cursor:
-            inv['_id'] = str(inv['_id'])
-            invoices.append(inv)
+        invoices, total = page_with_total(db.invoiceEnoylity, filter_criteria, order, skip, per_page, HIDE_NATIVE)
 
-        total = db.invoiceEnoylity.count_documents(filter_criteria)
         payload = {
             'invoices': invoices,
             'total': total,
@@ -4,9 +4,22 @@ import os
 import logging
 from datetime import datetime
 from fpdf import FPDF
-from pymongo import ReturnDocument
 import math
 from utils import format_response
+from settings import get_current_settings
+from sequences import SequenceAllocator
+from pagination import NEWEST_FIRST, InvalidCursor, keyset_page, page_with_total, wants_cursor
+from invoice_dates import BY_INVOICE_DATE, date_filter, native_dates
+from pdf_fonts import register_lexend
+from pdf_assets import resolve_asset, place_image
+from letterhead import stamp_letterhead
+from invoice_layout import (
+    Text, MarkY, CurY, cell, multi_cell, font, text_color, fill_color, set_xy, set_x, ln, rect, mark,
+    each, when, switch, table_header, table_row, compile_layout, replay
+)
+from render_jobs import (
+    RenderQueueFull, submit_render, wants_async, queued_response, queue_full_response
+)
 from db import db
 import copy
 from random import choices
@@ -21,6 +34,17 @@ enoylity_bp = Blueprint("enoylity", __name__, url_prefix="/invoiceEnoylityLLC")
 # Invoice type key in settings_invoice
 INVOICE_TYPE = "Enoylity Media Creations LLC"
 
+# Fields returned by the list endpoint, with the defaults and created_at format
+# clients have always received
+LIST_PROJECTION = {
+    '_id': 0, 'invoiceenoylityId': 1, 'invoice_number': 1, 'invoice_date': 1, 'due_date': 1, 'bill_to': 1,
+    'items': {'$ifNull': ['$items', []]},
+    'payment_method': {'$ifNull': ['$payment_method', 0]},
+    'subtotal': {'$ifNull': ['$subtotal', 0]},
+    'total': {'$ifNull': ['$total', 0]},
+    'created_at': {'$dateToString': {'date': '$created_at', 'format': '%Y-%m-%dT%H:%M:%SZ'}},
+}
+
 # Default template settings
 DEFAULT_SETTINGS = {
     "logo_path": "enoylitytechlogo.png",
@@ -54,29 +78,27 @@ DEFAULT_SETTINGS = {
     }
 }
 
-# Generate sequential invoice numbers
+# Generate invoice numbers (see sequences.py for ordering / gap guarantees)
+invoice_numbers = SequenceAllocator(f"{INVOICE_TYPE} counter")
+
 def get_next_invoice_number():
-    counter = db.invoice_counters.find_one_and_update(
-        {"_id": f"{INVOICE_TYPE} counter"},
-        {"$inc": {"sequence_value": 1}},
-        upsert=True,
-        return_document=ReturnDocument.AFTER
-    )
-    seq = counter.get("sequence_value", 1)
-    return f"INV{seq:05d}"
+    return f"INV{invoice_numbers.next():05d}"
 
 class InvoicePDF(FPDF):
     def __init__(self, settings, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.settings = settings
-        self.add_font('Lexend', '', settings['fonts']['regular'], uni=True)
-        self.add_font('Lexend', 'B', settings['fonts']['bold'], uni=True)
+        register_lexend(self, {'': settings['fonts']['regular'], 'B': settings['fonts']['bold']})
         self.set_font('Lexend', '', 11)
 
     def header(self):
+        stamp_letterhead(self, INVOICE_TYPE, self.settings, self._draw_letterhead)
+
+    def _draw_letterhead(self):
         s = self.settings
-        if os.path.isfile(s['logo_path']):
-            self.image(s['logo_path'], x=self.l_margin, y=10, w=40)
+        logo = resolve_asset(s['logo_path'])
+        if logo:
+            place_image(self, logo, x=self.l_margin, y=10, w=40)
         ci = s['company_info']
         self.set_xy(self.l_margin, 10)
         self.set_font('Lexend','B',18)
@@ -92,11 +114,129 @@ class InvoicePDF(FPDF):
         self.set_font('Lexend','',8)
         self.multi_cell(0,5,f"Page {self.page_no()}",align='C')
 
+def invoice_totals(items, payment_method):
+    """Subtotal and total (including the PayPal fee for PayPal payments)"""
+    subtotal=sum(float(it.get('price',0))*int(it.get('quantity',1)) for it in items)
+    total=subtotal+subtotal*0.056 if payment_method==0 else subtotal
+    return subtotal, total
+
+
+# Item table columns: (width, header, value template, align)
+ITEM_COLUMNS = [
+    (90, 'DESCRIPTION', '{description}', 'L'),
+    (30, 'RATE',        '${rate:.2f}',   'C'),
+    (20, 'QTY',         '{qty}',         'C'),
+    (45, 'AMOUNT',      '${amount:.2f}', 'C'),
+]
+
+
+def invoice_layout(settings, page):
+    """Layout spec for the LLC invoice body (compiled once per settings version)"""
+    colors=settings['colors']; x=page['l_margin']; width=page['w']-page['l_margin']-page['r_margin']
+    indent, padding = 4, 7
+    header_h, line_h = 7, 7
+    block_h = header_h + 4*line_h + padding*2
+    leftw=width/2-5; rightw=leftw; nx=x+leftw+10
+    pp=settings['paypal_details']; bk=settings['bank_details']
+
+    side_note = when('note', [
+        set_xy(nx, MarkY('pay')), font('B', 12), multi_cell(rightw, 6, 'Note:', align='L'),
+        font('', 11), set_xy(nx, CurY()), multi_cell(rightw, 6, Text('{note}'), align='L'),
+    ])
+
+    return [
+        # Bill To block on a background rectangle, address lines word-wrapped
+        mark('bill_to'),
+        fill_color(colors['light_pink']),
+        rect(x, MarkY('bill_to'), width, block_h, 'F'),
+        set_xy(x+indent, MarkY('bill_to', indent)),
+        font('B', 12),
+        text_color(colors['black']),
+        multi_cell(width-2*indent, header_h, 'Bill To:'),
+        font('', 11),
+        [[set_x(x+indent), multi_cell(width-2*indent, line_h, Text(field))]
+         for field in ('{bt_name}', '{bt_addr}', '{bt_phone}', '{bt_mail}')],
+        ln(padding),
+        ln(5),
+
+        # Invoice Details
+        mark('details'),
+        fill_color(colors['light_pink']),
+        rect(x, MarkY('details'), width, 8+3*6+3, 'F'),
+        set_xy(x+3, MarkY('details', 3)), font('B', 12), cell(0, 8, 'Invoice Details:', ln=1),
+        font('', 10),
+        [[set_x(x+3), cell(0, 6, Text(d), ln=1)]
+         for d in ('Invoice #: {invoice_number}', 'Bill Date: {invoice_date}', 'Due Date: {due_date}')],
+        ln(7),
+
+        # Items
+        table_header(ITEM_COLUMNS, 10, colors['dark_pink'], (255, 255, 255)),
+        text_color(colors['black']), font('', 11),
+        each('items', table_row(ITEM_COLUMNS, 8)),
+
+        # Fees & Total
+        switch('payment_method', {0: [
+            ln(4), font('', 13), cell(140, 8, 'PayPal Fee', 0, 0, 'R'), cell(45, 8, Text('$ {fee:.2f}'), 0, 1, 'C'),
+        ]}),
+        ln(6), font('B', 14), cell(135, 8, 'TOTAL ', 0, 0, 'R'), cell(39, 8, Text('USD $ {total:.2f}'), 0, 1, 'C'),
+
+        # Payment Info & Note
+        ln(10),
+        mark('pay'),
+        switch('payment_method', {
+            0: [
+                set_xy(x, MarkY('pay')), font('B', 12), cell(leftw, 6, 'PayPal Details:', ln=1),
+                font('', 11),
+                cell(leftw, 6, f"Receiver: {pp['receiver_email']}", ln=1),
+                cell(leftw, 6, f"PayPal Name: {pp['paypal_name']}", ln=1),
+                side_note,
+            ],
+            1: [
+                set_xy(x, MarkY('pay')), font('B', 12), cell(leftw, 6, 'Bank Details:', ln=1),
+                font('', 11),
+                [multi_cell(leftw, 6, line) for line in (
+                    f"Account Name: {bk['account_name']}", f"Account No:   {bk['account_number']}",
+                    f"Routing No:   {bk['routing_number']}", f"Bank:         {bk['bank_name']}",
+                    f"Address:      {bk['bank_address']}")],
+                when('bank_note', [
+                    ln(2), font('B', 12), multi_cell(leftw, 6, 'Bank Note:'),
+                    font('', 11), multi_cell(leftw, 6, Text('{bank_note}')),
+                ]),
+                side_note,
+            ],
+        }, default=when('note', [
+            font('B', 12), cell(0, 6, 'Note:', ln=1), font('', 11), multi_cell(0, 6, Text('{note}')),
+        ])),
+    ]
+
+
+def invoice_context(record):
+    """Per-invoice values bound into the compiled layout"""
+    items=[]
+    for it in record['items']:
+        rate=float(it.get('price',0)); qty=int(it.get('quantity',1))
+        items.append({'description':it.get('description',''),'rate':rate,'qty':qty,'amount':rate*qty})
+    subtotal,total=invoice_totals(record['items'],record['payment_method'])
+    bt=record['bill_to']
+    return {
+        'invoice_number':record['invoice_number'],'invoice_date':record['invoice_date'],'due_date':record['due_date'],
+        'bt_name':bt['name'],'bt_addr':bt['address'],'bt_phone':bt['bt_phone'],'bt_mail':bt['email'],
+        'note':record['note'],'bank_note':record['bank_Note'],'payment_method':record['payment_method'],
+        'items':items,'fee':total-subtotal,'total':total
+    }
+
+
+def render_invoice(settings, record):
+    """Render a stored LLC invoice record to PDF bytes (also runs in render worker processes)"""
+    pdf=InvoicePDF(settings); pdf.invoice_number=record['invoice_number']; pdf.invoice_date=record['invoice_date']; pdf.due_date=record['due_date']; pdf.add_page()
+    replay(pdf, compile_layout(INVOICE_TYPE, invoice_layout, settings, pdf), invoice_context(record))
+    return pdf.output(dest='S').encode('latin1')
+
+
 @enoylity_bp.route('/generate-invoice', methods=['POST'])
 def generate_invoice_endpoint():
     try:
-        raw = db.settings_invoice.find_one({"invoice_type": INVOICE_TYPE}) or {}
-        editable = raw.get('editable_fields', {})
+        editable = get_current_settings(INVOICE_TYPE)
         settings = copy.deepcopy(DEFAULT_SETTINGS)
         for k,v in editable.items():
             if isinstance(v, dict) and k in settings:
@@ -114,93 +254,35 @@ def generate_invoice_endpoint():
         bt_name=data['bill_to_name']; bt_addr=data['bill_to_address']; bt_phone=data.get('bill_to_phone',''); bt_mail=data.get('bill_to_email','')
         note=data.get('note',''); bank_note=data.get('bank_Note',''); items=data.get('items',[])
         payment_method=int(data.get('payment_method',0)); invoice_date=data['invoice_date']; due_date=data['due_date']
-        inv_num=get_next_invoice_number()
         try:
             datetime.strptime(invoice_date,'%d-%m-%Y'); datetime.strptime(due_date,'%d-%m-%Y')
         except ValueError:
             return format_response(False,"Dates must be DD-MM-YYYY",status=400)
 
-        pdf=InvoicePDF(settings); pdf.invoice_number=inv_num; pdf.invoice_date=invoice_date; pdf.due_date=due_date; pdf.add_page()
-
-        lines = [bt_name, bt_addr, bt_phone, bt_mail]
-        x, y = pdf.l_margin, pdf.get_y()
-        width = pdf.w - pdf.l_margin - pdf.r_margin
-        indent, padding = 4, 7
-        header_h, line_h = 7, 7
-        block_h = header_h + len(lines)*line_h + padding*2
-
-        # Draw the background rectangle
-        pdf.set_fill_color(*settings['colors']['light_pink'])
-        pdf.rect(x, y, width, block_h, 'F')
-
-        # Set position for "Bill To:" header
-        pdf.set_xy(x+indent, y+indent)
-        pdf.set_font('Lexend', 'B', 12)
-        pdf.set_text_color(*settings['colors']['black'])
-        pdf.multi_cell(width-2*indent, header_h, 'Bill To:')
-
-        # Set font for the address lines
-        pdf.set_font('Lexend', '', 11)
-
-        # Add each line of the address with word wrap
-        for ln in lines:
-            pdf.set_x(x+indent)
-            pdf.multi_cell(width-2*indent, line_h, ln)
-
-        pdf.ln(padding)
-        pdf.ln(5)
-
-        # Invoice Details
-        details=[f"Invoice #: {inv_num}",f"Bill Date: {invoice_date}",f"Due Date: {due_date}"]
-        y2=pdf.get_y(); pdf.set_fill_color(*settings['colors']['light_pink']); pdf.rect(x,y2,width,8+len(details)*6+3,'F')
-        pdf.set_xy(x+3,y2+3); pdf.set_font('Lexend','B',12); pdf.cell(0,8,'Invoice Details:',ln=1)
-        pdf.set_font('Lexend','',10)
-        for d in details: pdf.set_x(x+3); pdf.cell(0,6,d,ln=1)
-        pdf.ln(7)
-        
-        # Items
-        pdf.set_fill_color(*settings['colors']['dark_pink']); pdf.set_text_color(255,255,255); pdf.set_font('Lexend','B',12)
-        pdf.cell(90,10,'DESCRIPTION',0,0,'C',True); pdf.cell(30,10,'RATE',0,0,'C',True); pdf.cell(20,10,'QTY',0,0,'C',True); pdf.cell(45,10,'AMOUNT',0,1,'C',True)
-        pdf.set_text_color(*settings['colors']['black']); pdf.set_font('Lexend','',11)
-        subtotal=0
-        for it in items:
-            desc=it.get('description',''); rate=float(it.get('price',0)); qty=int(it.get('quantity',1)); amt=rate*qty; subtotal+=amt
-            pdf.cell(90,8,desc,0,0,'L'); pdf.cell(30,8,f'${rate:.2f}',0,0,'C'); pdf.cell(20,8,str(qty),0,0,'C'); pdf.cell(45,8,f'${amt:.2f}',0,1,'C')
-        # Fees & Total
-        if payment_method==0: fee=subtotal*0.056; total=subtotal+fee; pdf.ln(4); pdf.set_font('Lexend','',13); pdf.cell(140,8,'PayPal Fee',0,0,'R'); pdf.cell(45,8,f'$ {fee:.2f}',0,1,'C')
-        else: total=subtotal
-        pdf.ln(6); pdf.set_font('Lexend','B',14); pdf.cell(135,8,'TOTAL ',0,0,'R'); pdf.cell(39,8,f'USD $ {total:.2f}',0,1,'C')
-        # Payment Info & Note
-        pdf.ln(10); x=pdf.l_margin; y=pdf.get_y(); width=pdf.w-pdf.l_margin-pdf.r_margin; leftw=width/2-5; rightw=leftw
-        if payment_method==0:
-            pdf.set_xy(x,y); pdf.set_font('Lexend','B',12); pdf.cell(leftw,6,'PayPal Details:',ln=1)
-            pdf.set_font('Lexend','',11); pp=settings['paypal_details']; pdf.cell(leftw,6,f"Receiver: {pp['receiver_email']}",ln=1); pdf.cell(leftw,6,f"PayPal Name: {pp['paypal_name']}",ln=1)
-            if note:
-                nx,ny=x+leftw+10,y; pdf.set_xy(nx,ny); pdf.set_font('Lexend','B',12); pdf.multi_cell(rightw,6,'Note:',align='L')
-                pdf.set_font('Lexend','',11); pdf.set_xy(nx,pdf.get_y()); pdf.multi_cell(rightw,6,note,align='L')
-        elif payment_method==1:
-            pdf.set_xy(x,y); pdf.set_font('Lexend','B',12); pdf.cell(leftw,6,'Bank Details:',ln=1)
-            pdf.set_font('Lexend','',11); bk=settings['bank_details']
-            for line in (f"Account Name: {bk['account_name']}",f"Account No:   {bk['account_number']}",f"Routing No:   {bk['routing_number']}",f"Bank:         {bk['bank_name']}",f"Address:      {bk['bank_address']}"): pdf.multi_cell(leftw,6,line)
-            if bank_note:
-                pdf.ln(2); pdf.set_font('Lexend','B',12); pdf.multi_cell(leftw,6,'Bank Note:'); pdf.set_font('Lexend','',11); pdf.multi_cell(leftw,6,bank_note)
-            if note:
-                nx,ny=x+leftw+10,y; pdf.set_xy(nx,ny); pdf.set_font('Lexend','B',12); pdf.multi_cell(rightw,6,'Note:',align='L')
-                pdf.set_font('Lexend','',11); pdf.set_xy(nx,pdf.get_y()); pdf.multi_cell(rightw,6,note,align='L')
-        else:
-            if note:
-                pdf.set_font('Lexend','B',12); pdf.cell(0,6,'Note:',ln=1); pdf.set_font('Lexend','',11); pdf.multi_cell(0,6,note)
-        # Persist
+        # Persist (the number is taken once the request has validated)
+        subtotal,total=invoice_totals(items,payment_method)
+        inv_num=get_next_invoice_number()
         inv_id=''.join(choices(_str.digits,k=16)); record={
             'invoiceenoylityId':inv_id,'invoice_number':inv_num,'invoice_date':invoice_date,'due_date':due_date,
             'bill_to':{'name':bt_name,'address':bt_addr,'bt_phone':bt_phone,'email':bt_mail},'items':items,
             'payment_method':payment_method,'subtotal':subtotal,'total':total,'note':note,'bank_Note':bank_note,'created_at':datetime.utcnow()
         }
+        record.update(native_dates(record))
         if payment_method==0: record['payment_info']=settings['paypal_details']
         elif payment_method==1: record['payment_info']=settings['bank_details']
+        filename=f"invoice_{inv_num}.pdf"
+        # Async mode: save the record now and render on the worker pool
+        if wants_async():
+            try:
+                job_id=submit_render('invoiceEnoylityLLC',filename,render_invoice,settings,dict(record))
+            except RenderQueueFull:
+                return queue_full_response()
+            db.invoiceEnoylityLLC.insert_one(record)
+            return queued_response(job_id)
+        pdf_bytes=render_invoice(settings,record)
         db.invoiceEnoylityLLC.insert_one(record)
-        buf=io.BytesIO(pdf.output(dest='S').encode('latin1')); buf.seek(0)
-        return send_file(buf,mimetype='application/pdf',as_attachment=True,download_name=f"invoice_{inv_num}.pdf")
+        buf=io.BytesIO(pdf_bytes); buf.seek(0)
+        return send_file(buf,mimetype='application/pdf',as_attachment=True,download_name=filename)
     except KeyError as ke:
         return format_response(False,f"Missing field: {ke}",status=400)
     except Exception:
@@ -217,51 +299,33 @@ def list_invoices():
         page_size = max(int(data.get('page_size', 10)), 1)
         skip      = (page - 1) * page_size
 
-        # 2️⃣ Build your query (here we list all; you could add filters)
-        query = {}
-
-        # 3️⃣ Count total docs
-        total = db.invoiceEnoylityLLC.count_documents(query)
-
-        # 4️⃣ Fetch paginated slice, sorted newest first
-        cursor = (
-            db.invoiceEnoylityLLC
-            .find(query)
-            .sort('created_at', -1)
-            .skip(skip)
-            .limit(page_size)
-        )
-
-        # 5️⃣ Serialize results
-        invoices = []
-        for doc in cursor:
-            invoices.append({
-                'invoiceenoylityId': doc['invoiceenoylityId'],
-                'invoice_number':    doc['invoice_number'],
-                'invoice_date':      doc['invoice_date'],
-                'due_date':          doc['due_date'],
-                'bill_to':           doc['bill_to'],
-                'items':             doc.get('items', []),
-                'payment_method':    doc.get('payment_method', 0),
-                'subtotal':          doc.get('subtotal', 0),
-                'total':             doc.get('total', 0),
-                'created_at':        doc['created_at'].strftime('%Y-%m-%dT%H:%M:%SZ')
-            })
-
-        # 6️⃣ Build pagination metadata
-        total_pages = (total + page_size - 1) // page_size
-
-        return format_response(
-            True,
-            "Invoices retrieved",
-            {
-                'invoices':   invoices,
+        # 2️⃣ Build your query: indexed date filters from / to (invoice date), overdue
+        try:
+            query = date_filter(data)
+        except ValueError as e:
+            return format_response(False, str(e), status=400)
+        order = BY_INVOICE_DATE if data.get('sort_by') == 'invoice_date' else NEWEST_FIRST
+
+        if wants_cursor(data):
+            # 3️⃣ Continuation-token mode: seek past the last sort key, no count
+            try:
+                invoices, next_cursor, has_more = keyset_page(
+                    db.invoiceEnoylityLLC, query, order, page_size, data.get('cursor'), LIST_PROJECTION
+                )
+            except InvalidCursor:
+                return format_response(False, "Invalid cursor", status=400)
+            meta = {'page_size': page_size, 'next_cursor': next_cursor, 'has_more': has_more}
+        else:
+            # 3️⃣ Fetch paginated slice, sorted newest first, with the total
+            invoices, total = page_with_total(db.invoiceEnoylityLLC, query, order, skip, page_size, LIST_PROJECTION)
+            meta = {
                 'page':       page,
                 'page_size':  page_size,
                 'total':      total,
-                'total_pages': total_pages
+                'total_pages': (total + page_size - 1) // page_size
             }
-        )
+
+        return format_response(True, "Invoices retrieved", {'invoices': invoices, **meta})
 
     except Exception as e:
         logging.exception("Error listing invoices")
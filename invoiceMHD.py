@@ -4,13 +4,25 @@ import os
 import logging
 from datetime import datetime
 from fpdf import FPDF
-from pymongo import ReturnDocument
 
 from utils import format_response
+from pagination import ID_ORDER, InvalidCursor, keyset_page, page_with_total, wants_cursor
+from invoice_dates import BY_INVOICE_DATE, combine, date_filter, native_dates, HIDE_NATIVE
+from pdf_fonts import register_lexend
+from pdf_assets import resolve_asset, place_image
+from letterhead import stamp_letterhead
+from invoice_layout import (
+    Text, MarkY, CurY, cell, multi_cell, font, text_color, set_xy, ln, mark,
+    each, when, switch, filled_lines, table_header, table_row, compile_layout, replay
+)
+from render_jobs import (
+    RenderQueueFull, submit_render, wants_async, queued_response, queue_full_response
+)
 from db import db
 
 # Import helper to fetch editable fields
 from settings import get_current_settings
+from sequences import SequenceAllocator
 
 # Configure logging
 logging.basicConfig(level=logging.ERROR)
@@ -58,13 +70,15 @@ class InvoicePDF(FPDF):
     def __init__(self, settings, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.settings = settings
-        self.add_font('Lexend', '', settings['fonts']['regular'], uni=True)
-        self.add_font('Lexend', 'B', settings['fonts']['bold'], uni=True)
+        register_lexend(self, {'': settings['fonts']['regular'], 'B': settings['fonts']['bold']})
 
     def header(self):
-        logo = self.settings['logo_path']
-        if os.path.isfile(logo):
-            self.image(logo, x=self.w - self.r_margin - 40, y=10, w=40)
+        stamp_letterhead(self, 'MHD Tech', self.settings, self._draw_letterhead)
+
+    def _draw_letterhead(self):
+        logo = resolve_asset(self.settings['logo_path'])
+        if logo:
+            place_image(self, logo, x=self.w - self.r_margin - 40, y=10, w=40)
         self.set_xy(self.l_margin, 10)
         self.set_font('Lexend', 'B', 28)
         self.set_text_color(*self.settings['colors']['black'])
@@ -82,24 +96,175 @@ class InvoicePDF(FPDF):
         self.set_y(-15)
         self.set_font('Lexend', '', 8)
         pass
-# Invoice number generator
+# Invoice number generator (see sequences.py for ordering / gap guarantees)
+invoice_numbers = SequenceAllocator("MHD Tech counter")
+
 def get_next_invoice_number():
-    counter = db.invoice_counters.find_one_and_update(
-        {"_id": "MHD Tech counter"},
-        {"$inc": {"sequence_value": 1}},
-        upsert=True,
-        return_document=ReturnDocument.AFTER
-    )
-    seq = counter.get("sequence_value", 1)
-    return f"INV{seq:05d}"
+    return f"INV{invoice_numbers.next():05d}"
+
+
+def invoice_total(items, payment_method):
+    """Invoice total, including the PayPal fee when paying via PayPal"""
+    subtotal = sum(float(it.get('price', 0)) * int(it.get('quantity', 1)) for it in items)
+    if payment_method == 0:
+        return subtotal + subtotal * 0.056
+    return subtotal
+
+
+# Item table columns: (width, header, value template, align)
+ITEM_COLUMNS = [
+    (90, 'DESCRIPTION', '{description}',  'L'),
+    (30, 'RATE',        '$ {rate:.2f}',   'C'),
+    (20, 'QTY',         '{qty}',          'C'),
+    (45, 'AMOUNT',      '$ {amount:.2f}', 'C'),
+]
+
+
+def invoice_layout(settings, page):
+    """Layout spec for the MHD invoice body (compiled once per settings version)"""
+    colors   = settings['colors']
+    l_margin = page['l_margin']
+    block_w  = page['w'] - page['l_margin'] - page['r_margin']
+    note_w   = 80  # REDUCED width for your Notes column (to push it more to the right)
+    left_w   = block_w - note_w - 20  # Added 20 points of extra space between columns
+    note_x   = l_margin + left_w + 20
+    pd = settings['paypal_details']
+    bd = settings['bank_details']
+
+    # Right column: Notes heading on the same line as the payment details
+    side_note = when('note', [
+        set_xy(note_x, MarkY('pay')),
+        cell(note_w, 6, 'Note:', 0, 1),
+        set_xy(note_x, MarkY('pay', 6)),
+        font('', 11),
+        multi_cell(note_w, 5, Text('{note}'), 0),
+    ])
+
+    return [
+        # Bill To block
+        filled_lines('bill_to', None, block_w, [
+            ('B', 12, 8, 'Bill To:'),
+            ('',  11, 6, Text('{bt_name}')),
+            ('',  11, 6, Text('{bt_addr}')),
+            ('',  11, 6, Text('{bt_phone}')),
+            ('',  11, 6, Text('{bt_mail}')),
+        ], colors['light_pink'], colors['black']),
+        ln(4),
+
+        # Invoice Details block
+        filled_lines('details', None, block_w, [
+            ('B', 12, 8, 'Invoice Details:'),
+            ('',  11, 7, Text('Invoice #: {invoice_number}')),
+            ('',  11, 7, Text('Bill Date: {invoice_date}')),
+            ('',  11, 7, Text('Due Date: {due_date}')),
+        ], colors['light_pink'], colors['black']),
+        ln(10),
+
+        # Items table
+        table_header(ITEM_COLUMNS, 10, colors['dark_pink'], (255, 255, 255)),
+        text_color(colors['black']),
+        font('', 11),
+        each('items', table_row(ITEM_COLUMNS, 8)),
+
+        # PayPal fee if applicable, then the total
+        switch('payment_method', {0: [
+            ln(4),
+            font('', 13),
+            cell(140, 8, 'PayPal Fee', 0, 0, 'R'),
+            cell(45, 8, Text('$ {fee:.2f}'), 0, 1, 'C'),
+        ]}),
+        ln(8),
+        font('B', 14),
+        cell(135, 8, 'TOTAL ', 0, 0, 'R'),
+        cell(39, 8, Text('USD $ {total:.2f}'), 0, 1, 'C'),
+        ln(12),
+
+        # Left column: Bank or PayPal Details
+        mark('pay'),
+        set_xy(l_margin, MarkY('pay')),
+        font('B', 12),
+        switch('payment_method', {
+            0: [
+                cell(left_w, 6, 'PayPal Details:', 0),
+                side_note,
+                set_xy(l_margin, MarkY('pay', 6)),
+                font('', 11),
+                cell(left_w, 5, f"Name : {pd.get('paypal_name','')}", 0, 1),
+                cell(left_w, 5, f"Email: {pd.get('receiver_email','')}", 0, 1),
+            ],
+            1: [
+                cell(left_w, 6, 'Bank Details:', 0),
+                side_note,
+                set_xy(l_margin, MarkY('pay', 6)),
+                font('', 11),
+                cell(left_w, 5, f"Account Name  : {bd.get('account_name','')}", 0, 1),
+                cell(left_w, 5, f"Account Number: {bd.get('account_number','')}", 0, 1),
+                cell(left_w, 5, f"Routing Number: {bd.get('routing_number','')}", 0, 1),
+                cell(left_w, 5, f"Bank Name     : {bd.get('bank_name','')}", 0, 1),
+                cell(left_w, 5, f"Bank Address  : {bd.get('bank_address','')}", 0, 1),
+                # Bank Note a bit below the bank details
+                when('bank_note', [
+                    set_xy(l_margin, CurY(6)),
+                    font('B', 11),
+                    cell(note_w, 6, 'Bank Note:', 0, 1),
+                    font('', 11),
+                    multi_cell(note_w, 5, Text('{bank_note}'), 0),
+                ]),
+            ],
+        }, default=when('note', [
+            set_xy(l_margin, MarkY('pay')),
+            cell(note_w, 6, 'Note:', 0, 1),
+            set_xy(l_margin, MarkY('pay', 6)),
+            font('', 11),
+            multi_cell(note_w, 5, Text('{note}'), 0),
+        ])),
+    ]
+
+
+def invoice_context(record):
+    """Per-invoice values bound into the compiled layout"""
+    items, subtotal = [], 0
+    for it in record['items']:
+        rate = float(it.get('price', 0))
+        qty  = int(it.get('quantity', 1))
+        amount = rate * qty
+        subtotal += amount
+        items.append({'description': it.get('description', ''), 'rate': rate, 'qty': qty, 'amount': amount})
+    payment_method = record['payment_method']
+    fee = subtotal * 0.056 if payment_method == 0 else 0
+    return {
+        'invoice_number': record['invoice_number'],
+        'invoice_date':   record['invoice_date'],
+        'due_date':       record['due_date'],
+        'bt_name':        record['bill_to']['name'],
+        'bt_addr':        record['bill_to']['address'],
+        'bt_mail':        record['bill_to']['email'],
+        'bt_phone':       record['bill_to']['phone'],
+        'note':           record['notes'],
+        'bank_note':      record['bank_Note'],
+        'payment_method': payment_method,
+        'items':          items,
+        'fee':            fee,
+        'total':          subtotal + fee,
+    }
+
+
+def render_invoice(settings, record):
+    """Render a stored MHD invoice record to PDF bytes (also runs in render worker processes)"""
+    pdf = InvoicePDF(settings)
+    pdf.invoice_number = record['invoice_number']
+    pdf.invoice_date   = record['invoice_date']
+    pdf.due_date       = record['due_date']
+    pdf.add_page()
+    replay(pdf, compile_layout('MHD Tech', invoice_layout, settings, pdf), invoice_context(record))
+    return pdf.output(dest='S').encode('latin1')
+
 
 @invoice_bp.route('/generate-invoice', methods=['POST'])
 def generate_invoice_endpoint():
     try:
         # 1️⃣ Fetch editable fields for the "MHD" invoice type
-        raw = db.settings_invoice.find_one({"invoice_type": "MHD Tech"}) or {}
-        editable = raw.get("editable_fields", {})
-        print(editable)
+        editable = get_current_settings("MHD Tech")
         # 2️⃣ Merge into defaults (without mutating them)
         import copy
         settings = copy.deepcopy(DEFAULT_SETTINGS)
@@ -140,7 +305,6 @@ def generate_invoice_endpoint():
         payment_method = int(payment_method) if payment_method not in (None, '', 'null') else None
 
 
-        inv_no = get_next_invoice_number()
         # Validate dates
         try:
             datetime.strptime(data['invoice_date'], '%d-%m-%Y')
@@ -148,173 +312,16 @@ def generate_invoice_endpoint():
         except ValueError:
             return format_response(False, "Invalid date format. Use DD-MM-YYYY", status=400)
 
-        # 6️⃣ Build PDF
-        pdf = InvoicePDF(settings)
-        pdf.invoice_number = inv_no
-        pdf.invoice_date   = data['invoice_date']
-        pdf.due_date       = data['due_date']
-        pdf.add_page()
-
-        # Bill To block
-        lines = ["Bill To:"] + [bt_name, bt_addr, bt_phone, bt_mail]
-        heights = [8] + [6]*(len(lines)-1)
-        block_w = pdf.w - pdf.l_margin - pdf.r_margin
-        x, y = pdf.get_x(), pdf.get_y()
-        pdf.set_fill_color(*settings['colors']['light_pink'])
-        pdf.rect(x, y, block_w, sum(heights), 'F')
-        pdf.set_text_color(*settings['colors']['black'])
-        for h, txt, style in zip(heights, lines, ['B'] + ['']*(len(lines)-1)):
-            pdf.set_font('Lexend', style, 12 if style=='B' else 11)
-            pdf.set_xy(x, y)
-            pdf.cell(0, h, txt, ln=1)
-            y += h
-        pdf.ln(4)
-
-        # Invoice Details block
-        details = [
-            "Invoice Details:",
-            f"Invoice #: {inv_no}",
-            f"Bill Date: {data['invoice_date']}",
-            f"Due Date: {data['due_date']}"
-        ]
-        d_heights = [8] + [7]*(len(details)-1)
-        x, y = pdf.get_x(), pdf.get_y()
-        pdf.set_fill_color(*settings['colors']['light_pink'])
-        pdf.rect(x, y, block_w, sum(d_heights), 'F')
-        pdf.set_text_color(*settings['colors']['black'])
-        for h, txt, style in zip(d_heights, details, ['B'] + ['']*(len(details)-1)):
-            pdf.set_font('Lexend', style, 12 if style=='B' else 11)
-            pdf.set_xy(x, y)
-            pdf.cell(0, h, txt, ln=1)
-            y += h
-        pdf.ln(10)
-
-        # Items table header
-        pdf.set_fill_color(*settings['colors']['dark_pink'])
-        pdf.set_text_color(255,255,255)
-        pdf.set_font('Lexend','B',12)
-        pdf.cell(90,10,'DESCRIPTION',0,0,'C',fill=True)
-        pdf.cell(30,10,'RATE',0,0,'C',fill=True)
-        pdf.cell(20,10,'QTY',0,0,'C',fill=True)
-        pdf.cell(45,10,'AMOUNT',0,1,'C',fill=True)
-
-        # Items rows
-        pdf.set_text_color(*settings['colors']['black'])
-        pdf.set_font('Lexend','',11)
-        subtotal = 0
-        for it in items:
-            desc = it.get('description','')
-            rate = float(it.get('price',0))
-            qty  = int(it.get('quantity',1))
-            amt  = rate * qty
-            subtotal += amt
-            pdf.cell(90,8,desc,0,0,'L')
-            pdf.cell(30,8,f'$ {rate:.2f}',0,0,'C')
-            pdf.cell(20,8,str(qty),0,0,'C')
-            pdf.cell(45,8,f'$ {amt:.2f}',0,1,'C')
-
-        # PayPal fee if applicable
-        if payment_method == 0:
-            fee = subtotal * 0.056
-            total = subtotal + fee
-            pdf.ln(4)
-            pdf.set_font('Lexend','',13)
-            pdf.cell(140,8,'PayPal Fee',0,0,'R')
-            pdf.cell(45,8,f'$ {fee:.2f}',0,1,'C')
-        else:
-            total = subtotal
-        pdf.ln(8)
-        pdf.set_font('Lexend','B',14)
-        pdf.cell(135,8,'TOTAL ',0,0,'R')
-        pdf.cell(39,8,f'USD $ {total:.2f}',0,1,'C')
-
-        pdf.ln(12)
-
-        full_w = pdf.w - pdf.l_margin - pdf.r_margin
-        note_w = 80  # REDUCED width for your Notes column (to push it more to the right)
-        left_w = full_w - note_w - 20  # Added 20 points of extra space between columns
-
-        # Remember current Y
-        y0 = pdf.get_y()
+        try:
+            total_amount = invoice_total(items, payment_method)
+        except (AttributeError, TypeError, ValueError):
+            return format_response(False, "Each item needs a numeric price and quantity", status=400)
 
-        # Left column: Bank or PayPal Details
-        pdf.set_xy(pdf.l_margin, y0)
-        pdf.set_font('Lexend', 'B', 12)
-        if payment_method == 0:
-            pdf.cell(left_w, 6, 'PayPal Details:', 0)
-            
-            # Right column: Notes heading (on the same line as PayPal Details) - moved further right
-            if note:
-                pdf.set_xy(pdf.l_margin + left_w + 20, y0)
-                pdf.cell(note_w, 6, 'Note:', 0, 1)
-
-                # Content under “Note:”
-                pdf.set_xy(pdf.l_margin + left_w + 20, y0 + 6)
-                pdf.set_font('Lexend', '', 11)
-                pdf.multi_cell(note_w, 5, note, 0)
-
-
-
-                
-            # Continue with PayPal details
-            pdf.set_xy(pdf.l_margin, y0 + 6)
-            pd = settings['paypal_details']
-            pdf.set_font('Lexend', '', 11)
-            pdf.cell(left_w, 5, f"Name : {pd.get('paypal_name','')}", ln=1)
-            pdf.cell(left_w, 5, f"Email: {pd.get('receiver_email','')}", ln=1)
-
-        elif payment_method == 1:
-            pdf.cell(left_w, 6, 'Bank Details:', 0)
-            
-            # Right column: Notes heading (on the same line as Bank Details) - moved further right
-            if note:
-                pdf.set_xy(pdf.l_margin + left_w + 20, y0)
-                pdf.cell(note_w, 6, 'Note:', 0, 1)
-
-                # Content under “Note:”
-                pdf.set_xy(pdf.l_margin + left_w + 20, y0 + 6)
-                pdf.set_font('Lexend', '', 11)
-                pdf.multi_cell(note_w, 5, note, 0)
-
-            # Continue with Bank details
-            pdf.set_xy(pdf.l_margin, y0 + 6)
-            bd = settings['bank_details']
-            pdf.set_font('Lexend', '', 11)
-            pdf.cell(left_w, 5, f"Account Name  : {bd.get('account_name','')}", ln=1)
-            pdf.cell(left_w, 5, f"Account Number: {bd.get('account_number','')}", ln=1)
-            pdf.cell(left_w, 5, f"Routing Number: {bd.get('routing_number','')}", ln=1)
-            pdf.cell(left_w, 5, f"Bank Name     : {bd.get('bank_name','')}", ln=1)
-            pdf.cell(left_w, 5, f"Bank Address  : {bd.get('bank_address','')}", ln=1)
-
-
-
-            if bank_note:
-                # move down a bit below bank details
-                start_y = pdf.get_y() + 6
-                pdf.set_xy(pdf.l_margin, start_y)
-
-                # Bank Note heading
-                pdf.set_font('Lexend', 'B', 11)
-                pdf.cell(note_w, 6, 'Bank Note:', 0, 1)
-
-                # Bank Note content
-                pdf.set_font('Lexend', '', 11)
-                pdf.multi_cell(note_w, 5, bank_note, 0)
-
-        else:
-            if note:
-                pdf.set_xy(pdf.l_margin, y0)
-                pdf.cell(note_w, 6, 'Note:', 0, 1)
-                # Notes content - positioned at right column, under "Note:" heading
-                notes_x = pdf.l_margin  # Added 20 points of space
-                notes_y = y0 + 6  # Start notes content below the heading
-                pdf.set_xy(notes_x, notes_y)
-                pdf.set_font('Lexend', '', 11)
-                pdf.multi_cell(note_w, 5, note, 0)  # Default left alignment
-                pass
+        # Only valid requests consume an invoice number
+        inv_no = get_next_invoice_number()
 
-        # Save record
-        db.invoiceMHD.insert_one({
+        # 6️⃣ Build the invoice record
+        record = {
             'invoice_number': inv_no,
             'bill_to': {
                 'name': bt_name,
@@ -327,18 +334,35 @@ def generate_invoice_endpoint():
             'due_date': data['due_date'],
             'notes': note,
             'bank_Note':bank_note,
-            'total_amount': total,
+            'total_amount': total_amount,
             'payment_method': payment_method
-        })
+        }
+        record.update(native_dates(record))
+        filename = f"invoice_{inv_no}.pdf"
+
+        # Async mode: save the record now and render on the worker pool
+        if wants_async():
+            try:
+                job_id = submit_render('invoiceMHD', filename, render_invoice, settings, dict(record))
+            except RenderQueueFull:
+                return queue_full_response()
+            db.invoiceMHD.insert_one(record)
+            return queued_response(job_id)
+
+        # 7️⃣ Build PDF
+        pdf_bytes = render_invoice(settings, record)
+
+        # Save record
+        db.invoiceMHD.insert_one(record)
 
         # Stream PDF back to client
-        buf = io.BytesIO(pdf.output(dest='S').encode('latin1'))
+        buf = io.BytesIO(pdf_bytes)
         buf.seek(0)
         return send_file(
             buf,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=f"invoice_{inv_no}.pdf"
+            download_name=filename
         )
 
     except Exception:
@@ -363,11 +387,33 @@ def get_invoice_list():
                 {'invoice_date':  regex},
                 {'due_date':      regex}
             ]}
+        # Indexed date filters: from / to (invoice date), overdue
+        try:
+            criteria = combine(criteria, date_filter(data))
+        except ValueError as e:
+            return format_response(False, str(e), status=400)
+        # MHD records have no created_at, so _id order unless sorting by invoice date
+        order = BY_INVOICE_DATE if data.get('sort_by') == 'invoice_date' else ID_ORDER
+
+        if wants_cursor(data):
+            try:
+                docs, next_cursor, has_more = keyset_page(db.invoiceMHD, criteria, order, per_page,
+                                                          data.get('cursor'), HIDE_NATIVE)
+            except InvalidCursor:
+                return format_response(False, 'Invalid cursor', status=400)
+            return format_response(
+                True,
+                'Invoice list retrieved',
+                data={
+                    'invoices': docs,
+                    'per_page': per_page,
+                    'next_cursor': next_cursor,
+                    'has_more': has_more
+                }
+            )
 
         skip    = (page - 1) * per_page
-        cursor  = db.invoiceMHD.find(criteria).skip(skip).limit(per_page)
-        invoices = [{**inv, '_id': str(inv['_id'])} for inv in cursor]
-        total    = db.invoiceMHD.count_documents(criteria)
+        invoices, total = page_with_total(db.invoiceMHD, criteria, order, skip, per_page, HIDE_NATIVE)
 
         return format_response(
             True,
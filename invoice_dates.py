@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from pymongo import DESCENDING
+
+# Native date fields stored alongside the DD-MM-YYYY strings of invoices.
+#
+# ``invoice_date`` / ``due_date`` stay as entered (PDFs and list responses show
+# them); ``invoice_on`` / ``due_on`` hold the same days as BSON datetimes so
+# ranges and ordering can use an index.
+
+DATE_FORMAT = '%d-%m-%Y'
+
+# display string field -> native field
+DATE_FIELDS = {'invoice_date': 'invoice_on', 'due_date': 'due_on'}
+
+# List projection keeping the native fields out of client responses
+HIDE_NATIVE = {native: 0 for native in DATE_FIELDS.values()}
+
+# Latest invoice date first (backed by the invoice_on_desc indexes)
+BY_INVOICE_DATE = [('invoice_on', DESCENDING), ('_id', DESCENDING)]
+
+
+def parse_date(value):
+    """DD-MM-YYYY string -> datetime at midnight, or None"""
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def native_dates(record):
+    """``invoice_on`` / ``due_on`` for a record holding the display strings"""
+    return {native: parse_date(record.get(field)) for field, native in DATE_FIELDS.items()}
+
+
+def date_filter(params):
+    """
+    Mongo filter for the list endpoints' date parameters (empty dict if none):
+
+    * ``from`` / ``to``  invoice date range, DD-MM-YYYY, both inclusive
+    * ``overdue``        true: due date before today
+
+    Raises ValueError for malformed dates.
+    """
+    query = {}
+    bounds = {}
+    for param, op in (('from', '$gte'), ('to', '$lt')):
+        value = params.get(param)
+        if not value:
+            continue
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"{param} must be DD-MM-YYYY")
+        bounds[op] = day + timedelta(days=1) if param == 'to' else day
+    if bounds:
+        query['invoice_on'] = bounds
+    if params.get('overdue') in (True, 'true', '1', 1):
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        query['due_on'] = {'$lt': today}
+    return query
+
+
+def combine(*queries):
+    """AND together the non-empty filters"""
+    queries = [q for q in queries if q]
+    if not queries:
+        return {}
+    return queries[0] if len(queries) == 1 else {'$and': queries}
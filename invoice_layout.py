@@ -0,0 +1,310 @@
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from pdf_fonts import FONT_FAMILY
+from pdf_assets import place_image
+
+# Declarative invoice layouts: a per-company template is compiled once (per
+# settings version) into a flat list of drawing ops, then replayed for every
+# invoice with only the per-invoice fields bound in.
+
+logger = logging.getLogger(__name__)
+
+# Compiled layouts kept per (layout, settings, page geometry)
+LAYOUT_CACHE_SIZE = 64
+
+_layout_cache = OrderedDict()
+_layout_lock = threading.Lock()
+
+
+# ─── Bindings resolved when an op is replayed ────────────────────────────────
+
+class _Binding:
+    __slots__ = ()
+
+
+class Text(_Binding):
+    """Per-invoice text, a ``str.format`` template over the render context"""
+    __slots__ = ('template',)
+
+    def __init__(self, template):
+        self.template = template
+
+    def resolve(self, pdf, ctx, marks):
+        return self.template.format_map(ctx)
+
+
+class MarkX(_Binding):
+    """X coordinate of a position recorded with ``mark`` plus an offset"""
+    __slots__ = ('name', 'offset')
+
+    def __init__(self, name, offset=0):
+        self.name, self.offset = name, offset
+
+    def resolve(self, pdf, ctx, marks):
+        return marks[self.name][0] + self.offset
+
+
+class MarkY(_Binding):
+    """Y coordinate of a position recorded with ``mark`` plus an offset"""
+    __slots__ = ('name', 'offset')
+
+    def __init__(self, name, offset=0):
+        self.name, self.offset = name, offset
+
+    def resolve(self, pdf, ctx, marks):
+        return marks[self.name][1] + self.offset
+
+
+class CurY(_Binding):
+    """Current Y position plus an offset"""
+    __slots__ = ('offset',)
+
+    def __init__(self, offset=0):
+        self.offset = offset
+
+    def resolve(self, pdf, ctx, marks):
+        return pdf.get_y() + self.offset
+
+
+# ─── Template building blocks ────────────────────────────────────────────────
+
+def font(style, size):
+    return ('font', style, size)
+
+
+def text_color(rgb):
+    return ('text_color', tuple(rgb))
+
+
+def fill_color(rgb):
+    return ('fill_color', tuple(rgb))
+
+
+def draw_color(rgb):
+    return ('draw_color', tuple(rgb))
+
+
+def cell(w, h, txt='', border=0, ln=0, align='', fill=False):
+    return ('cell', w, h, txt, border, ln, align, fill)
+
+
+def multi_cell(w, h, txt, border=0, align='J'):
+    return ('multi_cell', w, h, txt, border, align)
+
+
+def ln(h=None):
+    return ('ln', h)
+
+
+def set_xy(x, y):
+    return ('set_xy', x, y)
+
+
+def set_x(x):
+    return ('set_x', x)
+
+
+def set_y(y):
+    return ('set_y', y)
+
+
+def rect(x, y, w, h, style='F'):
+    return ('rect', x, y, w, h, style)
+
+
+def line(x1, y1, x2, y2):
+    return ('line', x1, y1, x2, y2)
+
+
+def image(path, x, y, w):
+    return ('image', path, x, y, w)
+
+
+def mark(name, y=None):
+    """Record the current position (or the current X and ``y``) under ``name``"""
+    return ('mark', name, y)
+
+
+def keep_on_page(name, limit, reset_y):
+    """Start a new page when mark ``name`` is below ``limit``; the mark moves to ``reset_y``"""
+    return ('keep_on_page', name, limit, reset_y)
+
+
+def each(field, *ops):
+    """Replay ``ops`` once per item of ``ctx[field]`` with the item's keys bound"""
+    return ('each', field, _flatten(ops))
+
+
+def when(field, then, otherwise=()):
+    """Replay ``then`` if ``ctx[field]`` is truthy, else ``otherwise``"""
+    return ('when', field, _as_ops(then), _as_ops(otherwise))
+
+
+def switch(field, cases, default=()):
+    """Replay the ops registered for ``ctx[field]``"""
+    return ('switch', field, {k: _as_ops(v) for k, v in cases.items()}, _as_ops(default))
+
+
+def filled_lines(name, x, width, rows, fill, color):
+    """
+    Block of single-line cells on a filled background.
+
+    ``rows`` is a list of (style, size, height, text); the background height
+    and every row offset are computed here, at compile time.
+    """
+    ops = [mark(name), fill_color(fill), rect(MarkX(name), MarkY(name), width, sum(r[2] for r in rows), 'F'),
+           text_color(color)]
+    offset = 0
+    for style, size, h, txt in rows:
+        ops += [font(style, size), set_xy(MarkX(name) if x is None else x, MarkY(name, offset)), cell(0, h, txt, ln=1)]
+        offset += h
+    return ops
+
+
+def table_header(columns, height, fill, color, style='B', size=12, border=0):
+    """Header row; ``columns`` is a list of (width, header, value, align)"""
+    ops = [fill_color(fill), text_color(color), font(style, size)]
+    for i, (w, header, _value, _align) in enumerate(columns):
+        ops.append(cell(w, height, header, border, 1 if i == len(columns) - 1 else 0, 'C', True))
+    return ops
+
+
+def table_row(columns, height, border=0):
+    """One item row bound to the item context (use inside ``each``)"""
+    return [cell(w, height, Text(value), border, 1 if i == len(columns) - 1 else 0, align)
+            for i, (w, _header, value, align) in enumerate(columns)]
+
+
+# ─── Compilation and replay ──────────────────────────────────────────────────
+
+def _as_ops(ops):
+    """Accept either a single op or a (nested) list of ops"""
+    if isinstance(ops, tuple) and ops and isinstance(ops[0], str):
+        return (ops,)
+    return _flatten(ops)
+
+
+def _flatten(ops):
+    flat = []
+    for op in ops:
+        if isinstance(op, list):
+            flat.extend(_flatten(op))
+        elif op:
+            flat.append(op)
+    return tuple(flat)
+
+
+def _compile_ops(ops):
+    """Tag every op with whether any argument needs binding at replay time"""
+    compiled = []
+    for op in _flatten(ops):
+        kind, args = op[0], op[1:]
+        if kind == 'each':
+            compiled.append((kind, (args[0], _compile_ops(args[1])), True))
+        elif kind == 'when':
+            compiled.append((kind, (args[0], _compile_ops(args[1]), _compile_ops(args[2])), True))
+        elif kind == 'switch':
+            cases = {k: _compile_ops(v) for k, v in args[1].items()}
+            compiled.append((kind, (args[0], cases, _compile_ops(args[2])), True))
+        else:
+            compiled.append((kind, args, any(isinstance(a, _Binding) for a in args)))
+    return tuple(compiled)
+
+
+def _fingerprint(settings):
+    canonical = json.dumps(settings, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def compile_layout(name, builder, settings, pdf):
+    """
+    Compile ``builder(settings, page)`` into replayable ops, cached per
+    settings version and page geometry.
+    """
+    page = {'w': pdf.w, 'h': pdf.h, 'l_margin': pdf.l_margin, 'r_margin': pdf.r_margin}
+    key = (name, _fingerprint(settings), tuple(sorted(page.items())))
+    with _layout_lock:
+        ops = _layout_cache.get(key)
+        if ops is not None:
+            _layout_cache.move_to_end(key)
+            return ops
+
+    ops = _compile_ops(builder(settings, page))
+    with _layout_lock:
+        _layout_cache[key] = ops
+        while len(_layout_cache) > LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    logger.info("Compiled %s invoice layout (%d ops)", name, len(ops))
+    return ops
+
+
+def clear_layout_cache():
+    with _layout_lock:
+        _layout_cache.clear()
+
+
+def replay(pdf, ops, ctx, marks=None):
+    """Emit compiled ``ops`` on ``pdf`` with ``ctx`` bound into the dynamic fields"""
+    marks = {} if marks is None else marks
+    for kind, args, dynamic in ops:
+        if kind == 'each':
+            field, body = args
+            for item in ctx.get(field) or ():
+                replay(pdf, body, {**ctx, **item}, marks)
+            continue
+        if kind == 'when':
+            field, then, otherwise = args
+            replay(pdf, then if ctx.get(field) else otherwise, ctx, marks)
+            continue
+        if kind == 'switch':
+            field, cases, default = args
+            replay(pdf, cases.get(ctx.get(field), default), ctx, marks)
+            continue
+
+        if dynamic:
+            args = [a.resolve(pdf, ctx, marks) if isinstance(a, _Binding) else a for a in args]
+
+        if kind == 'cell':
+            pdf.cell(*args)
+        elif kind == 'font':
+            pdf.set_font(FONT_FAMILY, *args)
+        elif kind == 'set_xy':
+            pdf.set_xy(*args)
+        elif kind == 'multi_cell':
+            pdf.multi_cell(*args)
+        elif kind == 'text_color':
+            pdf.set_text_color(*args[0])
+        elif kind == 'fill_color':
+            pdf.set_fill_color(*args[0])
+        elif kind == 'draw_color':
+            pdf.set_draw_color(*args[0])
+        elif kind == 'ln':
+            pdf.ln() if args[0] is None else pdf.ln(args[0])
+        elif kind == 'set_x':
+            pdf.set_x(*args)
+        elif kind == 'set_y':
+            pdf.set_y(*args)
+        elif kind == 'rect':
+            pdf.rect(*args)
+        elif kind == 'line':
+            pdf.line(*args)
+        elif kind == 'mark':
+            name, y = args
+            marks[name] = (pdf.get_x(), pdf.get_y() if y is None else y)
+        elif kind == 'keep_on_page':
+            name, limit, reset_y = args
+            if marks[name][1] > limit:
+                pdf.add_page()
+                marks[name] = (marks[name][0], reset_y)
+        elif kind == 'image':
+            try:
+                place_image(pdf, args[0], x=args[1], y=args[2], w=args[3])
+            except Exception as e:
+                logger.error("Failed to add image %s: %s", args[0], e)
+        else:
+            raise ValueError(f"Unknown layout op: {kind}")
+    return pdf
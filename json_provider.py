@@ -0,0 +1,65 @@
+import decimal
+from datetime import date
+
+from bson import Decimal128, ObjectId
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON provider for API responses (registered in app.create_app).
+#
+# With orjson installed, documents are encoded in C, with ObjectId / Decimal /
+# Decimal128 / datetime handled by ``_default``, so handlers return Mongo
+# documents as they come off the cursor. Without orjson, or for values orjson
+# rejects (e.g. integers beyond 64 bits), Flask's stdlib encoder runs with the
+# same conversions.
+#
+# Output matches Flask's default provider (sorted keys, datetime / date as RFC
+# 822 HTTP dates, Decimal as a string) plus ObjectId -> hex string.
+
+# Sorted keys as Flask produces them; datetimes go through ``_default`` for the
+# HTTP date format; non-string dict keys (e.g. import report row numbers) allowed
+ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, date):
+        return http_date(value)
+    return DefaultJSONProvider.default(value)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+
+    def _encode(self, obj):
+        """UTF-8 JSON bytes for ``obj``"""
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+            except orjson.JSONEncodeError:
+                pass
+        return super().dumps(obj).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
@@ -0,0 +1,115 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from pdf_store import artifact_key
+
+# Pre-rendered letterheads: the static header a PDF class draws at the top of
+# every page is recorded once per settings version as a content-stream
+# fragment, then stamped into each new page instead of being redrawn.
+
+logger = logging.getLogger(__name__)
+
+# Recorded letterheads kept per (letterhead, settings version, page state)
+LETTERHEAD_CACHE_SIZE = 64
+
+# Graphics state a header can change and the fragment must restore
+_STATE_ATTRS = (
+    'x', 'y', 'lasth', 'font_family', 'font_style', 'font_size_pt', 'font_size',
+    'underline', 'unifontsubset', 'text_color', 'draw_color', 'fill_color',
+    'color_flag', 'line_width',
+)
+# Page geometry the header output depends on
+_PAGE_ATTRS = ('w', 'h', 'k', 'l_margin', 't_margin', 'r_margin', 'page_break_trigger', 'ws')
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _page_state(pdf):
+    """Everything the header sees when add_page() calls it, as a hashable key"""
+    return (
+        tuple(getattr(pdf, a, None) for a in _STATE_ATTRS + _PAGE_ATTRS),
+        tuple((k, f['i']) for k, f in pdf.fonts.items()),
+        tuple((name, info['i']) for name, info in pdf.images.items()),
+    )
+
+
+def _record(pdf, draw):
+    """Run ``draw()`` on ``pdf`` and capture what it emitted and changed"""
+    start = len(pdf.pages[pdf.page])
+    images_before = set(pdf.images)
+
+    # Collect the glyphs the header uses on empty subsets, then put them back
+    subsets = {}
+    for fontkey, font in pdf.fonts.items():
+        if 'subset' in font:
+            subsets[fontkey] = font['subset']
+            font['subset'] = []
+    try:
+        draw()
+    finally:
+        glyphs = {}
+        for fontkey, subset in subsets.items():
+            used = pdf.fonts[fontkey]['subset']
+            if used:
+                glyphs[fontkey] = list(used)
+            pdf.fonts[fontkey]['subset'] = subset + used
+
+    return {
+        'content': pdf.pages[pdf.page][start:],
+        'state': {a: getattr(pdf, a, None) for a in _STATE_ATTRS},
+        'glyphs': glyphs,
+        'images': {name: dict(info) for name, info in pdf.images.items() if name not in images_before},
+        # PNG logos with an alpha channel bump the document to PDF 1.4
+        'pdf_version': pdf.pdf_version,
+    }
+
+
+def _stamp(pdf, fragment):
+    pdf.pages[pdf.page] += fragment['content']
+    for fontkey, used in fragment['glyphs'].items():
+        pdf.fonts[fontkey]['subset'].extend(used)
+    for name, info in fragment['images'].items():
+        pdf.images[name] = dict(info)
+    pdf.pdf_version = max(pdf.pdf_version, fragment['pdf_version'])
+    for attr, value in fragment['state'].items():
+        setattr(pdf, attr, value)
+    if pdf.font_family:
+        pdf.current_font = pdf.fonts[pdf.font_family + pdf.font_style]
+
+
+def stamp_letterhead(pdf, name, settings, draw):
+    """
+    Draw the page header via the cached fragment for ``settings``.
+
+    ``draw`` is the uncached header routine; its output must depend only on
+    ``settings`` and the page state. The first page rendered with a given
+    settings version records the fragment, later pages (and documents) reuse it.
+    """
+    version = getattr(pdf, '_letterhead_version', None)
+    if version is None or version[0] != name:
+        version = (name, artifact_key('letterhead', name, settings))
+        pdf._letterhead_version = version
+    key = (version[1], _page_state(pdf))
+
+    with _lock:
+        fragment = _cache.get(key)
+        if fragment is not None:
+            _cache.move_to_end(key)
+    if fragment is not None:
+        _stamp(pdf, fragment)
+        return
+
+    fragment = _record(pdf, draw)
+    with _lock:
+        _cache[key] = fragment
+        while len(_cache) > LETTERHEAD_CACHE_SIZE:
+            _cache.popitem(last=False)
+    logger.info("Recorded %s letterhead (%d bytes)", name, len(fragment['content']))
+
+
+def clear_letterhead_cache():
+    """Drop every recorded letterhead (called when salary/invoice settings change)"""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,382 @@
+import sys
+import logging
+import argparse
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, ReplaceOne, UpdateOne
+from pymongo import errors as pymongo_errors
+
+from search import EMPLOYEE_SEARCH_FIELDS, SUBADMIN_SEARCH_FIELDS, search_document
+from invoice_dates import native_dates
+from credentials import login_key
+
+# Versioned schema migrations and the index definitions they maintain.
+#
+# Run at deploy time:
+#   python migrations.py migrate    apply pending migrations (idempotent)
+#   python migrations.py status     list applied / pending migrations
+#   python migrations.py report     missing, undeclared and unused indexes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Applied migration versions are recorded here ({_id: version, ...})
+MIGRATIONS_COLLECTION = 'schema_migrations'
+
+# Indexes created by each migration, per collection. A set is frozen once its
+# migration has shipped: new indexes go into a new set and a new migration, so
+# replaying the migrations on an empty database always builds the same thing.
+
+M001_INDEXES = {
+    'employees': [
+        IndexModel([('employeeId', ASCENDING)], name='employeeId_unique', unique=True),
+        IndexModel([('email', ASCENDING)], name='email'),
+        IndexModel([('phone', ASCENDING)], name='phone'),
+    ],
+    'payslips': [
+        IndexModel([('payslipId', ASCENDING)], name='payslipId_unique', unique=True),
+        IndexModel([('employeeId', ASCENDING), ('year', ASCENDING), ('month', ASCENDING)],
+                   name='employee_period'),
+        IndexModel([('year', ASCENDING), ('month', ASCENDING)], name='period'),
+        # Backs the ``search`` filter of /employee/getpayslips ($text)
+        IndexModel([('employeeId', TEXT), ('emp_snapshot.full_name', TEXT), ('emp_snapshot.department', TEXT)],
+                   name='payslip_text'),
+    ],
+    'subadmin': [
+        IndexModel([('subadminId', ASCENDING)], name='subadminId_unique', unique=True),
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+        IndexModel([('employeeId', ASCENDING)], name='employeeId'),
+    ],
+    'admin': [
+        IndexModel([('adminId', ASCENDING)], name='adminId_unique', unique=True),
+    ],
+    'invoiceMHD': [
+        IndexModel([('invoice_number', ASCENDING)], name='invoice_number'),
+    ],
+    'invoiceEnoylity': [
+        IndexModel([('invoice_number', ASCENDING)], name='invoice_number'),
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)], name='created_at_desc'),
+    ],
+    'invoiceEnoylityLLC': [
+        IndexModel([('invoice_number', ASCENDING)], name='invoice_number'),
+        # list_invoices sorts newest first
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)], name='created_at_desc'),
+    ],
+    'settings_invoice': [
+        IndexModel([('invoice_type', ASCENDING)], name='invoice_type'),
+        IndexModel([('settings_id', ASCENDING)], name='settings_id'),
+    ],
+    'settings_salary': [
+        IndexModel([('settings_type', ASCENDING)], name='settings_type'),
+        IndexModel([('settings_id', ASCENDING)], name='settings_id'),
+    ],
+    'render_jobs': [
+        IndexModel([('job_id', ASCENDING)], name='job_id_unique', unique=True),
+    ],
+}
+
+# Token indexes behind employee / subadmin search and autocomplete
+M002_INDEXES = {
+    'employees': [
+        IndexModel([('search.prefixes', ASCENDING)], name='search_prefixes'),
+        IndexModel([('search.grams', ASCENDING)], name='search_grams'),
+    ],
+    'subadmin': [
+        IndexModel([('search.prefixes', ASCENDING)], name='search_prefixes'),
+        IndexModel([('search.grams', ASCENDING)], name='search_grams'),
+    ],
+}
+
+# One slip per employee and month (generation upserts on this key); replaces employee_period
+M003_INDEXES = {
+    'payslips': [
+        IndexModel([('employeeId', ASCENDING), ('year', ASCENDING), ('month', ASCENDING)],
+                   name='employee_period_unique', unique=True),
+    ],
+}
+
+INVOICE_COLLECTIONS = ('invoiceMHD', 'invoiceEnoylity', 'invoiceEnoylityLLC')
+
+# Native invoice / due dates (see invoice_dates.py): range filters and sort_by=invoice_date
+M004_INDEXES = {
+    collection: [
+        IndexModel([('invoice_on', DESCENDING), ('_id', DESCENDING)], name='invoice_on_desc'),
+        IndexModel([('due_on', ASCENDING)], name='due_on'),
+    ]
+    for collection in INVOICE_COLLECTIONS
+}
+
+# Case-insensitive login (see credentials.py)
+M005_INDEXES = {
+    collection: [
+        IndexModel([('login_key', ASCENDING)], name='login_key_unique', unique=True,
+                   partialFilterExpression={'login_key': {'$type': 'string'}}),
+    ]
+    for collection in ('admin', 'subadmin')
+}
+
+# Old links to payslips archived by 003
+M006_INDEXES = {
+    'payslips_archive': [
+        IndexModel([('payslipId', ASCENDING)], name='payslipId'),
+    ],
+}
+
+# Payslip exports stream in (year, month, employeeId) order; replaces period (its prefix)
+M008_INDEXES = {
+    'payslips': [
+        IndexModel([('year', ASCENDING), ('month', ASCENDING), ('employeeId', ASCENDING)],
+                   name='period_employee'),
+    ],
+}
+
+# Indexes dropped by a later migration: collection -> names
+DROPPED_INDEXES = {
+    'payslips': {'employee_period', 'period'},
+}
+
+
+def _declared(*index_sets):
+    """Union of the per-migration sets, minus DROPPED_INDEXES"""
+    declared = {}
+    for index_set in index_sets:
+        for collection, models in index_set.items():
+            declared.setdefault(collection, []).extend(
+                m for m in models if m.document['name'] not in DROPPED_INDEXES.get(collection, ())
+            )
+    return declared
+
+
+# Indexes the current schema expects, named so they can be compared and reported
+INDEXES = _declared(M001_INDEXES, M002_INDEXES, M003_INDEXES, M004_INDEXES, M005_INDEXES,
+                    M006_INDEXES, M008_INDEXES)
+
+
+def ensure_indexes(db, indexes=None):
+    """
+    Create the indexes in ``indexes`` (collection -> IndexModels; default:
+    everything declared in INDEXES).
+
+    ``create_indexes`` is a no-op for indexes that already exist with the same
+    spec, so this is safe to run on every deploy.
+    """
+    for name, models in (indexes or INDEXES).items():
+        try:
+            created = db[name].create_indexes(models)
+            logger.info("Indexes ensured on %s: %s", name, ", ".join(created))
+        except pymongo_errors.OperationFailure as e:
+            # e.g. an index with the same keys but different options already exists
+            logger.error("Could not ensure indexes on %s: %s", name, e)
+            raise
+
+
+# ─── Migrations ──────────────────────────────────────────────────────────────
+# Append new migrations with the next version number; never edit applied ones.
+
+def _m001_initial_indexes(db):
+    ensure_indexes(db, M001_INDEXES)
+
+
+def _backfill_search(db, collection, fields, batch_size=500):
+    """Recompute the ``search`` sub-document of every record in ``collection``"""
+    ops = []
+    for doc in db[collection].find({}, {f: 1 for f in fields}):
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'search': search_document(doc, fields)}}))
+        if len(ops) >= batch_size:
+            db[collection].bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db[collection].bulk_write(ops, ordered=False)
+
+
+def _m002_search_tokens(db):
+    _backfill_search(db, 'employees', EMPLOYEE_SEARCH_FIELDS)
+    _backfill_search(db, 'subadmin', SUBADMIN_SEARCH_FIELDS)
+    ensure_indexes(db, M002_INDEXES)
+
+
+# Payslips superseded by a newer one for the same employee and month. They are
+# kept (with ``superseded_by``) so payslipId links handed out earlier still work.
+PAYSLIP_ARCHIVE_COLLECTION = 'payslips_archive'
+
+
+def _dedupe_payslips(db):
+    """Keep the most recently generated payslip per (employeeId, year, month); archive the others"""
+    groups = db.payslips.aggregate([
+        {'$sort': {'generated_on': -1, '_id': -1}},
+        {'$group': {'_id': {'e': '$employeeId', 'y': '$year', 'm': '$month'},
+                    'ids': {'$push': '$_id'}, 'latest': {'$first': '$payslipId'}, 'n': {'$sum': 1}}},
+        {'$match': {'n': {'$gt': 1}}},
+    ], allowDiskUse=True)
+    archived = 0
+    now = datetime.utcnow()
+    for group in groups:
+        older = list(db.payslips.find({'_id': {'$in': group['ids'][1:]}}))
+        # Same _id in the archive, so a re-run after a partial failure does not copy twice
+        db[PAYSLIP_ARCHIVE_COLLECTION].bulk_write([
+            ReplaceOne({'_id': doc['_id']}, {**doc, 'superseded_by': group['latest'], 'archived_at': now},
+                       upsert=True)
+            for doc in older
+        ], ordered=False)
+        archived += db.payslips.delete_many({'_id': {'$in': [doc['_id'] for doc in older]}}).deleted_count
+    if archived:
+        logger.info("Archived %d duplicate payslip(s) to %s", archived, PAYSLIP_ARCHIVE_COLLECTION)
+
+
+def _m003_unique_payslip_period(db):
+    _dedupe_payslips(db)
+    if 'employee_period' in {ix['name'] for ix in db.payslips.list_indexes()}:
+        db.payslips.drop_index('employee_period')
+    ensure_indexes(db, M003_INDEXES)
+
+
+def _backfill_invoice_dates(db, collection, batch_size=500):
+    """Set ``invoice_on`` / ``due_on`` from the DD-MM-YYYY strings where missing"""
+    ops = []
+    for doc in db[collection].find({'invoice_on': {'$exists': False}}, {'invoice_date': 1, 'due_date': 1}):
+        dates = native_dates(doc)
+        if dates['invoice_on'] is None:
+            # Unparseable legacy value: fall back to the insert time so the
+            # record still sorts and pages by invoice date
+            dates['invoice_on'] = doc['_id'].generation_time.replace(tzinfo=None)
+            logger.warning("%s %s: invoice_date %r is not DD-MM-YYYY", collection, doc['_id'], doc.get('invoice_date'))
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': dates}))
+        if len(ops) >= batch_size:
+            db[collection].bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db[collection].bulk_write(ops, ordered=False)
+
+
+def _m004_invoice_native_dates(db):
+    for collection in INVOICE_COLLECTIONS:
+        _backfill_invoice_dates(db, collection)
+    ensure_indexes(db, M004_INDEXES)
+
+
+def _m005_login_keys(db):
+    for collection, source in (('admin', 'email'), ('subadmin', 'username')):
+        ops = [
+            UpdateOne({'_id': doc['_id']}, {'$set': {'login_key': login_key(doc[source])}})
+            for doc in db[collection].find({source: {'$type': 'string'}}, {source: 1})
+        ]
+        if ops:
+            db[collection].bulk_write(ops, ordered=False)
+        clashes = list(db[collection].aggregate([
+            {'$match': {'login_key': {'$type': 'string'}}},
+            {'$group': {'_id': '$login_key', 'n': {'$sum': 1}}},
+            {'$match': {'n': {'$gt': 1}}},
+        ]))
+        if clashes:
+            # Logins that differ only by case must be renamed by hand before the unique index can exist
+            raise RuntimeError(f"{collection}: logins differing only by case: {[c['_id'] for c in clashes]}")
+    ensure_indexes(db, M005_INDEXES)
+
+
+def _m006_payslip_archive_index(db):
+    ensure_indexes(db, M006_INDEXES)
+
+
+def _m007_unicode_search_tokens(db):
+    # Tokens from 002 dropped every non-Latin letter (e.g. Devanagari names had none)
+    _backfill_search(db, 'employees', EMPLOYEE_SEARCH_FIELDS)
+    _backfill_search(db, 'subadmin', SUBADMIN_SEARCH_FIELDS)
+
+
+def _m008_payslip_export_index(db):
+    ensure_indexes(db, M008_INDEXES)
+    if 'period' in {ix['name'] for ix in db.payslips.list_indexes()}:
+        db.payslips.drop_index('period')
+
+
+MIGRATIONS = [
+    (1, "Create initial indexes", _m001_initial_indexes),
+    (2, "Backfill employee/subadmin search tokens", _m002_search_tokens),
+    (3, "One payslip per employee and month", _m003_unique_payslip_period),
+    (4, "Native invoice / due dates on invoices", _m004_invoice_native_dates),
+    (5, "Normalized login keys for admins and subadmins", _m005_login_keys),
+    (6, "Index archived payslips", _m006_payslip_archive_index),
+    (7, "Re-tokenize search for non-Latin names", _m007_unicode_search_tokens),
+    (8, "Index payslips in export order", _m008_payslip_export_index),
+]
+
+
+def applied_versions(db):
+    return {doc['_id'] for doc in db[MIGRATIONS_COLLECTION].find({}, {'_id': 1})}
+
+
+def pending_migrations(db):
+    done = applied_versions(db)
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def migrate(db):
+    """Apply pending migrations in order; returns the versions applied"""
+    applied = []
+    for version, description, func in pending_migrations(db):
+        logger.info("Applying migration %03d: %s", version, description)
+        func(db)
+        try:
+            db[MIGRATIONS_COLLECTION].insert_one({
+                '_id': version,
+                'description': description,
+                'applied_at': datetime.utcnow()
+            })
+        except pymongo_errors.DuplicateKeyError:
+            # Another deploy applied it concurrently; migrations are idempotent
+            logger.info("Migration %03d was recorded concurrently", version)
+        applied.append(version)
+    return applied
+
+
+def index_report(db):
+    """
+    Compare declared indexes with the database.
+
+    Per collection: ``missing`` (declared, not present), ``undeclared``
+    (present, not declared) and ``unused`` (present, no accesses since the
+    server last restarted, according to ``$indexStats``).
+    """
+    report = {}
+    for name, models in INDEXES.items():
+        declared = {m.document['name'] for m in models}
+        existing = {ix['name'] for ix in db[name].list_indexes()} - {'_id_'}
+        try:
+            usage = {s['name']: s['accesses']['ops'] for s in db[name].aggregate([{'$indexStats': {}}])}
+        except pymongo_errors.OperationFailure:
+            usage = {}
+        report[name] = {
+            'missing': sorted(declared - existing),
+            'undeclared': sorted(existing - declared),
+            'unused': sorted(ix for ix in existing if usage.get(ix) == 0),
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply schema migrations and report on indexes")
+    parser.add_argument('command', choices=['migrate', 'status', 'report'])
+    args = parser.parse_args(argv)
+
+    from db import db
+
+    if args.command == 'migrate':
+        applied = migrate(db)
+        print(f"Applied {len(applied)} migration(s)" + (f": {applied}" if applied else ""))
+    elif args.command == 'status':
+        done = applied_versions(db)
+        for version, description, _func in MIGRATIONS:
+            print(f"{version:03d}  {'applied' if version in done else 'pending':8}  {description}")
+    else:
+        problems = 0
+        for name, entry in index_report(db).items():
+            for kind in ('missing', 'undeclared', 'unused'):
+                for ix in entry[kind]:
+                    print(f"{name:20} {kind:11} {ix}")
+                    problems += kind == 'missing'
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
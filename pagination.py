@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from itsdangerous import BadData, URLSafeSerializer
+from pymongo import ASCENDING, DESCENDING
+
+from sessions import SESSION_SECRET
+
+# Pagination for list endpoints.
+#
+# Keyset (continuation-token) mode: a page is fetched with a range filter on the sort key of the last document
+# already returned instead of ``skip``, so every page costs the same no matter
+# how deep it is. Sort keys must end with ``_id`` (unique, so ordering is
+# stable) and every field in them must be present on all documents. Cursors
+# are signed, so a client cannot turn a sort value into a query operator.
+
+# Seconds a filtered total is reused for the same collection + query
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", 30))
+# Upper bound on cached totals (oldest entries are dropped first)
+COUNT_CACHE_SIZE = 1024
+
+_cursor_serializer = URLSafeSerializer(SESSION_SECRET, salt='cursor',
+                                      signer_kwargs={'digest_method': hashlib.sha256})
+# Types a decoded sort value may have; anything else (e.g. a dict) is rejected
+_CURSOR_TYPES = (str, int, float, bool, ObjectId, datetime, type(None))
+
+_count_cache = {}
+_count_lock = threading.Lock()
+
+# Sort used when a collection has no better indexed key
+ID_ORDER = [('_id', ASCENDING)]
+# Newest first, backed by the (created_at, _id) indexes
+NEWEST_FIRST = [('created_at', DESCENDING), ('_id', DESCENDING)]
+
+
+class InvalidCursor(ValueError):
+    """Raised when a continuation token cannot be decoded"""
+
+
+def wants_cursor(params):
+    """Keyset mode is selected by sending a ``cursor`` (empty/null for the first page)"""
+    return 'cursor' in params
+
+
+def _encode_value(value):
+    if isinstance(value, ObjectId):
+        return {'$oid': str(value)}
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if '$oid' in value:
+            return ObjectId(value['$oid'])
+        if '$date' in value:
+            return datetime.fromisoformat(value['$date'])
+    return value
+
+
+def _sort_key(sort):
+    """Compact identifier of a sort order, e.g. ``created_at:-1,_id:-1``"""
+    return ','.join(f'{field}:{direction}' for field, direction in sort)
+
+
+def encode_cursor(values, sort):
+    return _cursor_serializer.dumps({'s': _sort_key(sort), 'v': [_encode_value(v) for v in values]})
+
+
+def decode_cursor(token, sort):
+    try:
+        payload = _cursor_serializer.loads(token)
+        if not isinstance(payload, dict) or not isinstance(payload.get('v'), list):
+            raise InvalidCursor("malformed cursor")
+        values = [_decode_value(v) for v in payload['v']]
+    except (BadData, ValueError, TypeError, InvalidId) as e:
+        raise InvalidCursor(str(e))
+    # A cursor only continues the sort it was issued for: field lists of the
+    # same length (e.g. newest-first vs by invoice date) would otherwise mix
+    if payload.get('s') != _sort_key(sort) or len(values) != len(sort):
+        raise InvalidCursor("cursor does not match the sort order")
+    if not all(isinstance(v, _CURSOR_TYPES) for v in values):
+        raise InvalidCursor("cursor holds an invalid sort value")
+    return values
+
+
+def _after(sort, values):
+    """Filter matching documents strictly after ``values`` in ``sort`` order"""
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        branch = {f: v for (f, _d), v in zip(sort[:i], values[:i])}
+        branch[field] = {'$gt' if direction == ASCENDING else '$lt': values[i]}
+        branches.append(branch)
+    return branches[0] if len(branches) == 1 else {'$or': branches}
+
+
+def _get(doc, field):
+    for part in field.split('.'):
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return doc
+
+
+def _shows(projection, field):
+    """Whether ``projection`` returns ``field``"""
+    if field in projection:
+        return bool(projection[field])
+    # Inclusion projections return only the listed fields (and _id), exclusion ones everything else
+    return field == '_id' or not any(v for k, v in projection.items() if k != '_id')
+
+
+def keyset_page(collection, query, sort, size, cursor=None, projection=None):
+    """
+    Fetch one page of ``collection`` in ``sort`` order after ``cursor``.
+
+    Returns (documents, next_cursor, has_more). No count query is issued;
+    ``has_more`` comes from fetching one document past the page.
+    """
+    if cursor:
+        bound = _after(sort, decode_cursor(cursor, sort))
+        query = {'$and': [query, bound]} if query else bound
+
+    # Sort keys are needed to build the next cursor even if the projection hides or reshapes them
+    keys = [f for f, _d in sort]
+    extra = []
+    if projection:
+        projection = dict(projection)
+        inclusive = any(v for k, v in projection.items() if k != '_id')
+        for i, field in enumerate(keys):
+            if isinstance(projection.get(field), dict):
+                # Computed by an expression: read the stored value under an alias
+                keys[i] = f"_sort{i}"
+                projection[keys[i]] = f"${field}"
+            elif _shows(projection, field):
+                continue
+            elif inclusive:
+                projection[field] = 1
+            else:
+                del projection[field]
+            extra.append(keys[i])
+        projection = projection or None
+
+    docs = list(collection.find(query, projection).sort(sort).limit(size + 1))
+    has_more = len(docs) > size
+    docs = docs[:size]
+    next_cursor = encode_cursor([_get(docs[-1], k) for k in keys], sort) if has_more else None
+    if extra:
+        for doc in docs:
+            for key in extra:
+                doc.pop(key, None)
+    return docs, next_cursor, has_more
+
+
+# ─── Page-number mode with totals ────────────────────────────────────────────
+
+def _count_key(collection, query):
+    return collection.full_name, json.dumps(query, sort_keys=True, default=str)
+
+
+def _cached_count(key):
+    with _count_lock:
+        entry = _count_cache.get(key)
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+
+def _store_count(key, total):
+    with _count_lock:
+        if len(_count_cache) >= COUNT_CACHE_SIZE:
+            now = time.monotonic()
+            for k in [k for k, (_n, expires) in _count_cache.items() if expires <= now] or list(_count_cache)[:1]:
+                del _count_cache[k]
+        _count_cache[key] = (total, time.monotonic() + COUNT_CACHE_TTL)
+
+
+def clear_count_cache():
+    with _count_lock:
+        _count_cache.clear()
+
+
+def page_with_total(collection, query, sort, skip, limit, projection=None):
+    """
+    One page of ``collection`` plus the total matching documents.
+
+    * no filter: the total is ``estimated_document_count`` (collection metadata)
+    * filter with a cached total (COUNT_CACHE_TTL): only the page is fetched
+    * otherwise page and total come back from a single ``$facet`` aggregation
+
+    Returns (documents, total).
+    """
+    if not query:
+        docs = list(collection.find(query, projection).sort(sort).skip(skip).limit(limit))
+        return docs, collection.estimated_document_count()
+
+    key = _count_key(collection, query)
+    total = _cached_count(key)
+    if total is not None:
+        return list(collection.find(query, projection).sort(sort).skip(skip).limit(limit)), total
+
+    # $sort goes before $facet: facet sub-pipelines cannot use indexes, so a
+    # sort inside ``items`` would be a blocking in-memory sort of every match
+    page_stages = [{'$skip': skip}, {'$limit': limit}]
+    if projection:
+        page_stages.append({'$project': projection})
+    result = next(collection.aggregate([
+        {'$match': query},
+        {'$sort': dict(sort)},
+        {'$facet': {'items': page_stages, 'total': [{'$count': 'n'}]}}
+    ], allowDiskUse=True), None) or {}
+    total = result['total'][0]['n'] if result.get('total') else 0
+    _store_count(key, total)
+    return result.get('items', []), total
@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+from utils import format_response
+
+# Password hashing and verification on a bounded thread pool.
+#
+# bcrypt and PBKDF2 are slow on purpose; running them inline lets a burst of
+# logins occupy every request worker. Here at most PASSWORD_WORKERS hashes run
+# at once (both libraries release the GIL while hashing), at most
+# PASSWORD_QUEUE_LIMIT more wait, and a caller that cannot get a slot within
+# PASSWORD_QUEUE_TIMEOUT seconds gets PasswordBusy (-> 503 + Retry-After).
+#
+# Schemes: admins use bcrypt, subadmins werkzeug hashes (new ones PBKDF2-SHA256).
+# ``verify_password`` also reports when a stored hash uses weaker parameters
+# than the current ones, so login can store a fresh hash.
+#
+# Limits are per process. Under gunicorn, gunicorn.conf.py sizes them from its
+# worker and thread counts so the machine as a whole runs about one hash per
+# core and a saturated worker still answers 503.
+#
+# Pick costs for this hardware with:
+#   python passwords.py calibrate --target-ms 250
+# or set PASSWORD_TARGET_MS to calibrate once when the server starts (in the
+# gunicorn master, see ``apply_calibration``); every worker uses those costs.
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", os.cpu_count() or 2))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", 32))
+PASSWORD_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_QUEUE_TIMEOUT", 2))
+# Upper bound on one hash, queueing excluded
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+
+# Never calibrate below these
+BCRYPT_MIN_ROUNDS = 10
+PBKDF2_MIN_ITERATIONS = 600000
+
+BCRYPT_ROUNDS = max(int(os.getenv("BCRYPT_ROUNDS", 12)), BCRYPT_MIN_ROUNDS)
+PBKDF2_ITERATIONS = max(int(os.getenv("PBKDF2_ITERATIONS", DEFAULT_PBKDF2_ITERATIONS)), PBKDF2_MIN_ITERATIONS)
+# When set, costs are calibrated to this many milliseconds per hash at server start
+PASSWORD_TARGET_MS = os.getenv("PASSWORD_TARGET_MS")
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE_LIMIT)
+
+
+class PasswordBusy(Exception):
+    """Raised when no hashing slot frees up within PASSWORD_QUEUE_TIMEOUT"""
+
+
+def busy_response():
+    response, status = format_response(False, "Too many sign-in attempts in progress, retry shortly", status=503)
+    response.headers['Retry-After'] = '2'
+    return response, status
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix='password')
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _run(func, *args):
+    if not _slots.acquire(timeout=PASSWORD_QUEUE_TIMEOUT):
+        logger.warning("Password hashing queue is full")
+        raise PasswordBusy()
+    try:
+        future = _get_pool().submit(func, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _f: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        raise PasswordBusy()
+
+
+# ─── Schemes ─────────────────────────────────────────────────────────────────
+
+def _bcrypt_hash(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def _bcrypt_verify(password, stored):
+    ok = bcrypt.checkpw(password.encode('utf-8'), stored.encode('utf-8'))
+    # $2b$12$...: the cost is the second field
+    outdated = ok and int(stored.split('$')[2]) < BCRYPT_ROUNDS
+    return ok, _bcrypt_hash(password) if outdated else None
+
+
+def _werkzeug_hash(password):
+    return generate_password_hash(password, method=f"pbkdf2:sha256:{PBKDF2_ITERATIONS}")
+
+
+def _werkzeug_verify(password, stored):
+    ok = check_password_hash(stored, password)
+    method = stored.split('$', 1)[0].split(':')
+    # scrypt hashes are kept; PBKDF2 ones are upgraded when below the current iterations
+    outdated = ok and method[0] == 'pbkdf2' and (len(method) < 3 or int(method[2]) < PBKDF2_ITERATIONS)
+    return ok, _werkzeug_hash(password) if outdated else None
+
+
+_SCHEMES = {
+    'bcrypt': (_bcrypt_hash, _bcrypt_verify),
+    'werkzeug': (_werkzeug_hash, _werkzeug_verify),
+}
+
+
+def hash_password(password, scheme):
+    """New hash of ``password`` for ``scheme`` ('bcrypt' or 'werkzeug'); may raise PasswordBusy"""
+    return _run(_SCHEMES[scheme][0], password)
+
+
+def verify_password(password, stored, scheme):
+    """
+    Check ``password`` against ``stored``; may raise PasswordBusy.
+
+    Returns (ok, new_hash); ``new_hash`` is set when the password matched but
+    ``stored`` uses outdated parameters and should be replaced.
+    """
+    return _run(_SCHEMES[scheme][1], password, stored)
+
+
+# ─── Calibration ─────────────────────────────────────────────────────────────
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def calibrate(target_ms=250):
+    """bcrypt rounds and PBKDF2 iterations taking about ``target_ms`` per hash here"""
+    rounds = BCRYPT_MIN_ROUNDS
+    cost = _timed(lambda: bcrypt.hashpw(b'calibrate', bcrypt.gensalt(rounds=rounds)))
+    # Each extra round doubles the cost
+    while rounds < 16 and cost * 2 <= target_ms:
+        rounds += 1
+        cost *= 2
+
+    sample = 200000
+    per_iteration = _timed(lambda: generate_password_hash('calibrate', method=f"pbkdf2:sha256:{sample}")) / sample
+    iterations = max(int(target_ms / per_iteration), PBKDF2_MIN_ITERATIONS)
+    return {'BCRYPT_ROUNDS': rounds, 'PBKDF2_ITERATIONS': iterations // 1000 * 1000}
+
+
+def apply_calibration():
+    """
+    Calibrate to PASSWORD_TARGET_MS, if set. Call once per server, before
+    workers start (gunicorn's on_starting hook, or ``python app.py``): the
+    costs are also exported to the environment, so workers forked or started
+    later use the same values instead of measuring under each other's load.
+    """
+    global BCRYPT_ROUNDS, PBKDF2_ITERATIONS
+    if not PASSWORD_TARGET_MS:
+        return
+    costs = calibrate(float(PASSWORD_TARGET_MS))
+    BCRYPT_ROUNDS, PBKDF2_ITERATIONS = costs['BCRYPT_ROUNDS'], costs['PBKDF2_ITERATIONS']
+    os.environ.update({name: str(value) for name, value in costs.items()})
+    logger.info("Password hashing calibrated: %s", costs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pick password hashing costs for this machine")
+    parser.add_argument('command', choices=['calibrate'])
+    parser.add_argument('--target-ms', type=float, default=250)
+    args = parser.parse_args(argv)
+
+    for name, value in calibrate(args.target_ms).items():
+        print(f"{name}={value}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
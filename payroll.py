@@ -0,0 +1,181 @@
+from flask import Blueprint, request, Response, stream_with_context
+import io
+import os
+import logging
+import zipfile
+from concurrent.futures import TimeoutError as FutureTimeout
+from collections import deque
+from datetime import datetime
+
+from db import db
+from utils import format_response
+from settings import get_current_salary_settings
+from salaryslip import render_salary_slip
+from pdf_store import artifact_path, has_pdf, save_pdf
+from render_jobs import RENDER_WORKERS, RenderQueueFull, submit_task
+from employee import build_salary_snapshot, build_payslip_record, payslip_date_str, payslip_pdf_key, payslip_upsert
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+payroll_bp = Blueprint('payroll', __name__, url_prefix='/payroll')
+
+# Payslip records are upserted to Mongo with bulk_write in batches of this size
+PAYROLL_INSERT_BATCH = int(os.getenv("PAYROLL_INSERT_BATCH", 100))
+# Slips a payroll run keeps on the shared render queue at once; the rest of the
+# queue (RENDER_QUEUE_LIMIT) stays available to /jobs renders
+PAYROLL_RENDER_WINDOW = int(os.getenv("PAYROLL_RENDER_WINDOW", RENDER_WORKERS))
+# Seconds a payroll run waits for room on a full render queue before giving up on a slip
+PAYROLL_QUEUE_WAIT = float(os.getenv("PAYROLL_QUEUE_WAIT", 30))
+# Seconds a payroll run waits for one slip's render before reporting it as failed
+PAYROLL_RENDER_TIMEOUT = float(os.getenv("PAYROLL_RENDER_TIMEOUT", 120))
+
+class _ZipStream(io.RawIOBase):
+    """Unseekable sink that lets ZipFile write entries we can yield as they complete"""
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _overrides_by_employee(raw):
+    """Accept overrides either as {employeeId: {...}} or [{employeeId, ...}]"""
+    if isinstance(raw, dict):
+        return raw
+    overrides = {}
+    for item in raw or []:
+        emp_id = item.get('employeeId') or item.get('employee_id')
+        if emp_id:
+            overrides[emp_id] = item
+    return overrides
+
+
+@payroll_bp.route('/run', methods=['POST'])
+def run_payroll():
+    """
+    Generate salary slips for every employee for one month.
+
+    Body: {"month": "MM-YYYY", "employees": {employeeId: {lop, basic, hra, ...}}}
+    Returns a streamed ZIP with one PDF per employee.
+    """
+    data = request.get_json(force=True) or {}
+
+    payslip_month = data.get('month')
+    if not payslip_month:
+        return format_response(False, "Missing required field: month", status=400)
+    try:
+        month_date = datetime.strptime(payslip_month, "%m-%Y")
+    except ValueError:
+        return format_response(False, "Invalid month format. Use MM-YYYY", status=400)
+
+    overrides = _overrides_by_employee(data.get('employees'))
+    year, month = month_date.year, month_date.month
+    date_str = payslip_date_str(year, month)
+
+    # Build every snapshot up front so bad employee records are reported before streaming
+    jobs, errors = [], []
+    for emp in db.employees.find({}, {'_id': 0}):
+        emp_id = emp.get('employeeId')
+        try:
+            final, emp_snapshot = build_salary_snapshot(emp, overrides.get(emp_id, {}))
+        except (KeyError, ValueError, TypeError) as e:
+            errors.append(f"{emp_id}: invalid employee record ({e})")
+            continue
+        jobs.append((emp_id, final, emp_snapshot))
+
+    if not jobs:
+        return format_response(False, "No employees available for payroll run", status=404)
+
+    # Settings are read once for the whole run and shipped to the workers
+    company_settings = get_current_salary_settings()
+
+    def generate():
+        # Rendering is CPU bound, so slips go through the shared render queue
+        # (same admission limit as /jobs), at most PAYROLL_RENDER_WINDOW at a time
+        sink = _ZipStream()
+        records = []
+        # Slips whose inputs match the one already stored for this month are reused, not re-rendered
+        stored = {
+            p['employeeId']: p.get('pdf_key')
+            for p in db.payslips.find({'year': year, 'month': month}, {'_id': 0, 'employeeId': 1, 'pdf_key': 1})
+        }
+        try:
+            with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                in_flight = deque()
+                todo = iter(jobs)
+                while True:
+                    # Top up the window, keeping employee order
+                    while sum(1 for entry in in_flight if entry[4] is not None) < PAYROLL_RENDER_WINDOW:
+                        job = next(todo, None)
+                        if job is None:
+                            break
+                        emp_id, final, emp_snapshot = job
+                        key = payslip_pdf_key(emp_snapshot, date_str, company_settings)
+                        future = None
+                        if not (stored.get(emp_id) == key and has_pdf(key)):
+                            try:
+                                future = submit_task(render_salary_slip, emp_snapshot, date_str, company_settings,
+                                                     timeout=PAYROLL_QUEUE_WAIT)
+                            except RenderQueueFull:
+                                errors.append(f"{emp_id}: render queue full, slip skipped")
+                                continue
+                        in_flight.append((emp_id, final, emp_snapshot, key, future))
+                    if not in_flight:
+                        break
+
+                    emp_id, final, emp_snapshot, key, future = in_flight.popleft()
+                    if future is None:
+                        with open(artifact_path(key), 'rb') as f:
+                            zf.writestr(f"salary_slip_{emp_id}_{month:02d}-{year}.pdf", f.read())
+                        yield sink.drain()
+                        continue
+                    try:
+                        pdf_bytes = future.result(timeout=PAYROLL_RENDER_TIMEOUT)
+                    except FutureTimeout:
+                        logger.error("Payroll render for %s timed out", emp_id)
+                        errors.append(f"{emp_id}: render timed out after {PAYROLL_RENDER_TIMEOUT:g}s")
+                        continue
+                    except Exception as e:
+                        logger.exception("Payroll render failed for %s", emp_id)
+                        errors.append(f"{emp_id}: render failed ({e})")
+                        continue
+
+                    zf.writestr(f"salary_slip_{emp_id}_{month:02d}-{year}.pdf", pdf_bytes)
+                    pdf_key = save_pdf(key, pdf_bytes)
+                    if not pdf_key:
+                        # The payslip is still recorded; viewing it renders and stores the PDF again
+                        errors.append(f"{emp_id}: PDF could not be stored")
+                    # Re-running a month replaces that month's slips instead of adding more
+                    records.append(payslip_upsert(build_payslip_record(emp_id, year, month, final, emp_snapshot, pdf_key)))
+                    if len(records) >= PAYROLL_INSERT_BATCH:
+                        db.payslips.bulk_write(records, ordered=False)
+                        records = []
+                    yield sink.drain()
+
+                if errors:
+                    zf.writestr("errors.txt", "\n".join(errors))
+            yield sink.drain()
+        finally:
+            # Also on a client disconnect (the generator is closed mid-stream):
+            # slips already rendered and stored still get their payslip records
+            if records:
+                db.payslips.bulk_write(records, ordered=False)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="payroll_{month:02d}-{year}.zip"'
+        }
+    )
@@ -0,0 +1,104 @@
+import os
+import logging
+import threading
+from fpdf import FPDF
+
+# Local image assets (logos) decoded once per process and shared by every FPDF
+# generator. Assets are only ever read from disk; rendering never downloads.
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Directories searched, in order, for relative asset names
+ASSET_DIRS = [
+    os.getenv("ASSET_DIR", BASE_DIR),
+    os.path.join(BASE_DIR, 'assets'),
+]
+
+# Logos used by the built-in salary slip and invoice templates
+DEFAULT_ASSETS = [
+    'enoylity-final-logo.png',
+    'logomhd.jpeg',
+    'enoylitytechlogo.png',
+    os.path.join('assets', 'enoylity-final-logo.png'),
+]
+
+_image_cache = {}
+_image_lock = threading.Lock()
+
+
+def resolve_asset(name):
+    """Absolute path of a local asset, or None if it does not exist"""
+    if not name:
+        return None
+    if os.path.isabs(name):
+        return name if os.path.isfile(name) else None
+    for base in ASSET_DIRS:
+        path = os.path.join(base, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def upload_path(name):
+    """Where an uploaded asset called ``name`` is stored"""
+    return os.path.join(ASSET_DIRS[0], os.path.basename(name))
+
+
+def _load_image(path):
+    """Decode an image once (per file version) and keep FPDF's image info."""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    info = _image_cache.get(key)
+    if info is not None:
+        return info
+
+    with _image_lock:
+        info = _image_cache.get(key)
+        if info is None:
+            # Let FPDF do the actual decoding on a throwaway document
+            loader = FPDF()
+            loader.add_page()
+            loader.image(path, x=0, y=0, w=1)
+            info = dict(loader.images[path])
+            info.pop('i', None)
+            # Drop decoded data of older versions of the same file
+            for old in [k for k in _image_cache if k[0] == path]:
+                del _image_cache[old]
+            _image_cache[key] = info
+            logger.info("Decoded image asset %s", path)
+    return info
+
+
+def register_image(pdf, path):
+    """
+    Install a cached decoded image into an FPDF instance so ``pdf.image(path)``
+    skips parsing. Pixel data is shared read-only between documents.
+    """
+    if path in pdf.images:
+        return
+    info = _load_image(path)
+    pdf.images[path] = dict(info, i=len(pdf.images) + 1)
+    if 'smask' in info and pdf.pdf_version < '1.4':
+        # Alpha channels need PDF 1.4, as FPDF's own PNG parser sets
+        pdf.pdf_version = '1.4'
+
+
+def place_image(pdf, path, x=None, y=None, w=0, h=0):
+    """``pdf.image`` through the shared decoded-image cache"""
+    register_image(pdf, path)
+    pdf.image(path, x=x, y=y, w=w, h=h)
+
+
+def warm_assets():
+    """Decode the default logos at startup so the first render does not pay for it."""
+    for name in DEFAULT_ASSETS:
+        path = resolve_asset(name)
+        if path is None:
+            logger.warning("Logo asset %s is missing; documents will render without it", name)
+            continue
+        try:
+            _load_image(path)
+        except Exception as e:
+            logger.error("Could not preload image %s: %s", path, e)
@@ -0,0 +1,82 @@
+import os
+import logging
+import threading
+from fpdf import FPDF
+
+# Process-wide registry of parsed TTF font metrics shared by every FPDF generator
+
+logger = logging.getLogger(__name__)
+
+FONT_FAMILY = 'Lexend'
+
+# Default Lexend faces used by salary slips and invoices (style -> TTF path)
+LEXEND_FONTS = {
+    '':  os.path.join('static', 'Lexend-Regular.ttf'),
+    'B': os.path.join('static', 'Lexend-Bold.ttf'),
+}
+
+_font_cache = {}
+_font_lock = threading.Lock()
+
+
+def _load_font(family, style, path):
+    """Parse a TTF (or its .pkl metrics cache) once and keep FPDF's font entry."""
+    key = (family.lower(), style.upper(), os.path.abspath(path))
+    entry = _font_cache.get(key)
+    if entry is not None:
+        return entry
+
+    with _font_lock:
+        entry = _font_cache.get(key)
+        if entry is None:
+            # Let FPDF do the actual parsing on a throwaway document
+            loader = FPDF()
+            loader.add_font(family, style, path, uni=True)
+            fontkey = family.lower() + style.upper()
+            font = dict(loader.fonts[fontkey])
+            subset = list(font.pop('subset'))
+            font.pop('i', None)
+            entry = {
+                'fontkey': fontkey,
+                'font': font,
+                'subset': subset,
+                'font_files': dict(loader.font_files),
+            }
+            _font_cache[key] = entry
+            logger.info("Loaded font metrics for %s%s from %s", family, style, path)
+    return entry
+
+
+def register_font(pdf, family, style, path):
+    """
+    Install a cached font into an FPDF instance, replacing ``add_font``.
+
+    Character widths and descriptors are shared read-only between documents;
+    only the per-document subset list and font index are created fresh.
+    """
+    entry = _load_font(family, style, path)
+    fontkey = entry['fontkey']
+    if fontkey in pdf.fonts:
+        return
+    pdf.fonts[fontkey] = dict(
+        entry['font'],
+        i=len(pdf.fonts) + 1,
+        subset=list(entry['subset'])
+    )
+    for name, info in entry['font_files'].items():
+        pdf.font_files.setdefault(name, dict(info))
+
+
+def register_lexend(pdf, fonts=None):
+    """Register the Lexend regular/bold faces on ``pdf``."""
+    for style, path in (fonts or LEXEND_FONTS).items():
+        register_font(pdf, FONT_FAMILY, style, path)
+
+
+def warm_fonts():
+    """Load the default Lexend metrics at startup so the first request is not slow."""
+    for style, path in LEXEND_FONTS.items():
+        try:
+            _load_font(FONT_FAMILY, style, path)
+        except Exception as e:
+            logger.error("Could not preload font %s: %s", path, e)
@@ -0,0 +1,56 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+
+# Content-addressed filesystem store for rendered PDFs
+
+logger = logging.getLogger(__name__)
+
+PDF_STORE_DIR = os.getenv("PDF_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdf_store'))
+
+
+def artifact_key(*parts):
+    """
+    Hash the inputs that fully determine a rendered document.
+
+    For payslips this is the employee snapshot, the slip date and the salary
+    settings in effect, so a settings change yields a new key.
+    """
+    canonical = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def artifact_path(key):
+    """Location of an artifact; fanned out by prefix to keep directories small"""
+    return os.path.join(PDF_STORE_DIR, key[:2], f"{key}.pdf")
+
+
+def has_pdf(key):
+    return bool(key) and os.path.isfile(artifact_path(key))
+
+
+def save_pdf(key, pdf_bytes):
+    """
+    Store PDF bytes under ``key`` (atomic, no-op if already present).
+
+    Returns the key, or None if the store is not writable so callers can
+    carry on without a stored artifact.
+    """
+    path = artifact_path(key)
+    if os.path.isfile(path):
+        return key
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error("Could not store PDF artifact %s: %s", key, e)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    return key
@@ -0,0 +1,344 @@
+from flask import Blueprint, g, request, send_file
+import os
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from db import db
+from utils import format_response
+from sessions import signed_url
+from pdf_store import artifact_key, artifact_path, has_pdf, save_pdf
+from pdf_fonts import warm_fonts
+from pdf_assets import warm_assets
+
+# Asynchronous PDF rendering: a bounded process pool plus job status tracking
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+# Worker processes shared by async generate endpoints and payroll runs, per web
+# worker process (gunicorn.conf.py divides the cores between web workers)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 2))
+# Jobs queued or running before new submissions are rejected (backpressure)
+RENDER_QUEUE_LIMIT = int(os.getenv("RENDER_QUEUE_LIMIT", 50))
+# Seconds a finished job stays in the in-process registry
+RENDER_JOB_TTL = int(os.getenv("RENDER_JOB_TTL", 3600))
+# Upper bound for the long-poll ``wait`` parameter
+LONG_POLL_MAX = 30
+# Render processes are started by a forkserver rather than forked from the web
+# worker: its request and pymongo threads may hold a lock (font / letterhead /
+# image caches, logging) at fork time, which would deadlock the child
+RENDER_START_METHOD = os.getenv("RENDER_START_METHOD", "forkserver")
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+# Signalled whenever a queued render finishes and frees room under RENDER_QUEUE_LIMIT
+_room = threading.Condition(_jobs_lock)
+_pending = 0
+_latencies = deque(maxlen=500)
+_counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+
+class RenderQueueFull(Exception):
+    """Raised when the render queue is at RENDER_QUEUE_LIMIT"""
+
+
+def _init_render_process():
+    """Load font metrics and logos once per render process, not per render"""
+    warm_fonts()
+    warm_assets()
+
+
+def get_render_pool():
+    """Lazily create the process pool used for PDF rendering (one per web worker process)"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                # A pool inherited across fork has no management thread in this process
+                _pool = ProcessPoolExecutor(
+                    max_workers=RENDER_WORKERS,
+                    mp_context=multiprocessing.get_context(RENDER_START_METHOD),
+                    initializer=_init_render_process
+                )
+                _pool_pid = pid
+    return _pool
+
+
+def wants_async():
+    """True when the caller asked for async mode (?async=1 or {"async": true})"""
+    flag = request.args.get('async')
+    if flag is None:
+        body = request.get_json(silent=True) or {}
+        flag = body.get('async') if isinstance(body, dict) else None
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+
+def _public(job):
+    """Job fields exposed through the status endpoint"""
+    return {
+        'job_id': job['job_id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'error': job.get('error'),
+        'submitted_at': job['submitted_at'],
+        'finished_at': job.get('finished_at'),
+        'download_url': signed_url(f"/jobs/{job['job_id']}/download") if job['status'] == 'done' else None
+    }
+
+
+def _owner():
+    """Account submitting a job (None when authentication is disabled)"""
+    account = g.get('account')
+    return {'role': account['role'], 'id': account['id']} if account else None
+
+
+def _visible(job):
+    """Admins see every job, other accounts only the jobs they submitted"""
+    account = g.get('account')
+    if not account or account['role'] == 'admin':
+        return True
+    return job.get('owner') == {'role': account['role'], 'id': account['id']}
+
+
+def _evict_expired():
+    cutoff = time.time() - RENDER_JOB_TTL
+    with _jobs_lock:
+        for job_id in [j for j, job in _jobs.items()
+                       if job['status'] in ('done', 'failed') and job['_finished'] < cutoff]:
+            del _jobs[job_id]
+
+
+def _admit(timeout=None):
+    """
+    Count one render against RENDER_QUEUE_LIMIT, waiting up to ``timeout``
+    seconds for room (None: no waiting). Raises RenderQueueFull.
+    """
+    global _pending
+    deadline = time.monotonic() + (timeout or 0)
+    with _room:
+        while _pending >= RENDER_QUEUE_LIMIT:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _counters['rejected'] += 1
+                raise RenderQueueFull()
+            _room.wait(remaining)
+        _pending += 1
+        _counters['submitted'] += 1
+
+
+def _finished(ok, submitted):
+    """Release the queue slot of a render that ended (call with _jobs_lock held)"""
+    global _pending
+    _pending -= 1
+    _counters['completed' if ok else 'failed'] += 1
+    _latencies.append(time.time() - submitted)
+    _room.notify()
+
+
+def _on_done(job_id, future):
+    job = _jobs.get(job_id)
+    if job is None:
+        return
+    update = {'finished_at': datetime.utcnow()}
+    try:
+        pdf_bytes = future.result()
+        pdf_key = save_pdf(artifact_key('job', job_id), pdf_bytes)
+        if not pdf_key:
+            raise OSError("PDF store is not writable")
+        update.update(status='done', pdf_key=pdf_key)
+    except Exception as e:
+        logger.exception("Render job %s failed", job_id)
+        update.update(status='failed', error=str(e))
+
+    with _jobs_lock:
+        _finished(update['status'] == 'done', job['_submitted'])
+        job.update(update)
+        job['_finished'] = time.time()
+    job['_event'].set()
+
+    try:
+        db.render_jobs.update_one({'job_id': job_id}, {'$set': update})
+    except Exception as e:
+        logger.error("Could not persist render job %s: %s", job_id, e)
+
+
+def submit_render(kind, filename, func, *args):
+    """
+    Queue ``func(*args)`` (which must return PDF bytes) on the render pool.
+
+    Raises RenderQueueFull when RENDER_QUEUE_LIMIT jobs are already pending.
+    Returns the job id.
+    """
+    global _pending
+    _evict_expired()
+    _admit()
+
+    job_id = uuid.uuid4().hex
+    job = {
+        'job_id': job_id,
+        'kind': kind,
+        'filename': filename,
+        'owner': _owner(),
+        'status': 'queued',
+        'submitted_at': datetime.utcnow(),
+        '_submitted': time.time(),
+        '_event': threading.Event(),
+    }
+    with _jobs_lock:
+        _jobs[job_id] = job
+
+    # Persist so other web workers can answer status/download requests
+    try:
+        db.render_jobs.insert_one({k: v for k, v in job.items() if not k.startswith('_')})
+    except Exception as e:
+        logger.error("Could not persist render job %s: %s", job_id, e)
+
+    try:
+        future = get_render_pool().submit(func, *args)
+    except Exception:
+        with _room:
+            _pending -= 1
+            _jobs.pop(job_id, None)
+            _room.notify()
+        raise
+    future.add_done_callback(lambda f: _on_done(job_id, f))
+    return job_id
+
+
+def submit_task(func, *args, timeout=None):
+    """
+    Queue ``func(*args)`` on the render pool under the same admission control
+    as render jobs (counted in queue_depth and the stats), without a job record.
+
+    Waits up to ``timeout`` seconds for room under RENDER_QUEUE_LIMIT, then
+    raises RenderQueueFull. Returns the future.
+    """
+    global _pending
+    _admit(timeout)
+    submitted = time.time()
+    try:
+        future = get_render_pool().submit(func, *args)
+    except Exception:
+        with _room:
+            _pending -= 1
+            _room.notify()
+        raise
+
+    def done(f):
+        with _jobs_lock:
+            _finished(not f.cancelled() and f.exception() is None, submitted)
+
+    future.add_done_callback(done)
+    return future
+
+
+def queued_response(job_id):
+    """202 response returned by generate endpoints in async mode"""
+    return format_response(True, "Render job queued", {
+        'job_id': job_id,
+        'status_url': f"/jobs/{job_id}",
+        'download_url': f"/jobs/{job_id}/download"
+    }, status=202)
+
+
+def queue_full_response():
+    response, status = format_response(False, "Render queue is full, retry shortly", status=503)
+    response.headers['Retry-After'] = '5'
+    return response, status
+
+
+def get_job(job_id, wait=0):
+    """
+    Job status, optionally blocking up to ``wait`` seconds for completion.
+    None if the job does not exist or belongs to another account.
+    """
+    job = _jobs.get(job_id)
+    if job is not None:
+        if not _visible(job):
+            return None
+        if wait and job['status'] not in ('done', 'failed'):
+            job['_event'].wait(min(wait, LONG_POLL_MAX))
+        return _public(job)
+
+    # Submitted through another worker process: poll the shared record
+    deadline = time.time() + min(wait, LONG_POLL_MAX)
+    while True:
+        doc = db.render_jobs.find_one({'job_id': job_id}, {'_id': 0})
+        if doc is not None and not _visible(doc):
+            return None
+        if doc is None or doc['status'] in ('done', 'failed') or time.time() >= deadline:
+            return _public(doc) if doc else None
+        time.sleep(0.5)
+
+
+def _job_pdf_key(job_id):
+    job = _jobs.get(job_id)
+    if job is None:
+        job = db.render_jobs.find_one({'job_id': job_id}, {'_id': 0})
+    if job and job.get('status') == 'done' and _visible(job):
+        return job.get('pdf_key'), job.get('filename')
+    return None, None
+
+
+def queue_stats():
+    """Queue depth, worker count, counters and render latency percentiles"""
+    with _jobs_lock:
+        samples = sorted(_latencies)
+        stats = {
+            'queue_depth': _pending,
+            'queue_limit': RENDER_QUEUE_LIMIT,
+            'workers': RENDER_WORKERS,
+            **_counters
+        }
+    if samples:
+        stats['latency_ms'] = {
+            'p50': round(samples[len(samples) // 2] * 1000, 1),
+            'p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+            'max': round(samples[-1] * 1000, 1),
+        }
+    return stats
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def job_status(job_id):
+    try:
+        wait = max(float(request.args.get('wait', 0)), 0)
+    except ValueError:
+        return format_response(False, "wait must be a number of seconds", status=400)
+    job = get_job(job_id, wait)
+    if not job:
+        return format_response(False, "Job not found", status=404)
+    return format_response(True, "Job status retrieved", job)
+
+
+@jobs_bp.route('/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    pdf_key, filename = _job_pdf_key(job_id)
+    if not has_pdf(pdf_key):
+        return format_response(False, "Job result not available", status=404)
+    return send_file(
+        artifact_path(pdf_key),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=filename,
+        conditional=True
+    )
+
+
+@jobs_bp.route('/stats', methods=['GET'])
+def job_stats():
+    return format_response(True, "Render queue statistics", queue_stats())
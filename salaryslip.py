@@ -2,21 +2,28 @@ from flask import Flask, request, jsonify, send_file, Blueprint
 import datetime
 import calendar
 import re
-import requests
 import os
 from dateutil.relativedelta import relativedelta
 import io
 from num2words import num2words
 from utils import format_response
+from render_jobs import (
+    RenderQueueFull, submit_render, wants_async, queued_response, queue_full_response
+)
 
 # Import standard FPDF without extensions
 from fpdf import FPDF
+from pdf_fonts import register_lexend
+from pdf_assets import resolve_asset, place_image, upload_path
+from letterhead import stamp_letterhead
 
 # Import the settings utility function
 from settings import get_current_salary_settings
 
 salary_bp = Blueprint("salaryslip", __name__, url_prefix="/salary")
 
+LOGO_FILENAME = 'enoylity-final-logo.png'
+
 class ImprovedSalarySlipPDF(FPDF):
     """An improved PDF class for better-looking salary slips"""
     def __init__(self, company_info=None):
@@ -27,9 +34,8 @@ class ImprovedSalarySlipPDF(FPDF):
         self.company_info = company_info or {}
         
         # ─── Register Lexend fonts ───────────────────────────────────────────────
-        # Make sure you have placed Lexend-Regular.ttf and Lexend-Bold.ttf under static/fonts/
-        self.add_font('Lexend', '', os.path.join('static', 'Lexend-Regular.ttf'), uni=True)
-        self.add_font('Lexend', 'B', os.path.join('static', 'Lexend-Bold.ttf'), uni=True)
+        # Metrics are parsed once per process and shared by every slip
+        register_lexend(self)
         # Set Lexend as the default throughout
         self.set_font('Lexend', '', 11)
         self.set_auto_page_break(auto=True, margin=15)
@@ -42,22 +48,16 @@ class ImprovedSalarySlipPDF(FPDF):
         self.left_margin = 15
         self.right_margin = 15
         self.set_margins(self.left_margin, 10, self.right_margin)
-        self.logo_path = None
-        logo_url = 'https://www.enoylitystudio.com/wp-content/uploads/2024/02/enoylity-final-logo.png'
-        local_logo = 'enoylity-final-logo.png'
-        if not os.path.isfile(local_logo):
-            try:
-                resp = requests.get(logo_url, timeout=5)
-                resp.raise_for_status()
-                with open(local_logo, 'wb') as f:
-                    f.write(resp.content)
-            except Exception:
-                # if fetch fails, we'll just skip the logo
-                pass
-        if os.path.isfile(local_logo):
-            self.logo_path = local_logo
+        # Logo from local assets only (decoded once per process); skipped if missing
+        self.logo_path = resolve_asset(LOGO_FILENAME)
 
     def header(self):
+        # The letterhead only depends on the company settings and logo, so it is
+        # recorded once per settings version and stamped onto every page
+        stamp_letterhead(self, 'salary slip', {'company_info': self.company_info, 'logo_path': self.logo_path},
+                         self._draw_letterhead)
+
+    def _draw_letterhead(self):
         # Company name from settings - Use company_title if available, otherwise fallback
         company_title = self.company_info.get('company_title', 'ENOYLITY MEDIA CREATIONS')
         
@@ -69,7 +69,7 @@ class ImprovedSalarySlipPDF(FPDF):
         if self.logo_path:
             logo_w = 40  # mm width
             x_pos = self.w - self.right_margin - logo_w
-            self.image(self.logo_path, x=x_pos, y=10, w=logo_w)
+            place_image(self, self.logo_path, x=x_pos, y=10, w=logo_w)
 
         # Rest of your header (line, address, etc.) - using settings data
         self.ln(15)
@@ -344,13 +344,15 @@ class ImprovedSalarySlipPDF(FPDF):
 
 
 class SalarySlipGenerator:
-    def __init__(self, employee_data, current_date=None):
+    def __init__(self, employee_data, current_date=None, company_settings=None):
         self.employee_data = employee_data
         self.salary_details = {}
         self.tax_details = {}
         
-        # Fetch company settings from database
-        self.company_settings = get_current_salary_settings()
+        # Fetch company settings from database unless the caller already has them
+        if company_settings is None:
+            company_settings = get_current_salary_settings()
+        self.company_settings = company_settings
         
         # Set current date
         if current_date:
@@ -588,6 +590,12 @@ class SalarySlipGenerator:
         return pdf_buffer
 
 
+def render_salary_slip(employee_data, current_date=None, company_settings=None):
+    """Render a salary slip and return the raw PDF bytes (safe to run in a worker process)"""
+    generator = SalarySlipGenerator(employee_data, current_date=current_date, company_settings=company_settings)
+    return generator.generate_pdf().getvalue()
+
+
 # Routes remain the same...
 @salary_bp.route('/upload-logo', methods=['POST'])
 def upload_logo():
@@ -600,7 +608,7 @@ def upload_logo():
             return format_response(False, "No logo file selected", status=400)
 
         # Save the logo file
-        logo_file.save('company_logo.png')
+        logo_file.save(upload_path('company_logo.png'))
         return format_response(True, "Logo uploaded successfully")
 
     except Exception as e:
@@ -638,6 +646,19 @@ def generate_salary_slip():
         if not generator.validate_date(employee_data['doj']):
             return format_response(False, "Invalid date format for doj. Use DD-MM-YYYY", status=400)
 
+        filename = f"salary_slip_{employee_data['full_name'].replace(' ', '_')}.pdf"
+
+        # Async mode: render on the worker pool and let the client poll the job
+        if wants_async():
+            try:
+                job_id = submit_render(
+                    'salary_slip', filename, render_salary_slip,
+                    employee_data, payload.get('current_date'), generator.company_settings
+                )
+            except RenderQueueFull:
+                return queue_full_response()
+            return queued_response(job_id)
+
         # Generate PDF buffer
         pdf_buffer = generator.generate_pdf()
 
@@ -646,7 +667,7 @@ def generate_salary_slip():
             pdf_buffer,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=f"salary_slip_{employee_data['full_name'].replace(' ', '_')}.pdf"
+            download_name=filename
         )
 
     except Exception:
@@ -0,0 +1,125 @@
+import re
+import unicodedata
+
+# Indexed search over employees (and subadmins).
+#
+# Every searchable record carries a ``search`` sub-document, maintained on
+# write, with lowercased tokens:
+#   words     whole words (name parts, email parts, phone digits)
+#   prefixes  edge n-grams of each word, from 1 char  -> prefix / autocomplete
+#   grams     every substring of MIN_GRAM..MAX_GRAM   -> substring search
+# ``prefixes`` and ``grams`` have multikey indexes, so a query term is an
+# index seek instead of a case-insensitive regex over the whole collection.
+
+# Shortest / longest substring indexed for infix search
+MIN_GRAM = 2
+MAX_GRAM = 12
+
+# Searchable fields per collection
+EMPLOYEE_SEARCH_FIELDS = ('name', 'email', 'phone', 'employeeId')
+SUBADMIN_SEARCH_FIELDS = ('username', 'employeeId')
+
+# Default / maximum suggestions returned by autocomplete
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX = 25
+
+# Separators: everything but letters, digits and the marks that belong to them
+# (Devanagari vowel signs are marks, not letters, so \W would split words apart)
+_WORD_CATEGORIES = ('L', 'N', 'M')
+
+
+def normalize(text):
+    """Lowercase, strip accents and drop punctuation-only differences"""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    chars = (c if unicodedata.category(c)[0] in _WORD_CATEGORIES else ' ' for c in normalize(text))
+    return ''.join(chars).split()
+
+
+def search_document(record, fields):
+    """The ``search`` sub-document stored alongside ``record``"""
+    words = []
+    for field in fields:
+        value = record.get(field)
+        if value in (None, ''):
+            continue
+        tokens = tokenize(value)
+        words.extend(tokens)
+        if len(tokens) > 1 and field in ('phone', 'employeeId'):
+            # "+91 98765-43210" is also searchable as one number
+            words.append(''.join(tokens))
+
+    words = list(dict.fromkeys(words))
+    prefixes, grams = set(), set()
+    for word in words:
+        prefixes.update(word[:i] for i in range(1, min(len(word), MAX_GRAM) + 1))
+        for start in range(len(word)):
+            for end in range(start + MIN_GRAM, min(len(word), start + MAX_GRAM) + 1):
+                grams.add(word[start:end])
+    return {
+        'text': ' '.join(words),
+        'words': words,
+        'prefixes': sorted(prefixes),
+        'grams': sorted(grams),
+    }
+
+
+def search_query(search, prefix_only=False):
+    """
+    Mongo filter matching every term of ``search`` (None if there are no terms).
+
+    Terms match word prefixes, or any substring when ``prefix_only`` is False.
+    """
+    terms = tokenize(search)
+    if not terms:
+        return None
+    clauses = []
+    for term in terms:
+        key = term[:MAX_GRAM]
+        if prefix_only or len(term) < MIN_GRAM:
+            clauses.append({'search.prefixes': key})
+        else:
+            clauses.append({'search.grams': key})
+        if len(term) > MAX_GRAM:
+            # Seek on the indexed head, confirm the full term on the candidates
+            clauses.append({'search.text': {'$regex': re.escape(term)}})
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def _score(terms):
+    """Relevance: whole word 3, word prefix 2, substring 1 (summed over terms)"""
+    return {'$add': [
+        {'$cond': [{'$in': [t, '$search.words']}, 3,
+                   {'$cond': [{'$in': [t[:MAX_GRAM], '$search.prefixes']}, 2, 1]}]}
+        for t in terms
+    ]}
+
+
+def ranked_pipeline(query, search, sort_field, skip=0, limit=10, projection=None):
+    """Aggregation stages returning matches ordered by relevance, then ``sort_field``"""
+    stages = [
+        {'$match': query},
+        {'$addFields': {'_score': _score(tokenize(search))}},
+        {'$sort': {'_score': -1, sort_field: 1, '_id': 1}},
+        {'$skip': skip},
+        {'$limit': limit},
+    ]
+    inclusive = any(v for k, v in (projection or {}).items() if k != '_id')
+    stages.append({'$project': projection if inclusive else dict(projection or {}, search=0, _score=0)})
+    return stages
+
+
+def ranked_page(collection, query, search, sort_field, skip, limit, projection=None):
+    """One relevance-ordered page plus the total, in a single round trip"""
+    result = next(collection.aggregate([
+        {'$match': query},
+        {'$facet': {
+            'items': ranked_pipeline({}, search, sort_field, skip, limit, projection)[1:],
+            'total': [{'$count': 'n'}],
+        }}
+    ]), None) or {}
+    total = result['total'][0]['n'] if result.get('total') else 0
+    return result.get('items', []), total
@@ -0,0 +1,60 @@
+import os
+import logging
+import threading
+
+from pymongo import ReturnDocument
+
+from db import db
+
+# Sequence numbers (invoice numbers) backed by counter documents in
+# ``invoice_counters`` ({_id: <counter>, sequence_value: <last issued>}).
+#
+# Modes (SEQUENCE_MODE):
+#   strict  (default) one $inc per number: issued in global order, gaps only
+#           when a request fails after taking its number. Invoice numbering
+#           must be gap-free, so keep this unless gaps are acceptable.
+#   block   opt-in: each process leases SEQUENCE_BLOCK_SIZE numbers with one
+#           $inc and hands them out from memory. Numbers are unique across
+#           nodes and increasing within a process, but not ordered by time
+#           across processes, and the unused rest of a lease is skipped when
+#           the process exits (gaps on every worker restart).
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_MODE = os.getenv("SEQUENCE_MODE", "strict")
+SEQUENCE_BLOCK_SIZE = int(os.getenv("SEQUENCE_BLOCK_SIZE", 50))
+
+
+class SequenceAllocator:
+    """Allocator for one counter document"""
+
+    def __init__(self, counter_id, mode=None, block_size=None):
+        self.counter_id = counter_id
+        self.mode = mode or SEQUENCE_MODE
+        self.block_size = block_size or SEQUENCE_BLOCK_SIZE
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def _take(self, n):
+        """Atomically advance the counter by ``n``; returns the first number of the range"""
+        counter = db.invoice_counters.find_one_and_update(
+            {"_id": self.counter_id},
+            {"$inc": {"sequence_value": n}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["sequence_value"] - n + 1
+
+    def next(self):
+        if self.mode != "block":
+            return self._take(1)
+        with self._lock:
+            # A lease inherited from a parent process (pre-fork servers) is not ours
+            if self._pid != os.getpid() or self._next > self._end:
+                start = self._take(self.block_size)
+                self._next, self._end, self._pid = start, start + self.block_size - 1, os.getpid()
+                logger.info("Leased %s numbers %d-%d", self.counter_id, self._next, self._end)
+            value = self._next
+            self._next += 1
+            return value
@@ -0,0 +1,190 @@
+import os
+import time
+import hashlib
+import logging
+import secrets
+import threading
+
+from flask import g, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from db import db
+from utils import format_response
+
+# Signed session tokens and per-route access checks.
+#
+# Login verifies the password once and returns a token (HMAC-signed, carries
+# role, account id and session version). Every other request is checked by
+# ``authenticate`` (a before_request hook): signature + expiry in memory, then
+# the account's session version and permissions from a per-process cache.
+#
+# Cache entries live SESSION_CACHE_TTL seconds. The process that handles a
+# subadmin/admin change drops its entry at once (``invalidate_account``);
+# other processes pick the change up when their entry expires. A password
+# change bumps ``session_version``, which revokes tokens issued before it.
+#
+# Session tokens never go in URLs (they would end up in access logs). Links a
+# browser opens directly (PDFs) carry ``?sig=``: a signature valid for one path
+# and DOWNLOAD_URL_MAX_AGE seconds, checked like a token of the same account.
+
+logger = logging.getLogger(__name__)
+
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+if not SESSION_SECRET:
+    # Tokens then only verify in the process that issued them (or, with the
+    # gunicorn preload, in the workers of the master that generated it)
+    logger.warning("SESSION_SECRET is not set; using a random per-process secret")
+    SESSION_SECRET = secrets.token_hex(32)
+
+# Seconds a token stays valid after login
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", 12 * 3600))
+# Seconds a signed download URL stays valid
+DOWNLOAD_URL_MAX_AGE = int(os.getenv("DOWNLOAD_URL_MAX_AGE", 300))
+# Seconds an account's version / permissions are reused without a DB read
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", 60))
+# AUTH_REQUIRED=0 lets unauthenticated requests through (rollout switch)
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "1") != "0"
+
+# Routes reachable without a token
+PUBLIC_ENDPOINTS = {'static', 'admin.login_combined', 'subadmin.login_subadmin'}
+
+# Routes any signed-in account may use
+ANY_ACCOUNT = 'any'
+
+# Subadmin permission flag (see subadmin.PERMISSIONS) required per route.
+# Admins may use every route; routes not listed here are admin-only.
+ENDPOINT_PERMISSIONS = {
+    'employee.get_record': 'View Employee Details',
+    'employee.get_all_employees': 'View Employee Details',
+    'employee.autocomplete_employees': 'View Employee Details',
+    'employee.add_employee': 'Add Employee Details',
+    'employee.import_employees': 'Add Employee Details',
+    'employee.update_employee': 'Add Employee Details',
+    'employee.get_payslips': 'View payslip details',
+    'employee.view_payslip_pdf': 'View payslip details',
+    'export.export_payslips': 'View payslip details',
+    'employee.get_salary_slip': 'Generate payslip',
+    'salaryslip.generate_salary_slip': 'Generate payslip',
+    'payroll.run_payroll': 'Generate payslip',
+    'invoice.get_invoice_list': 'View Invoice details',
+    'invoiceEnoylity.get_invoice_list': 'View Invoice details',
+    'enoylity.list_invoices': 'View Invoice details',
+    'export.export_invoices': 'View Invoice details',
+    'invoice.generate_invoice_endpoint': 'Generate invoice details',
+    'invoiceEnoylity.generate_invoice_route': 'Generate invoice details',
+    'enoylity.generate_invoice_endpoint': 'Generate invoice details',
+    'settings.list_invoice_settings': ANY_ACCOUNT,
+    'settings.get_invoice_settings': ANY_ACCOUNT,
+    'settings.get_salary_settings': ANY_ACCOUNT,
+    # Render jobs are only visible to the account that submitted them (and admins), see render_jobs.py
+    'jobs.job_status': ANY_ACCOUNT,
+    'jobs.job_download': ANY_ACCOUNT,
+    'jobs.job_stats': ANY_ACCOUNT,
+}
+
+_serializer = URLSafeTimedSerializer(SESSION_SECRET, salt='session',
+                                     signer_kwargs={'digest_method': hashlib.sha256})
+_download_serializer = URLSafeTimedSerializer(SESSION_SECRET, salt='download',
+                                              signer_kwargs={'digest_method': hashlib.sha256})
+
+# (role, account id) -> (session_version, permissions, expires at)
+_account_cache = {}
+_cache_lock = threading.Lock()
+
+_COLLECTIONS = {'admin': ('admin', 'adminId'), 'subadmin': ('subadmin', 'subadminId')}
+
+
+def issue_token(role, account_id, session_version=0):
+    return _serializer.dumps({'role': role, 'id': account_id, 'sv': session_version})
+
+
+def _load(serializer, token, max_age):
+    try:
+        payload = serializer.loads(token, max_age=max_age)
+    except BadSignature:  # includes SignatureExpired
+        return None
+    return payload if isinstance(payload, dict) and payload.get('role') in _COLLECTIONS else None
+
+
+def read_token(token):
+    """Token payload, or None if the token is forged, malformed or expired"""
+    return _load(_serializer, token, SESSION_MAX_AGE)
+
+
+def signed_url(path):
+    """``path`` plus a short-lived signature for the current account, for links opened without headers"""
+    account = g.get('account')
+    if not account:
+        return path
+    sig = _download_serializer.dumps({'role': account['role'], 'id': account['id'], 'sv': account['sv'], 'p': path})
+    return f"{path}?sig={sig}"
+
+
+def read_signed_url(sig, path):
+    """Payload of a download signature for ``path``, or None if forged, expired or for another path"""
+    payload = _load(_download_serializer, sig, DOWNLOAD_URL_MAX_AGE)
+    return payload if payload and payload.get('p') == path else None
+
+
+def account_access(role, account_id):
+    """(session_version, permissions) of an account, cached; None if it no longer exists"""
+    key = (role, account_id)
+    with _cache_lock:
+        entry = _account_cache.get(key)
+    if entry and entry[2] > time.monotonic():
+        return entry[:2]
+
+    collection, id_field = _COLLECTIONS[role]
+    doc = db[collection].find_one({id_field: account_id}, {'_id': 0, 'session_version': 1, 'permissions': 1})
+    if doc is None:
+        invalidate_account(role, account_id)
+        return None
+    access = (doc.get('session_version', 0), doc.get('permissions') or {})
+    with _cache_lock:
+        _account_cache[key] = (*access, time.monotonic() + SESSION_CACHE_TTL)
+    return access
+
+
+def invalidate_account(role=None, account_id=None):
+    """Drop cached access for one account (or all of them)"""
+    with _cache_lock:
+        if role is None:
+            _account_cache.clear()
+        else:
+            _account_cache.pop((role, account_id), None)
+
+
+def _request_payload():
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return read_token(header[7:].strip())
+    # PDF links opened directly in the browser cannot set headers
+    sig = request.args.get('sig')
+    return read_signed_url(sig, request.path) if sig else None
+
+
+def authenticate():
+    """before_request hook: sets ``g.account`` or answers 401 / 403"""
+    g.account = None
+    endpoint = request.endpoint
+    if request.method == 'OPTIONS' or endpoint is None or endpoint in PUBLIC_ENDPOINTS:
+        return None
+
+    payload = _request_payload()
+    access = account_access(payload['role'], payload['id']) if payload else None
+    if access is None or access[0] != payload.get('sv', 0):
+        if not AUTH_REQUIRED:
+            return None
+        return format_response(False, "Authentication required.", None, 401)
+
+    permissions = access[1]
+    g.account = {'role': payload['role'], 'id': payload['id'], 'sv': access[0], 'permissions': permissions}
+    if payload['role'] == 'admin':
+        return None
+
+    required = ENDPOINT_PERMISSIONS.get(endpoint)
+    if required == ANY_ACCOUNT or (required and permissions.get(required)):
+        return None
+    if not AUTH_REQUIRED:
+        return None
+    return format_response(False, "You do not have permission for this action.", None, 403)
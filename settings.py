@@ -7,6 +7,14 @@ import string
 from datetime import datetime
 from pymongo import ReturnDocument
 import importlib
+import copy
+import time
+import logging
+import threading
+from letterhead import clear_letterhead_cache
+from invoice_layout import clear_layout_cache
+
+logger = logging.getLogger(__name__)
 
 # Blueprint setup
 settings_bp = Blueprint("settings", __name__, url_prefix="/settings")
@@ -26,6 +34,67 @@ DEFAULT_SALARY_SLIP_INFO = {
     "address_line2": "Nari Road, Nagpur, Maharashtra, India 440026"
 }
 
+# Seconds a cached settings document is served before its version is re-checked
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", 5))
+
+# (collection, key) -> {'doc', 'version', 'checked'}
+_settings_cache = {}
+_settings_lock = threading.Lock()
+
+
+def _version(doc):
+    """Version stamp of a settings document (bumped by every update/restore)"""
+    return doc.get("version", 0), doc.get("last_updated")
+
+
+def _cached_settings(collection, field, key, create):
+    """
+    Settings document for ``{field: key}`` served from memory.
+
+    Within SETTINGS_CACHE_TTL the cached copy is returned as is; after that a
+    projection-only query compares the version stamp and the full document is
+    re-read only if another node changed it. ``create`` builds the document
+    when none exists yet.
+    """
+    cache_key = (collection, key)
+    now = time.monotonic()
+    with _settings_lock:
+        entry = _settings_cache.get(cache_key)
+    if entry and now - entry['checked'] < SETTINGS_CACHE_TTL:
+        return entry['doc']
+
+    if entry:
+        stamp = db[collection].find_one({field: key}, {"_id": 0, "version": 1, "last_updated": 1})
+        if stamp is not None and _version(stamp) == entry['version']:
+            with _settings_lock:
+                entry['checked'] = now
+            return entry['doc']
+
+    doc = db[collection].find_one({field: key}) or create()
+    with _settings_lock:
+        _settings_cache[cache_key] = {'doc': doc, 'version': _version(doc), 'checked': now}
+    return doc
+
+
+def invalidate_settings(collection=None, key=None):
+    """Drop cached settings (one document, one collection, or everything)"""
+    with _settings_lock:
+        for cache_key in list(_settings_cache):
+            if collection in (None, cache_key[0]) and key in (None, cache_key[1]):
+                del _settings_cache[cache_key]
+
+
+def invalidate_render_caches():
+    """Drop pre-rendered letterheads and compiled layouts after a settings change"""
+    clear_letterhead_cache()
+    clear_layout_cache()
+
+
+def settings_changed(collection, key=None):
+    """Local invalidation after an update/restore (other nodes see the version bump)"""
+    invalidate_settings(collection, key)
+    invalidate_render_caches()
+
 def generate_unique_id():
     """Generate a unique 16-digit ID"""
     return ''.join(random.choices(string.digits, k=16))
@@ -88,10 +157,7 @@ def get_or_create_invoice_settings(invoice_type):
     if invoice_type not in INVOICE_MODULES:
         return None
     
-    # Try to find existing settings
-    settings = db.settings_invoice.find_one({"invoice_type": invoice_type})
-    
-    if not settings:
+    def create():
         # Create new settings
         module_name = INVOICE_MODULES[invoice_type]
         default_info = extract_company_info(module_name)
@@ -101,33 +167,45 @@ def get_or_create_invoice_settings(invoice_type):
             "invoice_type": invoice_type,
             "created_at": datetime.now(),
             "last_updated": datetime.now(),
+            "version": 1,
             "editable_fields": default_info
         }
         
         # Insert into database
         db.settings_invoice.insert_one(settings)
-    
-    return settings
+        return settings
+
+    # Served from the in-process cache (see _cached_settings)
+    return _cached_settings("settings_invoice", "invoice_type", invoice_type, create)
 
 def get_or_create_salary_settings():
     """Get or create settings for salary slip"""
-    # Try to find existing settings
-    settings = db.settings_salary.find_one({"settings_type": "salary_slip"})
-    
-    if not settings:
+    def create():
         # Create new settings
         settings = {
             "settings_id": generate_unique_id(),
             "settings_type": "salary_slip",
             "created_at": datetime.now(),
             "last_updated": datetime.now(),
+            "version": 1,
             "company_info": DEFAULT_SALARY_SLIP_INFO
         }
         
         # Insert into database
         db.settings_salary.insert_one(settings)
-    
-    return settings
+        return settings
+
+    # Served from the in-process cache (see _cached_settings)
+    return _cached_settings("settings_salary", "settings_type", "salary_slip", create)
+
+def warm_settings():
+    """Load every settings document into the cache (pre-fork preload); failures are logged"""
+    try:
+        for invoice_type in INVOICE_MODULES:
+            get_or_create_invoice_settings(invoice_type)
+        get_or_create_salary_settings()
+    except Exception as e:
+        logger.error("Could not preload settings: %s", e)
 
 @settings_bp.route('/getlist', methods=['GET'])
 def list_invoice_settings():
@@ -209,14 +287,15 @@ def update_invoice_settings():
 
     allowed_updates["last_updated"] = datetime.now()
 
-    # Perform update
+    # Perform update (the version bump makes other nodes refresh their cache)
     updated = db.settings_invoice.find_one_and_update(
         {"invoice_type": invoice_type},
-        {"$set": allowed_updates},
+        {"$set": allowed_updates, "$inc": {"version": 1}},
         return_document=ReturnDocument.AFTER
     )
     if not updated:
         return format_response(False, "Failed to update settings", status=500)
+    settings_changed("settings_invoice", invoice_type)
 
     # Convert _id for JSON
     updated["_id"] = str(updated["_id"])
@@ -252,10 +331,11 @@ def restore_default_settings():
         {"$set": {
             "editable_fields": default_info,
             "last_updated": datetime.now()
-        }}
+        }, "$inc": {"version": 1}}
     )
     if result.modified_count == 0:
         return format_response(False, "Failed to restore default settings", status=500)
+    settings_changed("settings_invoice", invoice_type)
 
     updated = db.settings_invoice.find_one({"settings_id": settings_id})
     updated["_id"] = str(updated["_id"])
@@ -267,7 +347,7 @@ def restore_default_settings():
 @settings_bp.route('/salary', methods=['GET'])
 def get_salary_settings():
     """Get salary slip settings"""
-    settings = get_or_create_salary_settings()
+    settings = dict(get_or_create_salary_settings())
     
     # Convert ObjectId to string for JSON serialization
     settings["_id"] = str(settings["_id"])
@@ -307,11 +387,12 @@ def update_salary_settings():
         {"$set": {
             "company_info": updated_info,
             "last_updated": datetime.now()
-        }}
+        }, "$inc": {"version": 1}}
     )
 
     if result.modified_count == 0:
         return format_response(False, "No changes made to settings", status=400)
+    settings_changed("settings_salary")
 
     updated = db.settings_salary.find_one({"settings_id": settings_id})
     updated["_id"] = str(updated.get("_id"))  # convert _id to string if exists
@@ -329,11 +410,12 @@ def restore_salary_settings():
         {"$set": {
             "company_info": DEFAULT_SALARY_SLIP_INFO,
             "last_updated": datetime.now()
-        }}
+        }, "$inc": {"version": 1}}
     )
     
     if result.modified_count == 0 and result.matched_count == 0:
         return format_response(False, "Failed to restore default salary slip settings", status=500)
+    settings_changed("settings_salary")
     
     # Get updated settings
     updated = db.settings_salary.find_one({"settings_type": "salary_slip"})
@@ -347,7 +429,8 @@ def get_current_settings(invoice_type):
     """Get current settings for invoice generation"""
     settings = get_or_create_invoice_settings(invoice_type)
     if settings:
-        return settings.get("editable_fields", {})
+        # Callers merge into this; keep the cached document untouched
+        return copy.deepcopy(settings.get("editable_fields", {}))
     return {}
 
 
@@ -355,5 +438,5 @@ def get_current_salary_settings():
     """Get current settings for salary slip generation"""
     settings = get_or_create_salary_settings()
     if settings:
-        return settings.get("company_info", DEFAULT_SALARY_SLIP_INFO)
+        return copy.deepcopy(settings.get("company_info", DEFAULT_SALARY_SLIP_INFO))
     return DEFAULT_SALARY_SLIP_INFO
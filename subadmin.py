@@ -1,9 +1,13 @@
 import re
 import uuid
 from flask import Blueprint, request
-from werkzeug.security import generate_password_hash, check_password_hash
 from db import db  # MongoDB connection for employees, subadmin, admin collections
 from utils import format_response
+from credentials import login_key
+from sessions import invalidate_account, issue_token
+from passwords import PasswordBusy, busy_response, hash_password, verify_password
+from search import SUBADMIN_SEARCH_FIELDS, search_document, search_query, ranked_page
+from pagination import ID_ORDER, InvalidCursor, keyset_page, page_with_total, wants_cursor
 
 # Blueprint for subadmin routes
 subadmin_bp = Blueprint('subadmin', __name__, url_prefix='/subadmin')
@@ -21,6 +25,9 @@ PERMISSIONS = {
 # Password complexity: uppercase, lowercase, digit, special char, min length 8
 PASSWORD_REGEX = re.compile(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[^A-Za-z0-9]).{8,}$')
 
+# Fields hidden from subadmin listings
+LIST_PROJECTION = {'_id': 0, 'password_hash': 0, 'search': 0, 'login_key': 0, 'session_version': 0}
+
 
 @subadmin_bp.route('/register', methods=['POST'])
 def register_subadmin():
@@ -53,25 +60,30 @@ def register_subadmin():
                                    'Subadmin credentials already exist for this employee, please login',
                                    status=409)
 
-        if db.subadmin.find_one({'username': username}):
+        if db.subadmin.find_one({'login_key': login_key(username)}):
             return format_response(False, 'Username already taken', status=409)
 
-        pw_hash = generate_password_hash(password)
+        pw_hash = hash_password(password, 'werkzeug')
         permission_flags = { key: int(bool(perms.get(key))) for key in PERMISSIONS.keys() }
         subadmin_id = str(uuid.uuid4())
 
-        db.subadmin.insert_one({
+        record = {
             'subadminId': subadmin_id,
             'employeeId': employee_id,
             'username': username,
+            'login_key': login_key(username),
             'password_hash': pw_hash,
             'permissions': permission_flags
-        })
+        }
+        record['search'] = search_document(record, SUBADMIN_SEARCH_FIELDS)
+        db.subadmin.insert_one(record)
 
         return format_response(True,
                                'Subadmin registered successfully',
                                data={'subadminId': subadmin_id})
 
+    except PasswordBusy:
+        return busy_response()
     except Exception:
         return format_response(False, 'Internal server error', status=500)
 
@@ -94,9 +106,11 @@ def update_subadmin():
 
         if 'username' in updates:
             new_username = updates['username']
-            if db.subadmin.find_one({'username': new_username, 'subadminId': {'$ne': subadmin_id}}):
+            if db.subadmin.find_one({'login_key': login_key(new_username), 'subadminId': {'$ne': subadmin_id}}):
                 return format_response(False, 'Username already in use', status=409)
             update_fields['username'] = new_username
+            update_fields['login_key'] = login_key(new_username)
+            update_fields['search'] = search_document({**existing, 'username': new_username}, SUBADMIN_SEARCH_FIELDS)
 
         if 'password' in updates:
             new_password = updates['password']
@@ -104,7 +118,7 @@ def update_subadmin():
                 return format_response(False,
                                        'Password must be at least 8 chars and include uppercase, lowercase, number, special char',
                                        status=400)
-            update_fields['password_hash'] = generate_password_hash(new_password)
+            update_fields['password_hash'] = hash_password(new_password, 'werkzeug')
 
         if 'permissions' in updates:
             perms = updates['permissions']
@@ -113,9 +127,17 @@ def update_subadmin():
         if not update_fields:
             return format_response(False, 'No valid fields to update', status=400)
 
-        db.subadmin.update_one({'subadminId': subadmin_id}, {'$set': update_fields})
+        update = {'$set': update_fields}
+        if 'password_hash' in update_fields:
+            # New password: tokens issued before it stop working
+            update['$inc'] = {'session_version': 1}
+        db.subadmin.update_one({'subadminId': subadmin_id}, update)
+        # Permission changes apply to this subadmin's next request
+        invalidate_account('subadmin', subadmin_id)
         return format_response(True, 'Subadmin updated successfully')
 
+    except PasswordBusy:
+        return busy_response()
     except Exception:
         return format_response(False, 'Internal server error', status=500)
 
@@ -132,6 +154,7 @@ def delete_subadmin():
         result = db.subadmin.delete_one({'subadminId': subadmin_id})
         if result.deleted_count == 0:
             return format_response(False, 'Subadmin not found', status=404)
+        invalidate_account('subadmin', subadmin_id)
 
         return format_response(True, 'Subadmin deleted successfully')
 
@@ -147,19 +170,32 @@ def get_subadmin_list():
         page_size = int(data.get('pageSize', 10))
         search = (data.get('search') or '').strip()
 
-        query = {}
+        # Token index lookup (see search.py) instead of a case-insensitive regex scan
+        query = (search_query(search) or {'_id': None}) if search else {}
+
+        if wants_cursor(data):
+            try:
+                subadmins, next_cursor, has_more = keyset_page(
+                    db.subadmin, query, ID_ORDER, page_size, data.get('cursor'), LIST_PROJECTION
+                )
+            except InvalidCursor:
+                return format_response(False, 'Invalid cursor', status=400)
+            payload = {
+                'subadmins': subadmins,
+                'pageSize': page_size,
+                'next_cursor': next_cursor,
+                'has_more': has_more
+            }
+            return format_response(True, 'Subadmin list retrieved successfully', data=payload)
+
         if search:
-            query['$or'] = [
-                {'username': {'$regex': search, '$options': 'i'}},
-                {'employeeId': {'$regex': search, '$options': 'i'}}
-            ]
-
-        total = db.subadmin.count_documents(query)
-        subadmins = list(
-            db.subadmin.find(query, {'_id': 0, 'password_hash': 0})
-                       .skip((page - 1) * page_size)
-                       .limit(page_size)
-        )
+            subadmins, total = ranked_page(
+                db.subadmin, query, search, 'username', (page - 1) * page_size, page_size, LIST_PROJECTION
+            )
+        else:
+            subadmins, total = page_with_total(
+                db.subadmin, query, ID_ORDER, (page - 1) * page_size, page_size, LIST_PROJECTION
+            )
 
         payload = {
             'subadmins': subadmins,
@@ -183,15 +219,25 @@ def login_subadmin():
         if not all([username, password]):
             return format_response(False, 'Missing username or password', status=400)
 
-        user = db.subadmin.find_one({'username': username})
-        if not user or not check_password_hash(user['password_hash'], password):
+        user = db.subadmin.find_one({'login_key': login_key(username)},
+                                    {'subadminId': 1, 'password_hash': 1, 'permissions': 1, 'session_version': 1})
+        if not user:
+            return format_response(False, 'Invalid credentials', status=401)
+        ok, new_hash = verify_password(password, user['password_hash'], 'werkzeug')
+        if not ok:
             return format_response(False, 'Invalid credentials', status=401)
+        if new_hash:
+            # Stored with older hashing parameters: upgrade while we have the password
+            db.subadmin.update_one({'_id': user['_id']}, {'$set': {'password_hash': new_hash}})
 
         resp = {
             'role': 'subadmin',
-            'permissions': user.get('permissions', {})
+            'permissions': user.get('permissions', {}),
+            'token': issue_token('subadmin', user['subadminId'], user.get('session_version', 0))
         }
         return format_response(True, 'Login successful', data=resp)
 
+    except PasswordBusy:
+        return busy_response()
     except Exception:
         return format_response(False, 'Internal server error', status=500)
@@ -0,0 +1,25 @@
+import os
+
+from dotenv import load_dotenv
+
+# Production WSGI entry point:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# With ``preload_app`` (the default in gunicorn.conf.py) this module is
+# imported once in the master: fonts, logos and settings are loaded here and
+# shared copy-on-write by the forked workers. Database clients, render pools
+# and password pools are created per worker process after fork.
+
+load_dotenv()
+
+# Tokens must verify in every worker and survive restarts, so the signing key
+# has to come from the environment (sessions.py only falls back to a random
+# per-process key for local development)
+if not os.getenv("SESSION_SECRET"):
+    raise RuntimeError("SESSION_SECRET must be set to run the production server")
+
+from app import create_app, preload  # noqa: E402
+
+app = create_app()
+preload(settings=True)